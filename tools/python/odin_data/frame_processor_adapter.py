@@ -3,11 +3,14 @@ Created on 6th September 2017
 
 :author: Alan Greer
 """
+import functools
 import json
 import logging
 import os
+import time
 from odin_data.ipc_tornado_client import IpcTornadoClient
-from odin_data.util import remove_prefix, remove_suffix
+from odin_data.ipc_message import IpcMessageException
+from odin_data.util import remove_prefix, remove_suffix, etag_matches, not_modified_response
 from odin_data.odin_data_adapter import OdinDataAdapter
 from odin.adapters.adapter import ApiAdapter, ApiAdapterResponse, request_types, response_types
 from tornado import escape
@@ -47,6 +50,29 @@ class FrameProcessorAdapter(OdinDataAdapter):
             'config/hdf/frames': 0
         }
         self._command = 'config/hdf/write'
+        # Staging area for the acquisition that follows the current one
+        self._next_param = {
+            'config/next/hdf/acquisition_id': '',
+            'config/next/hdf/file/path': '',
+            'config/next/hdf/file/name': '',
+            'config/next/hdf/file/extension': 'h5',
+            'config/next/hdf/frames': 0
+        }
+        self._next_command = 'config/next/stage'
+        self._next_clear_command = 'config/next/clear'
+        self._stage_count = 0
+        self._status['status/next_acquisition'] = {
+            'state': 'empty',
+            'acquisition_id': '',
+            'error': ''
+        }
+        self._acquisition_start_count = 0
+        self._status['status/acquisition_start'] = {
+            'state': 'idle',
+            'acquisition_id': '',
+            'latency': 0.0,
+            'clients': []
+        }
         self.setup_rank()
 
     @request_types('application/json', 'application/vnd.odin-native')
@@ -72,8 +98,15 @@ class FrameProcessorAdapter(OdinDataAdapter):
         #
         # When this arrives write all params into a single IPC message
         # config/hdf/write
-        if path in self._param:
-            response['value'] = self._param[path]
+        if path in self._param or path in self._next_param:
+            etag = self.parameter_etag(path)
+            if etag_matches(request, etag):
+                return ApiAdapterResponse(not_modified_response(etag), status_code=status_code)
+            if path in self._param:
+                response['value'] = self._param[path]
+            else:
+                response['value'] = self._next_param[path]
+            response['etag'] = etag
         else:
             return super(FrameProcessorAdapter, self).get(path, request)
 
@@ -114,6 +147,20 @@ class FrameProcessorAdapter(OdinDataAdapter):
                     self._param[path] = str(escape.url_unescape(request.body)).replace('"', '')
                 # Merge with the configuration store
 
+            elif path in self._next_param:
+                value = str(escape.url_unescape(request.body)).replace('"', '')
+                logging.debug("Setting {} to {}".format(path, value))
+                if path == 'config/next/hdf/frames':
+                    self._next_param[path] = int(value)
+                else:
+                    self._next_param[path] = value
+
+            elif path == self._next_command:
+                response, status_code = self.stage_next_acquisition()
+
+            elif path == self._next_clear_command:
+                response, status_code = self.clear_next_acquisition()
+
             elif path == self._command:
                 write = bool_from_string(str(escape.url_unescape(request.body)))
                 config = {'hdf': {'write': write}}
@@ -127,34 +174,16 @@ class FrameProcessorAdapter(OdinDataAdapter):
                     if str(self._param['config/hdf/file/name']) == '':
                         raise RuntimeError("File name must not be empty")
 
-                    # First setup the rank for the frameProcessor applications
-                    self.setup_rank()
-                    rank = 0
+                    # A staged acquisition that has not been started by the clients is started now
+                    if self._status['status/next_acquisition']['state'] == 'staged':
+                        self.promote_next_acquisition()
+
+                    # Setup and start the acquisition on all clients at once
+                    response, status_code = self.start_acquisition()
+                else:
                     for client in self._clients:
-                        # Send the configuration required to setup the acquisition
-                        # The file path is the same for all clients
-                        parameters = {
-                            'hdf': {
-                                'frames': self._param['config/hdf/frames']
-                            }
-                        }
-                        # Send the number of frames first
-                        client.send_configuration(parameters)
-                        parameters = {
-                            'hdf': {
-                                'acquisition_id': self._param['config/hdf/acquisition_id'],
-                                'file': {
-                                    'path': str(self._param['config/hdf/file/path']),
-                                    'name': str(self._param['config/hdf/file/name']),
-                                    'extension': str(self._param['config/hdf/file/extension'])
-                                }
-                            }
-                        }
-                        client.send_configuration(parameters)
-                        rank += 1
-                for client in self._clients:
-                    # Send the configuration required to start the acquisition
-                    client.send_configuration(config)
+                        # Send the configuration required to stop the acquisition
+                        client.send_configuration(config)
 
             else:
                 return super(FrameProcessorAdapter, self).put(path, request)
@@ -164,15 +193,276 @@ class FrameProcessorAdapter(OdinDataAdapter):
             self.set_error(str(ex))
             status_code = 503
             response = {'error': str(ex)}
+        finally:
+            self._versions.bump()
 
         return ApiAdapterResponse(response, status_code=status_code)
 
+    def process_batch_configuration(self, items):
+        # Store any of the locally held acquisition parameters, passing the rest on to the clients
+        results = {}
+        remaining = {}
+        for path, value in items.items():
+            local_path = 'config/' + remove_prefix(path.strip('/'), 'config/')
+            if local_path in self._param:
+                try:
+                    if local_path == 'config/hdf/frames':
+                        self._param[local_path] = int(value)
+                    else:
+                        self._param[local_path] = str(value)
+                    results[path] = 'ok'
+                except (TypeError, ValueError) as ex:
+                    results[path] = str(ex)
+            elif local_path == self._command:
+                results[path] = 'Cannot set {} in a batch request'.format(self._command)
+            else:
+                remaining[path] = value
+
+        response, status_code = super(FrameProcessorAdapter, self).process_batch_configuration(remaining)
+        response['results'].update(results)
+        errors = [result for result in results.values() if result != 'ok']
+        if errors and status_code == 200:
+            status_code = 503
+            response['error'] = errors[0]
+            self.set_error(errors[0])
+        return response, status_code
+
     def require_version_check(self, param):
         # If the parameter is in the version check list then request a version update
         if param in self.VERSION_CHECK_CONFIG_ITEMS:
             return True
         return False
 
+    def client_active(self, index):
+        # A client that is writing is always active, even if its status has not changed
+        active = super(FrameProcessorAdapter, self).client_active(index)
+        writing = self.traverse_parameters(self._clients[index].parameters, ['status', 'hdf', 'writing'])
+        return active or bool(writing)
+
+    def stage_next_acquisition(self):
+        """Validate the staged acquisition and deliver it to the clients ahead of time.
+
+        The file writer holds the delivered settings for its next acquisition while the current
+        one is running and starts it as soon as the current acquisition completes.  The staged
+        settings become the current adapter settings once the clients report that it has
+        started, see process_updates.
+
+        :return: tuple of response dict and status code
+        :raises RuntimeError: if the staged acquisition is invalid
+        """
+        next_status = {
+            'state': 'empty',
+            'acquisition_id': self._next_param['config/next/hdf/acquisition_id'],
+            'error': ''
+        }
+        self._status['status/next_acquisition'] = next_status
+        self._stage_count += 1
+
+        error = self.validate_next_acquisition()
+        if error:
+            next_status['state'] = 'failed'
+            next_status['error'] = error
+            raise RuntimeError(error)
+
+        parameters = {
+            'hdf': {
+                'frames': self._next_param['config/next/hdf/frames'],
+                'acquisition_id': self._next_param['config/next/hdf/acquisition_id'],
+                'file': {
+                    'path': str(self._next_param['config/next/hdf/file/path']),
+                    'name': str(self._next_param['config/next/hdf/file/name']),
+                    'extension': str(self._next_param['config/next/hdf/file/extension'])
+                }
+            }
+        }
+        next_status['state'] = 'delivering'
+        next_status['pending'] = len(self._clients)
+        reply_futures = []
+        response, status_code = self.send_to_clients(None, parameters, reply_futures=reply_futures)
+        if status_code != 200:
+            next_status['state'] = 'failed'
+            next_status['error'] = response.get('error', OdinDataAdapter.ERROR_FAILED_TO_SEND)
+            return response, status_code
+
+        for (index, future) in reply_futures:
+            future.add_done_callback(functools.partial(self._stage_reply, self._stage_count))
+        return response, status_code
+
+    def validate_next_acquisition(self):
+        """Check the staged acquisition can be started automatically by the file writer.
+
+        :return: error message, or an empty string if the staged acquisition is valid
+        """
+        acquisition_id = self._next_param['config/next/hdf/acquisition_id']
+        file_path = str(self._next_param['config/next/hdf/file/path'])
+        file_name = str(self._next_param['config/next/hdf/file/name'])
+        if acquisition_id == '':
+            return "Acquisition ID must not be empty for the next acquisition"
+        if not os.path.isdir(file_path):
+            return "Invalid path specified for the next acquisition [{}]".format(file_path)
+        if file_name == '':
+            return "File name must not be empty for the next acquisition"
+        # The file writer does not restart into an identical file or acquisition
+        if file_path == str(self._param['config/hdf/file/path']):
+            if file_name == str(self._param['config/hdf/file/name']):
+                return "Next acquisition must not use the same file as the current one"
+            if acquisition_id == self._param['config/hdf/acquisition_id']:
+                return "Next acquisition must not use the same acquisition ID as the current one"
+        return ''
+
+    def _stage_reply(self, stage_count, future):
+        if stage_count != self._stage_count:
+            # The staged acquisition has since been replaced
+            return
+        next_status = self._status['status/next_acquisition']
+        try:
+            future.result()
+        except IpcMessageException as err:
+            next_status['error'] = str(err)
+        next_status['pending'] -= 1
+        if next_status['pending'] == 0 and next_status['state'] == 'delivering':
+            if next_status['error']:
+                next_status['state'] = 'failed'
+                self.set_error("Failed to stage next acquisition: {}".format(next_status['error']))
+            else:
+                next_status['state'] = 'staged'
+        self._versions.bump('status')
+
+    def clear_next_acquisition(self):
+        """Clear the staged acquisition so that the clients do not start it automatically.
+
+        :return: tuple of response dict and status code
+        """
+        self._stage_count += 1
+        self._status['status/next_acquisition'] = {'state': 'empty', 'acquisition_id': '', 'error': ''}
+        parameters = {'hdf': {'acquisition_id': '', 'file': {'name': ''}}}
+        return self.send_to_clients(None, parameters)
+
+    def promote_next_acquisition(self):
+        """Make the staged acquisition settings the current ones."""
+        for path in self._next_param:
+            self._param[path.replace('config/next/', 'config/', 1)] = self._next_param[path]
+        self._stage_count += 1
+        next_status = self._status['status/next_acquisition']
+        next_status['state'] = 'active'
+        next_status.pop('pending', None)
+        self._versions.bump()
+
+    def process_updates(self):
+        # Promote the staged acquisition once any client reports that it has started it
+        next_status = self._status['status/next_acquisition']
+        if next_status['state'] in ('delivering', 'staged'):
+            for client in self._clients:
+                acquisition_id = self.traverse_parameters(client.parameters,
+                                                          ['status', 'hdf', 'acquisition_id'])
+                writing = self.traverse_parameters(client.parameters, ['status', 'hdf', 'writing'])
+                if writing and acquisition_id == next_status['acquisition_id']:
+                    logging.info("Next acquisition %s has started", acquisition_id)
+                    self.promote_next_acquisition()
+                    break
+
+    def acquisition_parameters(self, rank):
+        """Build the configuration to setup and start an acquisition on a single client.
+
+        :param rank: rank of the client
+        :return: configuration dict for the client
+        """
+        return {
+            'hdf': {
+                'process': {
+                    'number': len(self._clients),
+                    'rank': rank
+                },
+                'frames': self._param['config/hdf/frames'],
+                'acquisition_id': self._param['config/hdf/acquisition_id'],
+                'file': {
+                    'path': str(self._param['config/hdf/file/path']),
+                    'name': str(self._param['config/hdf/file/name']),
+                    'extension': str(self._param['config/hdf/file/extension'])
+                },
+                'write': True
+            }
+        }
+
+    def start_acquisition(self):
+        """Setup and start an acquisition on all clients in a single transaction.
+
+        Each client is sent one configure message containing its rank, the frame count, the
+        file and acquisition settings and finally the write command, which the file writer
+        applies in that order.  The messages are sent to all clients without waiting, and
+        status/acquisition_start becomes ready once every client has acknowledged its message,
+        reporting the start up latency of each client.
+
+        The adapter is synchronous, so the PUT cannot wait for the replies without blocking the
+        IOLoop that receives them.  The response instead reports the acquisition start as pending
+        and the caller polls status/acquisition_start, which is failed if any client NACKs or
+        does not reply within the configuration acknowledgement timeout.
+
+        :return: tuple of response dict and status code for sending the messages
+        """
+        status_code = 200
+        response = {}
+        start_time = time.time()
+        self._acquisition_start_count += 1
+        start_status = {
+            'state': 'pending',
+            'acquisition_id': self._param['config/hdf/acquisition_id'],
+            'latency': 0.0,
+            'clients': [{'state': 'pending', 'latency': 0.0, 'error': ''} for _ in self._clients]
+        }
+        self._status['status/acquisition_start'] = start_status
+
+        for rank in range(len(self._clients)):
+            reply_futures = []
+            try:
+                self.send_client_configuration(rank, self.acquisition_parameters(rank),
+                                               reply_futures=reply_futures)
+            except Exception as err:
+                logging.debug(OdinDataAdapter.ERROR_FAILED_TO_SEND)
+                logging.error("Error: %s", err)
+                status_code = 503
+                response = {'error': OdinDataAdapter.ERROR_FAILED_TO_SEND}
+                start_status['clients'][rank]['state'] = 'failed'
+                start_status['clients'][rank]['error'] = str(err)
+            for (index, future) in reply_futures:
+                future.add_done_callback(functools.partial(
+                    self._acquisition_start_reply, self._acquisition_start_count, index, start_time
+                ))
+
+        self._update_acquisition_start(start_status)
+        if status_code == 200:
+            response = {'acquisition_start': start_status['state'],
+                        'acquisition_id': start_status['acquisition_id']}
+        return response, status_code
+
+    def _acquisition_start_reply(self, start_count, index, start_time, future):
+        if start_count != self._acquisition_start_count:
+            # A newer acquisition start has superseded this one
+            return
+        start_status = self._status['status/acquisition_start']
+        client_status = start_status['clients'][index]
+        client_status['latency'] = time.time() - start_time
+        try:
+            future.result()
+            client_status['state'] = 'ready'
+        except IpcMessageException as err:
+            client_status['state'] = 'failed'
+            client_status['error'] = str(err)
+            self.set_error("Client {} failed to start acquisition: {}".format(index, err))
+        self._update_acquisition_start(start_status)
+
+    def _update_acquisition_start(self, start_status):
+        # Complete the transaction once every client has replied
+        states = [client['state'] for client in start_status['clients']]
+        if 'pending' not in states:
+            if 'failed' in states:
+                start_status['state'] = 'failed'
+            else:
+                start_status['state'] = 'ready'
+            start_status['latency'] = max([client['latency'] for client in start_status['clients']] + [0.0])
+            logging.debug("Acquisition start %s in %.3fs", start_status['state'], start_status['latency'])
+        self._versions.bump('status')
+
     def setup_rank(self):
         # Attempt initialisation of the connected clients
         processes = len(self._clients)
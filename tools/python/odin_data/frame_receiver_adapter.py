@@ -4,7 +4,9 @@ Created on 2nd August 2018
 :author: Alan Greer
 """
 import copy
+import functools
 import logging
+from odin_data.ipc_message import IpcMessageException
 from odin_data.odin_data_adapter import OdinDataAdapter
 from odin_data.util import remove_prefix, remove_suffix
 
@@ -29,8 +31,14 @@ class FrameReceiverAdapter(OdinDataAdapter):
         super(FrameReceiverAdapter, self).__init__(**kwargs)
 
         self._decoder_config = []
+        # Record of the decoder config last acknowledged by each client
+        self._sent_decoder_config = []
+        # Count of the invalidations of each record, so replies to earlier messages are ignored
+        self._sent_decoder_count = []
         for ep in self._endpoints:
             self._decoder_config.append(None)
+            self._sent_decoder_config.append(None)
+            self._sent_decoder_count.append(0)
 
     def require_version_check(self, param):
         # If the parameter is in the version check list then request a version update
@@ -38,64 +46,185 @@ class FrameReceiverAdapter(OdinDataAdapter):
             return True
         return False
 
-    def send_to_clients(self, request_command, parameters, client_index=-1):
+    def process_reconnection(self, client):
+        # A restarted client has lost its decoder so the full config must be sent again
+        self.clear_sent_decoder_config(client)
+        super(FrameReceiverAdapter, self).process_reconnection(client)
+
+    def push_configuration(self, messages, client_index=-1, source=''):
+        # A configuration file may also set up the decoder, so the sent record is no longer valid
+        if client_index == -1:
+            for index in range(len(self._sent_decoder_config)):
+                self.clear_sent_decoder_config(index)
+        else:
+            self.clear_sent_decoder_config(client_index)
+        return super(FrameReceiverAdapter, self).push_configuration(messages, client_index, source)
+
+    def clear_sent_decoder_config(self, client_index):
+        """
+        Forget the decoder config acknowledged by a client, so that it is sent again in full.
+
+        :param client_index: index of the client
+        """
+        self._sent_decoder_config[client_index] = None
+        self._sent_decoder_count[client_index] += 1
+
+    def send_client_configuration(self, client_index, parameters, command=None, reply_futures=None):
+        """
+        Send a configuration message to a single client, tracking the reply to any decoder config.
+
+        The decoder config is only recorded as sent once the client has acknowledged it, so a
+        decoder config that is rejected or lost is sent again with the next request.
+
+        :param client_index: index of the client to send to
+        :param parameters: configuration parameters to send
+        :param command: optional parameter name to send the parameters under
+        :param reply_futures: if a list is given the reply is tracked and a tuple of the client
+            index and reply future is appended to it
+        """
+        decoder_config = None
+        if command == 'decoder_config':
+            decoder_config = parameters
+        elif command is None and 'decoder_config' in parameters:
+            decoder_config = parameters['decoder_config']
+        if decoder_config is None:
+            return super(FrameReceiverAdapter, self).send_client_configuration(client_index, parameters, command,
+                                                                               reply_futures)
+
+        futures = []
+        super(FrameReceiverAdapter, self).send_client_configuration(client_index, parameters, command, futures)
+        for (index, future) in futures:
+            future.add_done_callback(functools.partial(
+                self._decoder_config_reply, index, copy.deepcopy(decoder_config), self._sent_decoder_count[index]
+            ))
+        if reply_futures is not None:
+            reply_futures.extend(futures)
+
+    def _decoder_config_reply(self, client_index, decoder_config, sent_count, future):
+        if sent_count != self._sent_decoder_count[client_index]:
+            # The record has been invalidated since the message was sent
+            return
+        try:
+            future.result()
+            self._sent_decoder_config[client_index] = decoder_config
+        except IpcMessageException as err:
+            logging.error("Client %d did not apply decoder config: %s", client_index, err)
+            self.clear_sent_decoder_config(client_index)
+
+    def merge_decoder_config(self, client_index, decoder_config):
+        """
+        Merge decoder config items into the accumulated decoder config of a client.
+
+        :param client_index: index of the client
+        :param decoder_config: dictionary of decoder config items
+        """
+        if self._decoder_config[client_index] is None:
+            self._decoder_config[client_index] = copy.deepcopy(decoder_config)
+        else:
+            for item in decoder_config:
+                self._decoder_config[client_index][item] = copy.deepcopy(decoder_config[item])
+
+    def client_parameters(self, client_index, command, parameters):
+        """
+        Construct the parameters to send to a single client.
+
+        The full decoder config is inserted only if it differs from the decoder config last
+        acknowledged by the client, otherwise the decoder config is removed so that the Frame Receiver does not
+        tear down and re-initialise an unchanged decoder.
+
+        :param client_index: index of the client
+        :param command: top level command of the request
+        :param parameters: parameters of the request
+        :return: parameters to send, empty if there is nothing to send
+        """
+        decoder_config = self._decoder_config[client_index]
+        if command == 'decoder_config':
+            if decoder_config == self._sent_decoder_config[client_index]:
+                logging.debug("Decoder config unchanged for client %d", client_index)
+                return {}
+            return copy.deepcopy(decoder_config)
+
+        parameters = copy.deepcopy(parameters)
+        if command is None and 'decoder_config' in parameters and decoder_config is not None:
+            if decoder_config == self._sent_decoder_config[client_index]:
+                logging.debug("Decoder config unchanged for client %d", client_index)
+                del parameters['decoder_config']
+            else:
+                parameters['decoder_config'] = copy.deepcopy(decoder_config)
+        return parameters
+
+    @staticmethod
+    def request_decoder_config(command, parameters):
+        """
+        Return the decoder config items of a request, or None if it has none.
+
+        :param command: top level command of the request
+        :param parameters: parameters of the request
+        """
+        if command is None and 'decoder_config' in parameters:
+            logging.debug("Found decoder config: {}".format(parameters['decoder_config']))
+            return parameters['decoder_config']
+        elif command == 'decoder_config':
+            logging.debug("Found decoder config: {}".format(parameters))
+            return parameters
+        return None
+
+    def send_to_clients(self, request_command, parameters, client_index=-1, reply_futures=None):
         """
         Intercept the base class send_to_clients method.
         Keep a record of any decoder specific configuration items and then if a single decoder config
         item is later changed send the full decoder configuration to the Frame Receiver application.
         This is necessary as often a decoder config change will result in the complete tear down and re-init
         of the Decoder class and so a full and consistent set of decoder config parameters are required.
+        If the full decoder configuration of a client is unchanged it is not sent again.
 
         :param request_command:
         :param parameters:
         :param client_index:
+        :param reply_futures:
         """
         logging.debug("Original index: {} request_command: {} and parameters: {}".format(client_index, request_command, parameters))
+        if isinstance(parameters, list):
+            if len(parameters) != len(self._decoder_config) or client_index != -1:
+                # Mismatched per client parameter sets are rejected by the base class
+                return super(FrameReceiverAdapter, self).send_to_clients(request_command, parameters,
+                                                                         client_index, reply_futures)
+            # Each client is sent its own full decoder config, merged with its own decoder config items
+            command = request_command
+            new_param_set = []
+            for index, param_set in enumerate(parameters):
+                if param_set:
+                    command, param_set = self.uri_params_to_dictionary(request_command, param_set)
+                    decoder_config = self.request_decoder_config(command, param_set)
+                    if decoder_config is not None:
+                        self.merge_decoder_config(index, decoder_config)
+                        param_set = self.client_parameters(index, command, param_set)
+                new_param_set.append(param_set)
+            logging.debug("Updated full command: {} and parameter set: {}".format(command, new_param_set))
+            return super(FrameReceiverAdapter, self).send_to_clients(command, new_param_set, -1,
+                                                                     reply_futures)
+
         command, parameters = self.uri_params_to_dictionary(request_command, parameters)
 
-        decoder_config = None
-        if command is None:
-            if 'decoder_config' in parameters:
-                logging.debug("Found decoder config: {}".format(parameters['decoder_config']))
-                decoder_config = parameters['decoder_config']
-        elif command == 'decoder_config':
-                logging.debug("Found decoder config: {}".format(parameters))
-                decoder_config = parameters
-
-        if decoder_config is not None:
-            if client_index == -1:
-                for index in range(len(self._decoder_config)):
-                    if self._decoder_config[index] is None:
-                        self._decoder_config[index] = decoder_config
-                    else:
-                        for item in decoder_config:
-                            self._decoder_config[index][item] = decoder_config[item]
-            else:
-                if self._decoder_config[client_index] is None:
-                    self._decoder_config[client_index] = decoder_config
-                else:
-                    for item in decoder_config:
-                        self._decoder_config[client_index][item] = decoder_config[item]
+        decoder_config = self.request_decoder_config(command, parameters)
+        if decoder_config is None:
+            return super(FrameReceiverAdapter, self).send_to_clients(command, parameters, client_index,
+                                                                     reply_futures)
 
         # Now construct the new full message, inserting the full decoder config back into the parameters
         if client_index == -1:
             new_param_set = []
-            # Loop over each decoder config item and send a list of commands
-            for dc in self._decoder_config:
-                if command is None:
-                    if 'decoder_config' in parameters and dc is not None:
-                        parameters['decoder_config'] = dc
-                elif command == 'decoder_config':
-                    parameters = dc
-                new_param_set.append(copy.deepcopy(parameters))
-        else:
-            if command is None:
-                if 'decoder_config' in parameters and self._decoder_config[client_index] is not None:
-                    parameters['decoder_config'] = self._decoder_config[client_index]
-            elif command == 'decoder_config':
-                parameters = self._decoder_config[client_index]
-            new_param_set = parameters
-
+            for index in range(len(self._decoder_config)):
+                self.merge_decoder_config(index, decoder_config)
+                new_param_set.append(self.client_parameters(index, command, parameters))
+            logging.debug("Updated full command: {} and parameter set: {}".format(command, new_param_set))
+            return super(FrameReceiverAdapter, self).send_to_clients(command, new_param_set, -1,
+                                                                     reply_futures)
+
+        self.merge_decoder_config(client_index, decoder_config)
+        new_param_set = self.client_parameters(client_index, command, parameters)
         logging.debug("Updated full command: {} and parameter set: {}".format(command, new_param_set))
-
-        return super(FrameReceiverAdapter, self).send_to_clients(command, new_param_set, client_index)
+        if not new_param_set:
+            return {}, 200
+        return super(FrameReceiverAdapter, self).send_to_clients(command, new_param_set, client_index,
+                                                                 reply_futures)
@@ -2,8 +2,12 @@ import logging
 import struct
 from threading import RLock
 
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
 from odin_data.ipc_tornado_channel import IpcTornadoChannel
 from odin_data.ipc_message import IpcMessage, IpcMessageException
+from odin_data.util import ParameterVersions
 from datetime import datetime
 
 
@@ -20,6 +24,7 @@ class IpcTornadoClient(object):
         self._port = port
 
         self._parameters = {'status': {'connected': False}}
+        self._versions = ParameterVersions()
         self.ctrl_endpoint = self.ENDPOINT_TEMPLATE.format(IP=ip_address, PORT=port)
         self.logger.debug("Connecting to client at %s", self.ctrl_endpoint)
         self.ctrl_channel = IpcTornadoChannel(IpcTornadoChannel.CHANNEL_TYPE_DEALER)
@@ -27,6 +32,7 @@ class IpcTornadoClient(object):
         self.ctrl_channel.connect(self.ctrl_endpoint)
         self.ctrl_channel.register_callback(self._callback)
         self.message_id = 0
+        self._pending_replies = {}
 
         self._lock = RLock()
 
@@ -34,19 +40,26 @@ class IpcTornadoClient(object):
     def parameters(self):
         return self._parameters
 
+    @property
+    def versions(self):
+        return self._versions
+
     def _monitor_callback(self, msg):
         # Handle the multi-part message
         self.logger.debug("Msg received from %s: %s", self.ctrl_endpoint, msg)
         if msg['event'] == IpcTornadoChannel.CONNECTED:
             self.logger.debug("  Connected...")
             self._parameters['status']['connected'] = True
+            self._versions.bump('status')
         if msg['event'] == IpcTornadoChannel.DISCONNECTED:
             self.logger.debug("  Disconnected...")
             self._parameters['status']['connected'] = False
+            self._versions.bump('status')
 
     def _callback(self, msg):
         # Handle the multi-part message
         reply = IpcMessage(from_str=msg[0])
+        self._resolve_reply(reply)
         if 'request_version' in reply.get_msg_val():
             self._update_versions(reply.attrs)
         if 'request_configuration' in reply.get_msg_val():
@@ -54,30 +67,62 @@ class IpcTornadoClient(object):
         if 'status' in reply.get_msg_val():
             self._update_status(reply.attrs)
 
+    def _resolve_reply(self, reply):
+        # Complete the future of any request that is waiting for this reply
+        future = self._pending_replies.pop(reply.attrs.get('id'), None)
+        if future is not None and not future.done():
+            if reply.get_msg_type() == IpcMessage.ACK:
+                future.set_result(reply)
+            else:
+                error = reply.attrs.get('params', {}).get('error', 'Request rejected')
+                future.set_exception(IpcMessageException(error))
+
+    def _expire_reply(self, msg_id):
+        future = self._pending_replies.pop(msg_id, None)
+        if future is not None and not future.done():
+            future.set_exception(IpcMessageException("Request timed out waiting for reply"))
+
     def _update_versions(self, version_msg):
         params = version_msg['params']
+        if params['version'] != self._parameters.get('version'):
+            self._versions.bump('version')
         self._parameters['version'] = params['version']
 
     def _update_configuration(self, config_msg):
         params = config_msg['params']
+        if params != self._parameters.get('config'):
+            self._versions.bump('config')
         self._parameters['config'] = params
 
     def _update_status(self, status_msg):
         params = status_msg['params']
+        # If we have received a status response then we must be connected
+        params['connected'] = True
+        # The timestamp of each reply alone does not count as a change to the status
+        previous = dict(self._parameters['status'])
+        previous.pop('timestamp', None)
+        if params != previous:
+            self._versions.bump('status')
         params['timestamp'] = status_msg['timestamp']
         self._parameters['status'] = params
-        # If we have received a status response then we must be connected
-        self._parameters['status']['connected'] = True
 
     def connected(self):
         return self._parameters['status']['connected']
 
-    def _send_message(self, msg):
-        msg.set_msg_id(self.message_id)
-        self.message_id = (self.message_id + 1) % self.MESSAGE_ID_MAX
-        self.logger.debug("Sending control message [%s]:\n%s", self.ctrl_endpoint, msg.encode())
+    def _send_message(self, msg, reply_future=None):
         with self._lock:
-            self.ctrl_channel.send(msg.encode())
+            msg_id = self.message_id
+            msg.set_msg_id(msg_id)
+            self.message_id = (self.message_id + 1) % self.MESSAGE_ID_MAX
+            if reply_future is not None:
+                self._pending_replies[msg_id] = reply_future
+            self.logger.debug("Sending control message [%s]:\n%s", self.ctrl_endpoint, msg.encode())
+            try:
+                self.ctrl_channel.send(msg.encode())
+            except Exception:
+                self._pending_replies.pop(msg_id, None)
+                raise
+        return msg_id
 
     @staticmethod
     def _raise_reply_error(msg, reply):
@@ -90,7 +135,8 @@ class IpcTornadoClient(object):
         msg = IpcMessage("cmd", value)
         self._send_message(msg)
 
-    def send_configuration(self, content, target=None, valid_error=None):
+    @staticmethod
+    def _configuration_message(content, target=None):
         msg = IpcMessage("cmd", "configure")
 
         if target is not None:
@@ -99,6 +145,29 @@ class IpcTornadoClient(object):
             for parameter, value in content.items():
                 msg.set_param(parameter, value)
 
+        return msg
+
+    def send_configuration(self, content, target=None, valid_error=None):
+        msg = self._configuration_message(content, target)
         self._send_message(msg)
 
+    def send_configuration_with_reply(self, content, target=None, timeout=None):
+        """Send a configuration message and track the reply from the client.
+
+        Messages are sent immediately, so several configurations can be pipelined to the
+        client while their replies are outstanding.
+
+        :param content: configuration parameters to send
+        :param target: optional parameter name to send the content under
+        :param timeout: time in seconds to wait for a reply, or None to wait forever
+        :return: Future resolving to the ACK reply, or raising IpcMessageException on a NACK
+            or timeout
+        """
+        future = Future()
+        msg = self._configuration_message(content, target)
+        msg_id = self._send_message(msg, future)
+        if timeout is not None:
+            IOLoop.current().call_later(timeout, self._expire_reply, msg_id)
+        return future
+
 
@@ -17,6 +17,7 @@ from tornado.escape import json_decode
 
 from odin_data.ipc_tornado_channel import IpcTornadoChannel
 from odin_data.ipc_channel import IpcChannelException
+from odin_data.util import ParameterVersions, etag_matches, not_modified_response
 from odin.adapters.adapter import ApiAdapter, ApiAdapterResponse, response_types
 from odin.adapters.parameter_tree import ParameterTree, ParameterTreeError
 
@@ -122,6 +123,7 @@ class LiveViewer(object):
         logging.debug("Initialising LiveViewer")
 
         self.img_data = np.arange(0, 1024, 1).reshape(32, 32)
+        self.versions = ParameterVersions()
         self.clip_min = None
         self.clip_max = None
         self.header = {}
@@ -202,8 +204,12 @@ class LiveViewer(object):
                 content_type = 'application/json'
                 status = 400
         else:
-
-            response = self.param_tree.get(path)
+            # Skip reading the parameter tree if the client already holds the current version
+            etag = self.versions.etag(path)
+            if etag_matches(_request, etag):
+                response = not_modified_response(etag)
+            else:
+                response = {'etag': etag, 'value': self.param_tree.get(path)}
             content_type = 'application/json'
             status = 200
 
@@ -217,6 +223,11 @@ class LiveViewer(object):
         :param data: the data to PUT to the resource
         """
         self.param_tree.set(path, data)
+        subtree = path.strip('/').split('/')[0]
+        if subtree:
+            self.versions.bump(subtree)
+        else:
+            self.versions.bump()
 
     def create_image_from_socket(self, msg):
         """
@@ -240,6 +251,7 @@ class LiveViewer(object):
 
         self.img_data = img_data.reshape([int(header["shape"][0]), int(header["shape"][1])])
         self.header = header
+        self.versions.bump('frame', 'data_min_max', 'frame_counts')
 
         self.rendered_image = self.render_image(
             self.selected_colormap, self.clip_min, self.clip_max)
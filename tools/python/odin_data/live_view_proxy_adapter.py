@@ -19,6 +19,7 @@ from tornado.ioloop import IOLoop
 from zmq.error import ZMQError
 
 from odin_data.ipc_tornado_channel import IpcTornadoChannel
+from odin_data.util import ParameterVersions, etag_matches, not_modified_response
 from odin.adapters.adapter import ApiAdapter, ApiAdapterResponse, response_types
 from odin.adapters.parameter_tree import ParameterTree, ParameterTreeError
 
@@ -97,6 +98,7 @@ class LiveViewProxyAdapter(ApiAdapter):
             tree["nodes"][sub.name] = sub.param_tree
 
         self.param_tree = ParameterTree(tree)
+        self.versions = ParameterVersions()
 
         self.queue = PriorityQueue(self.max_queue)
 
@@ -123,6 +125,7 @@ class LiveViewProxyAdapter(ApiAdapter):
             frame = self.queue.get_nowait()
             self.last_sent_frame = (frame.acq_id, frame.num)
             self.publish_channel.send_multipart([frame.get_header(), frame.data])
+            self.versions.bump('last_sent_frame')
         except QueueEmptyException:
             # queue is empty but thats fine, no need to report
             # or there'd be far too much output
@@ -136,7 +139,12 @@ class LiveViewProxyAdapter(ApiAdapter):
         """
         HTTP Get Request Handler. Return the requested data from the parameter tree
         """
-        response = self.param_tree.get(path)
+        # Skip reading the parameter tree if the client already holds the current version
+        etag = self.versions.etag(path)
+        if etag_matches(request, etag):
+            response = not_modified_response(etag)
+        else:
+            response = {'etag': etag, 'value': self.param_tree.get(path)}
         content_type = 'application/json'
         status = 200
         return ApiAdapterResponse(response, content_type, status)
@@ -149,6 +157,7 @@ class LiveViewProxyAdapter(ApiAdapter):
         try:
             data = json_decode(request.body)
             self.param_tree.set(path, data)
+            self.versions.bump()
             response = self.param_tree.get(path)
             status_code = 200
         except ParameterTreeError as set_err:
@@ -162,6 +171,8 @@ class LiveViewProxyAdapter(ApiAdapter):
         not lower than the last sent frame)
         If the queue is full, the next frame should be removed and this frame added instead.
         """
+        # Every frame changes the counters of its source node
+        self.versions.bump('nodes')
         if (frame.acq_id, frame.num) < self.last_sent_frame:
             source.dropped_frame()
             return
@@ -172,6 +183,7 @@ class LiveViewProxyAdapter(ApiAdapter):
             self.queue.get_nowait()
             self.queue.put_nowait(frame)
             self.dropped_frame_count += 1
+            self.versions.bump('dropped_frames')
 
     def set_reset(self, data):
         """
@@ -5,6 +5,7 @@ from tornado import escape
 from odin.adapters.adapter import ApiAdapterResponse, \
     request_types, response_types
 from odin_data.odin_data_adapter import OdinDataAdapter
+from odin_data.util import etag_matches, not_modified_response
 
 
 class MetaListenerAdapter(OdinDataAdapter):
@@ -28,7 +29,8 @@ class MetaListenerAdapter(OdinDataAdapter):
         self._config_parameters = {
             "config/output_dir": "",
             "config/flush": 100,
-            "config/file_prefix": ""
+            "config/file_prefix": "",
+            "config/scratch_dir": ""
         }
 
         # Parameters must be created before base init called
@@ -70,6 +72,11 @@ class MetaListenerAdapter(OdinDataAdapter):
         logging.debug("GET path: %s", path)
         logging.debug("GET request: %s", request)
 
+        etag = self.parameter_etag(path)
+        if etag_matches(request, etag):
+            return ApiAdapterResponse(not_modified_response(etag), status_code=status_code)
+        response["etag"] = etag
+
         if path == "config/acquisition_id":
             response["value"] = self.acquisitionID
         elif path == "status/acquisition_active":
@@ -120,7 +127,8 @@ class MetaListenerAdapter(OdinDataAdapter):
                 acquisition_id=self.acquisitionID,
                 output_dir=self._config_parameters["config/output_dir"],
                 flush=self._config_parameters["config/flush"],
-                file_prefix=self._config_parameters["config/file_prefix"]
+                file_prefix=self._config_parameters["config/file_prefix"],
+                scratch_dir=self._config_parameters["config/scratch_dir"]
             )
             status_code, response = self._send_config(config)
         elif path == "config/stop":
@@ -149,6 +157,7 @@ class MetaListenerAdapter(OdinDataAdapter):
         else:
             return super(OdinDataAdapter, self).put(path, request)
 
+        self._versions.bump()
         return ApiAdapterResponse(response, status_code=status_code)
 
     def _send_config(self, config_message):
@@ -164,12 +173,25 @@ class MetaListenerAdapter(OdinDataAdapter):
 
         return status_code, response
 
+    def client_active(self, index):
+        # Any acquisition that is currently writing keeps the client active
+        active = super(MetaListenerAdapter, self).client_active(index)
+        acquisitions = self.traverse_parameters(
+            self._clients[index].parameters, ["status", "acquisitions"]
+        )
+        if acquisitions:
+            for acquisition in acquisitions.values():
+                if acquisition.get("writing"):
+                    active = True
+        return active
+
     def process_updates(self):
         """Handle additional background update loop tasks
 
         Store a copy of all parameters so they don't disappear
 
         """
+        previous = (self.acquisitionID, self.acquisition_active, dict(self._readback_parameters))
         if self.acquisitionID:
             acquisition_active = self.acquisitionID in self.traverse_parameters(
                 self._client.parameters, ["status", "acquisitions"]
@@ -186,3 +208,8 @@ class MetaListenerAdapter(OdinDataAdapter):
                 self.acquisition_active = False
         else:
             self._set_defaults()
+
+        # The stored copies are only updated after a status reply, so record their change
+        # separately, otherwise a GET in between would keep the old value under the new ETag
+        if (self.acquisitionID, self.acquisition_active, self._readback_parameters) != previous:
+            self._versions.bump('status', 'config')
@@ -0,0 +1,242 @@
+"""Meta Listener benchmark
+
+Publishes synthetic meta messages, in the format of the frameProcessor MetaMessagePublisher, from
+a number of publisher processes to a MetaListener and reports the sustained rate at which they are
+received, their latency, the memory growth of the listener and the number of messages dropped,
+for comparison of MetaListener settings.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import numpy
+import zmq
+
+from odin_data.meta_writer.meta_listener import META_VALUE_TYPES, MetaListener
+from odin_data.meta_writer.meta_writer import DatasetBuffer, MetaWriter
+
+
+class CountingWriter(MetaWriter):
+    """Meta writer that reads and counts messages without writing them.
+
+    The latency of each message is recorded from the time it was sent, given by the 'sent' item
+    of the user header.
+    """
+
+    def __init__(self, logger, directory, acquisition_id):
+        super(CountingWriter, self).__init__(logger, directory, acquisition_id)
+        self.message_count = 0
+        self.latencies = DatasetBuffer('float64')
+
+    def process_message(self, message, userheader, receiver):
+        receiver.recv()
+        self.message_count += 1
+        if 'sent' in userheader:
+            self.latencies.append(time.time() - userheader['sent'])
+
+    def stop(self):
+        self.finished = True
+
+
+def publisher_endpoint(endpoint, index):
+    """Return the endpoint of a publisher, offsetting the port or path of the first endpoint.
+
+    :param endpoint: ZeroMQ endpoint of the first publisher
+    :param index: Index of the publisher
+    """
+    if index == 0:
+        return endpoint
+    if endpoint.startswith('tcp://'):
+        address, port = endpoint.rsplit(':', 1)
+        return '{}:{}'.format(address, int(port) + index)
+    return '{}_{}'.format(endpoint, index)
+
+
+def publish(endpoint, num_messages, acquisition_id, value_type='double', size=8, rate=0, rank=0,
+            publishers=1, start_event=None):
+    """Publish synthetic meta messages.
+
+    Each message has a JSON header part and a value part of the given type.  Raw values are the
+    given number of bytes, and numeric values are the frame number.  Publisher N of M publishes
+    frames N, N + M, N + 2M..., as the frameProcessors of a multi-process acquisition do.
+
+    :param endpoint: ZeroMQ endpoint to bind the publisher to
+    :param num_messages: Number of messages to publish
+    :param acquisition_id: Acquisition ID to put in the message headers
+    :param value_type: Type of the message values, one of integer, uint64, double or raw
+    :param size: Size in bytes of raw values
+    :param rate: Number of messages to publish per second, or 0 to publish as fast as possible
+    :param rank: Rank of the publisher
+    :param publishers: Number of publishers
+    :param start_event: Event to wait for before publishing, otherwise wait for subscribers to connect
+    :return: Time in seconds taken to publish the messages
+    """
+    context = zmq.Context.instance()
+    publisher = context.socket(zmq.PUB)
+    publisher.set_hwm(num_messages)
+    publisher.bind(endpoint)
+    if start_event is not None:
+        start_event.wait()
+    else:
+        # Allow the listener to connect before publishing
+        time.sleep(0.5)
+
+    raw_value = numpy.zeros(size, dtype='uint8').tobytes()
+    start = time.time()
+    for index in range(num_messages):
+        if rate:
+            delay = start + float(index) / rate - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        frame = rank + index * publishers
+        header = {'plugin': 'benchmark', 'parameter': 'value', 'type': value_type,
+                  'header': {'acqID': acquisition_id, 'frame': frame, 'rank': rank, 'sent': time.time()}}
+        if value_type == 'raw':
+            value = raw_value
+        else:
+            value = numpy.array([frame], dtype=META_VALUE_TYPES[value_type]).tobytes()
+        publisher.send(json.dumps(header).encode(), zmq.SNDMORE)
+        publisher.send(value)
+    duration = time.time() - start
+    publisher.close(linger=1000)
+    return duration
+
+
+def run_publisher(results, *args):
+    """Publish messages in a publisher process, putting the time taken on a results queue."""
+    results.put(publish(*args))
+
+
+def resident_memory():
+    """Return the resident memory of this process in bytes."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        if resource is None:
+            return 0
+        # Peak rather than current memory, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def run_benchmark(num_messages, drain_size=MetaListener.DEFAULT_DRAIN_SIZE, endpoint='tcp://127.0.0.1:5558',
+                  ctrl=5659, timeout=10.0, publishers=1, rate=0, size=8, value_type='double'):
+    """Measure the rate at which a MetaListener receives messages from a number of publishers.
+
+    :param num_messages: Number of messages for each publisher to publish
+    :param drain_size: Drain size of the MetaListener
+    :param endpoint: ZeroMQ endpoint of the first publisher
+    :param ctrl: Control port of the MetaListener
+    :param timeout: Time in seconds to wait for the messages to be received
+    :param publishers: Number of publisher processes
+    :param rate: Number of messages per second for each publisher to publish, or 0 for no limit
+    :param size: Size in bytes of raw values
+    :param value_type: Type of the message values
+    :return: Dictionary of results
+    """
+    endpoints = [publisher_endpoint(endpoint, index) for index in range(publishers)]
+
+    # Start the publishers before the listener creates a ZeroMQ context, as it cannot be forked
+    start_event = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    processes = []
+    for rank, publisher_address in enumerate(endpoints):
+        process = multiprocessing.Process(target=run_publisher,
+                                          args=(results, publisher_address, num_messages, 'benchmark',
+                                                value_type, size, rate, rank, publishers, start_event))
+        process.daemon = True
+        process.start()
+        processes.append(process)
+
+    listener = MetaListener('/tmp', ','.join(endpoints), ctrl, 'odin_data.meta_writer.benchmark.CountingWriter',
+                            drain_size)
+    listener.handle_configure_message({'acquisition_id': 'benchmark'}, 0)
+    writer = listener._writers['benchmark']
+    memory_start = resident_memory()
+    listener_thread = threading.Thread(target=listener.run)
+    listener_thread.start()
+
+    # Allow the listener to connect before publishing
+    time.sleep(0.5)
+    start_event.set()
+    start = time.time()
+
+    # Wait until the messages have been received, or no more are arriving
+    published = num_messages * publishers
+    end = time.time()
+    received = 0
+    while received < published and time.time() - end < 1.0 and time.time() - start < timeout:
+        time.sleep(0.01)
+        if listener.writer_queue_status()['received'] > received:
+            received = listener.writer_queue_status()['received']
+            end = time.time()
+    memory_end = resident_memory()
+    listener._kill_requested = True
+    listener_thread.join()
+
+    publish_times = [results.get(timeout=timeout) for _ in processes]
+    for process in processes:
+        process.join()
+    for publisher_address in endpoints:
+        if publisher_address.startswith('ipc://') and os.path.exists(publisher_address[len('ipc://'):]):
+            os.remove(publisher_address[len('ipc://'):])
+
+    latencies = writer.latencies.values * 1000.0
+    percentiles = numpy.percentile(latencies, [50, 90, 99]).tolist() if len(latencies) else [0.0] * 3
+    return {
+        'drain_size': drain_size,
+        'publishers': publishers,
+        'published': published,
+        'received': received,
+        'written': writer.message_count,
+        'dropped': published - received,
+        'publish_time': max(publish_times),
+        'rate': received / (end - start),
+        'latency_p50': percentiles[0],
+        'latency_p90': percentiles[1],
+        'latency_p99': percentiles[2],
+        'latency_max': float(latencies.max()) if len(latencies) else 0.0,
+        'memory_growth': memory_end - memory_start
+    }
+
+
+def options():
+    """Parse program arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--messages", default=100000, type=int,
+                        help="Number of messages for each publisher to publish")
+    parser.add_argument("--drain-sizes", default="1,1000",
+                        help="Comma separated list of MetaListener drain sizes to compare")
+    parser.add_argument("-p", "--publishers", default=1, type=int, help="Number of publisher processes")
+    parser.add_argument("-r", "--rate", default=0, type=float,
+                        help="Messages per second for each publisher to publish, 0 for no limit")
+    parser.add_argument("-t", "--type", default="double", choices=sorted(list(META_VALUE_TYPES) + ['raw']),
+                        help="Type of the message values")
+    parser.add_argument("-s", "--size", default=8, type=int, help="Size in bytes of raw message values")
+    parser.add_argument("-e", "--endpoint", default="tcp://127.0.0.1:5558", help="Endpoint of the first publisher")
+    parser.add_argument("-c", "--ctrl", default="5659", help="MetaListener control port")
+    return parser.parse_args()
+
+
+def main():
+    """Run the benchmark for each drain size and print the results."""
+    args = options()
+    for drain_size in [int(size) for size in args.drain_sizes.split(',')]:
+        result = run_benchmark(args.messages, drain_size, args.endpoint, args.ctrl, publishers=args.publishers,
+                               rate=args.rate, size=args.size, value_type=args.type)
+        print("drain_size {drain_size:6d}: received {received}/{published} (dropped {dropped}) "
+              "at {rate:.0f} messages/s, latency p50 {latency_p50:.2f} p90 {latency_p90:.2f} "
+              "p99 {latency_p99:.2f} max {latency_max:.2f} ms, "
+              "memory growth {memory_growth} bytes".format(**result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""Implementation of odin_data File Mover
+
+This module moves a closed meta file, or a directory of meta files, from the local scratch
+directory it was written in to its destination on a background thread.  A file on another
+filesystem is copied alongside its destination, verified against the checksum of the source and
+then renamed into place, and only then is the source removed.
+"""
+import hashlib
+import os
+import shutil
+import threading
+import time
+
+
+class FileMover(object):
+    """File Mover class.
+
+    This class moves a file or directory to its destination on a thread, recording its progress
+    """
+
+    # Number of bytes read and written at a time when copying
+    CHUNK_SIZE = 4 * 1024 * 1024
+    # Suffix of a file while it is being copied to its destination
+    PARTIAL_SUFFIX = '.part'
+
+    def __init__(self, logger, source, destination):
+        """Initalise the FileMover object.
+
+        :param logger: Logger to use
+        :param source: Full path of the file or directory to move
+        :param destination: Full path to move it to
+        """
+        self._logger = logger
+        self.source = source
+        self.destination = destination
+        self.state = 'pending'
+        self.error = None
+        self.bytes_total = 0
+        self.bytes_copied = 0
+        self.files = 0
+        self.duration = None
+        self._thread = None
+
+    @property
+    def done(self):
+        """Return whether the move has completed or failed."""
+        return self.state in ('complete', 'failed')
+
+    def start(self):
+        """Start moving the file on a background thread."""
+        self._thread = threading.Thread(target=self.run, name='file_mover')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        """Wait for the move to finish.
+
+        :param timeout: Time in seconds to wait, or None to wait until it finishes
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def status(self):
+        """Return the progress of the move."""
+        return {
+            'state': self.state,
+            'source': self.source,
+            'destination': self.destination,
+            'bytes_total': self.bytes_total,
+            'bytes_copied': self.bytes_copied,
+            'files': self.files,
+            'duration': self.duration,
+            'error': self.error
+        }
+
+    def run(self):
+        """Move the file, renaming it if possible and otherwise copying it with verification."""
+        start = time.time()
+        try:
+            sources = self.source_files()
+            self.bytes_total = sum(os.path.getsize(source) for source, _ in sources)
+            self.files = len(sources)
+            if self.same_filesystem():
+                self._logger.info('Renaming %s to %s', self.source, self.destination)
+                self.state = 'moving'
+                os.rename(self.source, self.destination)
+                self.bytes_copied = self.bytes_total
+            else:
+                self._logger.info('Copying %s to %s', self.source, self.destination)
+                self.state = 'copying'
+                for source, destination in sources:
+                    self.copy_file(source, destination)
+                if os.path.isdir(self.source):
+                    shutil.rmtree(self.source)
+                else:
+                    os.remove(self.source)
+            self.state = 'complete'
+            self._logger.info('Moved %s to %s', self.source, self.destination)
+        except Exception as err:
+            self.state = 'failed'
+            self.error = str(err)
+            self._logger.error('Unable to move %s to %s: %s', self.source, self.destination, err)
+        self.duration = time.time() - start
+
+    def source_files(self):
+        """Return a list of (source, destination) file paths to move."""
+        if not os.path.isdir(self.source):
+            return [(self.source, self.destination)]
+        files = []
+        for root, _, names in os.walk(self.source):
+            for name in sorted(names):
+                source = os.path.join(root, name)
+                files.append((source, os.path.join(self.destination, os.path.relpath(source, self.source))))
+        return files
+
+    def same_filesystem(self):
+        """Return whether the source can be renamed to the destination."""
+        destination_directory = os.path.dirname(os.path.abspath(self.destination))
+        return os.stat(self.source).st_dev == os.stat(destination_directory).st_dev
+
+    def copy_file(self, source, destination):
+        """Copy a file, verifying the copy against the checksum of the source before renaming it.
+
+        :param source: Full path of the file to copy
+        :param destination: Full path to copy it to
+        """
+        if not os.path.isdir(os.path.dirname(destination)):
+            os.makedirs(os.path.dirname(destination))
+        partial = destination + self.PARTIAL_SUFFIX
+        source_checksum = hashlib.md5()
+        with open(source, 'rb') as source_file:
+            with open(partial, 'wb') as partial_file:
+                while True:
+                    data = source_file.read(self.CHUNK_SIZE)
+                    if not data:
+                        break
+                    source_checksum.update(data)
+                    partial_file.write(data)
+                    self.bytes_copied += len(data)
+                partial_file.flush()
+                os.fsync(partial_file.fileno())
+
+        if self.checksum(partial) != source_checksum.hexdigest():
+            os.remove(partial)
+            raise Exception('Checksum of ' + destination + ' does not match ' + source)
+        os.rename(partial, destination)
+
+    def checksum(self, file_name):
+        """Return the MD5 checksum of a file.
+
+        :param file_name: Full path of the file
+        """
+        checksum = hashlib.md5()
+        with open(file_name, 'rb') as checksum_file:
+            while True:
+                data = checksum_file.read(self.CHUNK_SIZE)
+                if not data:
+                    break
+                checksum.update(data)
+        return checksum.hexdigest()
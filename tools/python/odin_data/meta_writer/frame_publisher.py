@@ -0,0 +1,231 @@
+"""Implementation of odin_data Frame Publisher
+
+This module republishes the per-frame meta values received by a MetaListener, merged across
+frameProcessor ranks into one record per frame, so that online analysis can subscribe to a single
+compact stream rather than to each frameProcessor.
+
+Records are published periodically in batches, as a three part message of the acquisition ID,
+which subscribers can filter on, a JSON header and the records as a binary NumPy structured array
+with a 'frame' and a 'rank' field followed by a field for each parameter.  decode_frame_records
+decodes a received message.  A record is held back until it has a value for every parameter of its
+acquisition, or until a grace period has passed since its first value, so that each frame is
+published once.  The field of a parameter has the type of its values, promoted as required.
+
+The publisher never blocks writing: messages are sent without blocking to an XPUB socket with a
+small high water mark.  A PUB socket silently drops messages for slow subscribers, so the socket
+is set not to drop messages, and a message that cannot be queued for every subscriber is dropped
+and counted instead.  As ZeroMQ conflation does not
+support multipart messages, records can also be conflated before they are sent, so that only the
+most recent frames of each acquisition are published at each interval.
+"""
+import collections
+import json
+import time
+
+import numpy
+import zmq
+
+from odin_data.meta_writer.meta_writer import FrameJoin
+
+
+def decode_frame_records(parts):
+    """Decode a message published by a FramePublisher.
+
+    :param parts: List of the message parts
+    :return: Tuple of the header dictionary and the structured array of records
+    """
+    header = json.loads(parts[1])
+    dtype = numpy.dtype([(str(name), str(type_str)) for name, type_str in header['dtype']])
+    return header, numpy.frombuffer(parts[2], dtype=dtype)
+
+
+class FramePublisher(object):
+    """Frame Publisher class.
+
+    This class merges per-frame meta values into records and publishes them in batches
+    """
+
+    # Default minimum time in seconds between publishing records
+    DEFAULT_INTERVAL = 0.1
+    # Default time in seconds after its first value that an incomplete record is published
+    DEFAULT_GRACE = 1.0
+    # Maximum number of records published in a single message
+    MAX_BATCH_RECORDS = 1000
+    # Number of messages queued for each subscriber before further messages are dropped
+    SEND_HWM = 100
+    # Maximum number of subscription messages read from the socket at each publish
+    MAX_SUBSCRIPTIONS = 100
+
+    def __init__(self, socket, interval=DEFAULT_INTERVAL, conflate=0, grace=DEFAULT_GRACE):
+        """Initalise the FramePublisher object.
+
+        :param socket: ZeroMQ XPUB socket to publish on
+        :param interval: Minimum time in seconds between publishing records
+        :param conflate: Maximum number of records of an acquisition to publish per interval, keeping
+        the most recent frames, or 0 to publish all records
+        :param grace: Time in seconds after its first value that an incomplete record is published
+        """
+        self._socket = socket
+        self._socket.set_hwm(self.SEND_HWM)
+        # Raise Again rather than silently dropping messages at the high water mark
+        self._socket.setsockopt(zmq.XPUB_NODROP, 1)
+        self.interval = interval
+        self.conflate = conflate
+        self.grace = grace
+        self._records = collections.OrderedDict()
+        self._dtypes = {}
+        # Time of the first value of each record, keyed by acquisition ID and frame number
+        self._first_added = {}
+        # Time of the last value of each acquisition
+        self._last_added = {}
+        self._last_published = 0.0
+        self.published = 0
+        self.messages = 0
+        self.conflated = 0
+        self.dropped = 0
+
+    def add_value(self, acquisition_id, frame, rank, column, value):
+        """Add the value of a frame to the record of the frame, if it is a numeric scalar.
+
+        The type of the column is promoted if the value cannot be held by its current type, e.g. to
+        float for a float value in an integer column.
+
+        :param acquisition_id: Acquisition ID
+        :param frame: The frame number of the value
+        :param rank: The rank of the frameProcessor that published the value
+        :param column: The column name
+        :param value: The value of the frame
+        :return: Whether the value was added
+        """
+        value = numpy.asarray(value)
+        if value.ndim != 0 or value.dtype.kind not in 'biuf':
+            return False
+        if acquisition_id not in self._records:
+            self._records[acquisition_id] = {}
+            self._dtypes[acquisition_id] = collections.OrderedDict()
+            self._first_added[acquisition_id] = {}
+        dtypes = self._dtypes[acquisition_id]
+        if column not in dtypes:
+            dtypes[column] = value.dtype
+        elif not numpy.can_cast(value.dtype, dtypes[column]):
+            dtypes[column] = numpy.promote_types(dtypes[column], value.dtype)
+        frame = int(frame)
+        record = self._records[acquisition_id].setdefault(frame, {})
+        now = time.time()
+        self._first_added[acquisition_id].setdefault(frame, now)
+        self._last_added[acquisition_id] = now
+        record['rank'] = rank
+        record[column] = value
+        return True
+
+    def pending(self):
+        """Return the number of records waiting to be published."""
+        return sum(len(records) for records in list(self._records.values()))
+
+    def ready(self, acquisition_id, now):
+        """Return the frames of an acquisition whose records are ready to be published.
+
+        A record is ready once it has a value for every column of the acquisition, or once the
+        grace period has passed since its first value.
+
+        :param acquisition_id: Acquisition ID
+        :param now: The current time
+        :return: Sorted list of frame numbers
+        """
+        records = self._records[acquisition_id]
+        first_added = self._first_added[acquisition_id]
+        num_columns = len(self._dtypes[acquisition_id]) + 1
+        return sorted(frame for frame, record in records.items()
+                      if len(record) == num_columns or now - first_added[frame] >= self.grace)
+
+    def publish(self, force=False):
+        """Publish the records that are ready, if the publish interval has elapsed.
+
+        :param force: Publish regardless of the interval, including records that are not ready
+        """
+        now = time.time()
+        if not force and now - self._last_published < self.interval:
+            return
+        self._last_published = now
+        self.read_subscriptions()
+
+        for acquisition_id, records in list(self._records.items()):
+            frames = sorted(records) if force else self.ready(acquisition_id, now)
+            published = frames
+            if self.conflate and len(frames) > self.conflate:
+                self.conflated += len(frames) - self.conflate
+                frames = frames[-self.conflate:]
+            for start in range(0, len(frames), self.MAX_BATCH_RECORDS):
+                batch = frames[start:start + self.MAX_BATCH_RECORDS]
+                self.send(self.encode(acquisition_id, batch, records), len(batch))
+            for frame in published:
+                del records[frame]
+                del self._first_added[acquisition_id][frame]
+            # The columns of an acquisition are kept while it is receiving values
+            if not records and (force or now - self._last_added[acquisition_id] >= self.grace):
+                del self._records[acquisition_id]
+                del self._last_added[acquisition_id]
+                del self._dtypes[acquisition_id]
+                del self._first_added[acquisition_id]
+
+    def encode(self, acquisition_id, frames, records):
+        """Encode the records of a batch of frames as a message.
+
+        :param acquisition_id: Acquisition ID
+        :param frames: Sorted list of the frame numbers in the batch
+        :param records: Dictionary of frame number to record
+        :return: List of message parts
+        """
+        columns = self._dtypes[acquisition_id]
+        dtype = [('frame', '<i8'), ('rank', '<i4')] + [(str(column), columns[column]) for column in columns]
+        table = numpy.empty(len(frames), dtype=dtype)
+        table['frame'] = frames
+        table['rank'] = [records[frame]['rank'] for frame in frames]
+        for column, column_dtype in columns.items():
+            fill = FrameJoin.fill_value(column_dtype)
+            table[str(column)] = [records[frame].get(column, fill) for frame in frames]
+
+        header = {
+            'acquisition_id': acquisition_id,
+            'records': len(frames),
+            'first': frames[0],
+            'last': frames[-1],
+            'dtype': table.dtype.descr
+        }
+        return [acquisition_id.encode(), json.dumps(header).encode(), table.tobytes()]
+
+    def read_subscriptions(self):
+        """Discard the subscription messages received on the socket, so that they do not queue up."""
+        for _ in range(self.MAX_SUBSCRIPTIONS):
+            try:
+                self._socket.recv(zmq.NOBLOCK)
+            except zmq.Again:
+                break
+
+    def send(self, parts, num_records):
+        """Send a message without blocking, dropping it if it cannot be queued for every subscriber.
+
+        :param parts: List of message parts
+        :param num_records: Number of records in the message
+        """
+        try:
+            self._socket.send_multipart(parts, zmq.NOBLOCK)
+            self.messages += 1
+            self.published += num_records
+        except zmq.Again:
+            self.dropped += 1
+
+    def status(self):
+        """Return the counters of the publisher."""
+        return {
+            'published': self.published,
+            'messages': self.messages,
+            'conflated': self.conflated,
+            'dropped': self.dropped,
+            'pending': self.pending()
+        }
+
+    def close(self):
+        """Publish any pending records and close the socket."""
+        self.publish(force=True)
+        self._socket.close(linger=0)
@@ -0,0 +1,64 @@
+"""Meta journal replay
+
+Rebuilds the meta file of an acquisition from its meta journal, by passing the journalled messages
+through a MetaListener to a new writer in the order they were received.
+"""
+import argparse
+import logging
+
+from odin_data.meta_writer.meta_journal import read_journal
+from odin_data.meta_writer.meta_listener import MetaListener
+
+
+def replay_journal(file_name, writer_module=None, directory=None):
+    """Write the messages of a journal to a new meta file.
+
+    :param file_name: Full path of the journal file
+    :param writer_module: Detector writer class, the class recorded in the journal if None
+    :param directory: Directory to create the meta file in, the journalled directory if None
+    :return: Full path of the meta file written
+    """
+    header, records = read_journal(file_name)
+    acquisition_id = header['acquisition_id']
+    if writer_module is None:
+        writer_module = header['writer']
+    if directory is None:
+        directory = header['directory']
+
+    listener = MetaListener(directory, '', 0, writer_module)
+    params = {'acquisition_id': acquisition_id, 'output_dir': directory, 'flush': header['flush'],
+              'swmr': header['swmr'], 'storage': header['storage'], 'join': header['join']}
+    if header['file_prefix']:
+        params['file_prefix'] = header['file_prefix']
+    listener.handle_configure_message(params, 0)
+
+    for input_index, parts in records:
+        listener.write_message(parts, input_index)
+
+    writer = listener._writers[acquisition_id]
+    listener.stop_writer(writer)
+    listener.logger.info('Replayed %d messages of acquisition [%s] from %s',
+                         len(records), acquisition_id, file_name)
+    return writer.full_file_name
+
+
+def options():
+    """Parse program arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("journal", help="Meta journal file to replay")
+    parser.add_argument("-w", "--writer", default=None,
+                        help="Module path to detector specific meta writer class, if not the journalled one")
+    parser.add_argument("-d", "--directory", default=None,
+                        help="Directory to write the meta data file to, if not the journalled one")
+    return parser.parse_args()
+
+
+def main():
+    """Replay a meta journal."""
+    args = options()
+    logging.basicConfig(level=logging.INFO)
+    print(replay_journal(args.journal, args.writer, args.directory))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Implementation of odin_data Meta Journal
+
+This module records the meta messages of an acquisition in an append-only, memory-mapped journal
+file before they are written, so that the meta file can be rebuilt if the meta writer dies before
+the file is closed.
+
+The journal starts with a magic string and a JSON header describing the acquisition, followed by
+one record per message.  Each record is a header of the length of its data, a CRC32 of the data,
+the input index and the number of parts, followed by each part prefixed with its length.  The
+record header is written after its data, so a record that was being appended when the writer died
+is either absent or fails its CRC, and reading stops there.
+"""
+import json
+import mmap
+import os
+import struct
+import zlib
+
+JOURNAL_SUFFIX = '_meta.journal'
+JOURNAL_MAGIC = b'ODINMJ01'
+
+# Magic string and length of the JSON header
+FILE_HEADER = struct.Struct('<8sI')
+# Length of the record data, CRC32 of the record data, input index and number of parts
+RECORD_HEADER = struct.Struct('<IIII')
+# Length of a message part
+PART_HEADER = struct.Struct('<I')
+
+
+class MetaJournal(object):
+    """Meta Journal class.
+
+    This class appends meta messages to a memory-mapped journal file
+    """
+
+    # Size in bytes by which the journal file is extended when it is full
+    CHUNK_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, file_name, header):
+        """Initalise the MetaJournal object, creating the journal file.
+
+        :param file_name: Full path of the journal file
+        :param header: Dictionary describing the acquisition, stored at the start of the journal
+        """
+        self.file_name = file_name
+        self.records = 0
+        header = json.dumps(header).encode()
+        self._file = open(file_name, 'w+b')
+        self._size = 0
+        self._map = None
+        self._offset = 0
+        self._reserve(FILE_HEADER.size + len(header))
+        self._map[0:FILE_HEADER.size] = FILE_HEADER.pack(JOURNAL_MAGIC, len(header))
+        self._map[FILE_HEADER.size:FILE_HEADER.size + len(header)] = header
+        self._offset = FILE_HEADER.size + len(header)
+
+    def _reserve(self, length):
+        """Extend and remap the journal file if there is not enough space to append to it.
+
+        :param length: Number of bytes to be appended
+        """
+        if self._offset + length <= self._size:
+            return
+        if self._map is not None:
+            self._map.close()
+        while self._size < self._offset + length:
+            self._size += self.CHUNK_SIZE
+        self._file.truncate(self._size)
+        self._map = mmap.mmap(self._file.fileno(), self._size)
+
+    def append(self, parts, input_index=0):
+        """Append a message to the journal.
+
+        :param parts: List of message parts, as bytes
+        :param input_index: Index of the input the message was received on
+        """
+        length = sum(PART_HEADER.size + len(part) for part in parts)
+        self._reserve(RECORD_HEADER.size + length)
+
+        position = self._offset + RECORD_HEADER.size
+        for part in parts:
+            self._map[position:position + PART_HEADER.size] = PART_HEADER.pack(len(part))
+            position += PART_HEADER.size
+            self._map[position:position + len(part)] = part
+            position += len(part)
+
+        start = self._offset + RECORD_HEADER.size
+        crc = zlib.crc32(self._map[start:position]) & 0xffffffff
+        self._map[self._offset:start] = RECORD_HEADER.pack(length, crc, input_index, len(parts))
+        self._offset = position
+        self.records += 1
+
+    def sync(self):
+        """Flush the journal to disk."""
+        self._map.flush()
+
+    def close(self, remove=False):
+        """Close the journal, trimming the unused space from the end of the file.
+
+        :param remove: Remove the journal file once closed
+        """
+        if self._map is not None:
+            self._map.flush()
+            self._map.close()
+            self._map = None
+            self._file.truncate(self._offset)
+            self._file.close()
+        if remove and os.path.exists(self.file_name):
+            os.remove(self.file_name)
+
+
+def read_journal(file_name):
+    """Read the header and complete records of a journal file.
+
+    :param file_name: Full path of the journal file
+    :return: Tuple of the header dictionary and a list of (input index, parts) tuples
+    """
+    with open(file_name, 'rb') as journal_file:
+        data = journal_file.read()
+
+    if len(data) < FILE_HEADER.size:
+        raise Exception('Journal file ' + file_name + ' is too short')
+    magic, header_length = FILE_HEADER.unpack_from(data, 0)
+    if magic != JOURNAL_MAGIC:
+        raise Exception('File ' + file_name + ' is not a meta journal')
+    offset = FILE_HEADER.size + header_length
+    header = json.loads(data[FILE_HEADER.size:offset].decode())
+
+    records = []
+    while offset + RECORD_HEADER.size <= len(data):
+        length, crc, input_index, num_parts = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        # Unused space is zero, so a zero length record marks the end of the journal
+        if length == 0 or start + length > len(data):
+            break
+        if zlib.crc32(data[start:start + length]) & 0xffffffff != crc:
+            break
+        parts = []
+        position = start
+        for _ in range(num_parts):
+            part_length, = PART_HEADER.unpack_from(data, position)
+            position += PART_HEADER.size
+            parts.append(data[position:position + part_length])
+            position += part_length
+        records.append((input_index, parts))
+        offset = start + length
+
+    return header, records
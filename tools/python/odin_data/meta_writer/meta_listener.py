@@ -6,65 +6,229 @@ on to a MetaWriter to write. Also handles odin Ipc control messages.
 Matt Taylor, Diamond Light Source
 """
 import zmq
+import json
 import logging
+import numpy
+import os
 import re
-import importlib
+import threading
+import time
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 from odin_data.ipc_message import IpcMessage
+from odin_data.meta_writer.frame_publisher import FramePublisher
+from odin_data.meta_writer.meta_journal import MetaJournal, JOURNAL_SUFFIX
+from odin_data.meta_writer.meta_writer import FrameJoin, meta_frame_number, meta_frame_value, meta_rank
+from odin_data.meta_writer.storage import STORAGE_BACKENDS
+from odin_data.meta_writer.writer_registry import AcquisitionWriters, WriterRegistry
 import odin_data._version as versioneer
 
 MAJOR_VER_REGEX = r"^([0-9]+)[\\.-].*|$"
 MINOR_VER_REGEX = r"^[0-9]+[\\.-]([0-9]+).*|$"
 PATCH_VER_REGEX = r"^[0-9]+[\\.-][0-9]+[\\.-]([0-9]+).|$"
 
+# NumPy types of the values published by the frameProcessor MetaMessagePublisher
+META_VALUE_TYPES = {
+    'integer': numpy.dtype('<i4'),
+    'uint64': numpy.dtype('<u8'),
+    'double': numpy.dtype('<f8')
+}
+
+
+def odin_data_version():
+    """Return the odin-data version, split into its components."""
+    version = versioneer.get_versions()["version"]
+    major_version = re.findall(MAJOR_VER_REGEX, version)[0]
+    minor_version = re.findall(MINOR_VER_REGEX, version)[0]
+    patch_version = re.findall(PATCH_VER_REGEX, version)[0]
+    short_version = major_version + "." + minor_version + "." + patch_version
+
+    odin_data_dict = {}
+    odin_data_dict["full"] = version
+    odin_data_dict["major"] = major_version
+    odin_data_dict["minor"] = minor_version
+    odin_data_dict["patch"] = patch_version
+    odin_data_dict["short"] = short_version
+    return odin_data_dict
+
+
+def part_bytes(part):
+    """Return the content of a message part, which may be a zero-copy Frame, as bytes."""
+    if isinstance(part, zmq.Frame):
+        return part.bytes
+    return part
+
+
+def decode_meta_value(message, part):
+    """Decode the data part of a meta message according to the type in its header.
+
+    Numeric values are returned as NumPy scalars and strings as str.  Raw values are returned as
+    a read only NumPy array viewing the message data, with the dtype and shape given by the
+    'dtype' and 'shape' items of the user header if present, otherwise as an array of bytes.
+
+    :param message: The decoded message header
+    :param part: The data part of the message
+    :return: The decoded value
+    """
+    value_type = message.get('type')
+    if value_type in META_VALUE_TYPES:
+        return numpy.frombuffer(part, dtype=META_VALUE_TYPES[value_type])[0]
+    elif value_type == 'string':
+        return part_bytes(part).decode('utf-8')
+    elif value_type == 'raw':
+        userheader = message.get('header')
+        if not isinstance(userheader, dict):
+            userheader = {}
+        value = numpy.frombuffer(part, dtype=numpy.dtype(str(userheader.get('dtype', 'uint8'))))
+        if 'shape' in userheader:
+            value = value.reshape(userheader['shape'])
+        return value
+    raise ValueError('Unknown meta value type: ' + str(value_type))
+
+
+class ReceivedMessage(object):
+    """Received message parts.
+
+    This class replays the remaining parts of a multipart meta message that has already been read
+    from a ZeroMQ socket, so that writers can read them as they would from the socket itself
+    """
+
+    def __init__(self, parts):
+        """Initalise the ReceivedMessage object.
+
+        :param parts: List of message parts still to be read
+        """
+        self._parts = parts
+        self._index = 0
+
+    def recv(self, flags=0, copy=True, track=False):
+        """Return the next message part, as bytes if copy is True."""
+        if self._index >= len(self._parts):
+            raise zmq.ZMQError(zmq.EAGAIN)
+        part = self._parts[self._index]
+        self._index += 1
+        if copy:
+            return part_bytes(part)
+        return part
+
+    def recv_json(self, flags=0):
+        """Return the next message part decoded from JSON."""
+        return json.loads(self.recv(flags))
+
+    def recv_multipart(self, flags=0, copy=True, track=False):
+        """Return all remaining message parts, as bytes if copy is True."""
+        parts = self._parts[self._index:]
+        self._index = len(self._parts)
+        if copy:
+            return [part_bytes(part) for part in parts]
+        return parts
+
+    def getsockopt(self, option):
+        """Return whether more message parts remain for the RCVMORE option."""
+        if option == zmq.RCVMORE:
+            return int(self._index < len(self._parts))
+        raise zmq.ZMQError(zmq.EINVAL)
+
+
 class MetaListener:
     """Meta Listener class.
 
     This class listens on ZeroMQ sockets for incoming cnotrol and meta data messages
     """
 
-    def __init__(self, directory, inputs, ctrl, writer_module):
+    # Interval in milliseconds at which writers are checked for an expired flush timeout
+    FLUSH_CHECK_INTERVAL = 500
+    # Number of batches that can be queued for the writer thread while a batch is written
+    WRITER_QUEUE_SIZE = 2
+    # Number of messages that can be held in a batch before receiving blocks on the writer thread
+    MAX_BATCH_MESSAGES = 10000
+    # Default maximum number of messages read from a ready input socket per poll
+    DEFAULT_DRAIN_SIZE = 1000
+    # Default maximum number of finished writers kept to report their status
+    MAX_FINISHED_WRITERS = 3
+    # Default maximum number of writers in use, beyond which new acquisitions are refused
+    MAX_OPEN_WRITERS = 8
+    # Default time in seconds after which a writer with no frame processors writing to it is closed
+    IDLE_WRITER_TIMEOUT = 10.0
+
+    def __init__(self, directory, inputs, ctrl, writer_module, drain_size=DEFAULT_DRAIN_SIZE,
+                 input_type=zmq.SUB, publish=None):
         """Initalise the MetaListener object.
 
         :param directory: Directory to create the meta file in
         :param inputs: Comma separated list of input ZMQ addresses
-        :param ctrl: Port to use for control messages
+        :param ctrl: Port, or full ZMQ address, to use for control messages
         :param writer_module: Detector writer class
+        :param drain_size: Maximum number of messages to read from a ready input socket per poll
+        :param input_type: ZeroMQ socket type of the inputs
+        :param publish: ZeroMQ address to republish per-frame meta data on, or None
         """
         self._inputs = inputs
         self._directory = directory
         self._ctrl_port = str(ctrl)
         self._writer_module = writer_module
-        self._writers = {}
+        self._drain_size = max(int(drain_size), 1)
+        self._input_type = input_type
+        self._writers = AcquisitionWriters(self.MAX_FINISHED_WRITERS, self.MAX_OPEN_WRITERS)
+        self._idle_timeout = self.IDLE_WRITER_TIMEOUT
         self._kill_requested = False
 
+        # Messages are received on the main thread and passed in batches to a writer thread, so
+        # that slow disk access does not block receiving
+        self._writer_queue = queue.Queue(self.WRITER_QUEUE_SIZE)
+        self._writer_thread = None
+        self._batch = []
+        self._messages_received = 0
+        self._input_received = {}
+        self._messages_written = 0
+        self._queue_full_count = 0
+        self._stall_count = 0
+        self._stall_time = 0.0
+
         # create logger
         self.logger = logging.getLogger('meta_listener')
 
+        # Writer classes are loaded once, and a writer can be created in advance of an acquisition
+        self._registry = WriterRegistry(self.logger)
+        self._prewarm = False
+
+        # Messages can be journalled before they are written, so a meta file can be rebuilt
+        self._journal = False
+        self._journals = {}
+
+        # Per-frame values can be republished on a PUB socket, which belongs to the writer thread
+        self._context = None
+        self._publish = publish or ''
+        self._publish_interval = FramePublisher.DEFAULT_INTERVAL
+        self._publish_conflate = 0
+        self._publish_grace = FramePublisher.DEFAULT_GRACE
+        self._publisher = None
+
+        # The version cannot change while running, and finding it may need to run git
+        self._version = odin_data_version()
+
     def run(self):
         """Main application loop."""
         self.logger.info('Starting Meta listener...')
 
         receiver_list = []
         context = zmq.Context()
+        self._context = context
         ctrl_socket = None
 
         try:
             inputs_list = self._inputs.split(',')
 
             # Control socket
-            ctrl_address = "tcp://*:" + self._ctrl_port
-            self.logger.info('Binding control address to ' + ctrl_address)
-            ctrl_socket = context.socket(zmq.ROUTER)
-            ctrl_socket.bind(ctrl_address)
+            ctrl_socket = self.create_control_socket(context)
 
             # Socket to receive messages on
             for x in inputs_list:
-                new_receiver = context.socket(zmq.SUB)
-                new_receiver.set_hwm(10000)
-                new_receiver.connect(x)
-                new_receiver.setsockopt(zmq.SUBSCRIBE, '')
-                receiver_list.append(new_receiver)
+                receiver_list.append(self.create_input_socket(context, x))
 
             poller = zmq.Poller()
             for eachReceiver in receiver_list:
@@ -74,21 +238,37 @@ class MetaListener:
 
             self.logger.info('Listening to inputs ' + str(inputs_list))
 
+            self._writer_thread = threading.Thread(target=self.write_loop, name='meta_writer')
+            self._writer_thread.daemon = True
+            self._writer_thread.start()
+
+            if self._prewarm:
+                self.queue_call(self.prewarm_writer)
+
+            if self._publish:
+                self.queue_call(self.open_publisher)
+
             while self._kill_requested == False:
-                socks = dict(poller.poll())
-                for receiver in receiver_list:
+                socks = dict(poller.poll(self.FLUSH_CHECK_INTERVAL))
+                for index, receiver in enumerate(receiver_list):
                     if socks.get(receiver) == zmq.POLLIN:
-                        self.handle_message(receiver)
+                        self.drain_messages(receiver, index)
 
                 if socks.get(ctrl_socket) == zmq.POLLIN:
                     self.handle_control_message(ctrl_socket)
 
-            self.stop_all_writers()
+                self.submit_batch()
 
             self.logger.info('Finished listening')
         except Exception as err:
             self.logger.error('Unexpected Exception: ' + str(err))
 
+        # Write any remaining messages before stopping the writers
+        self.stop_writer_thread()
+        self.stop_all_writers()
+        self.wait_for_file_moves()
+        self.close_publisher()
+
         # Finished
         for receiver in receiver_list:
             receiver.close(linger=0)
@@ -101,6 +281,33 @@ class MetaListener:
         self.logger.info("Finished run")
         return
 
+    def create_control_socket(self, context):
+        """Create the control socket and bind it to the control port.
+
+        :param: context: ZeroMQ context to create the socket in
+        """
+        if '://' in self._ctrl_port:
+            ctrl_address = self._ctrl_port
+        else:
+            ctrl_address = "tcp://*:" + self._ctrl_port
+        self.logger.info('Binding control address to ' + ctrl_address)
+        ctrl_socket = context.socket(zmq.ROUTER)
+        ctrl_socket.bind(ctrl_address)
+        return ctrl_socket
+
+    def create_input_socket(self, context, endpoint):
+        """Create a socket to receive meta messages and connect it to an input.
+
+        :param: context: ZeroMQ context to create the socket in
+        :param: endpoint: ZeroMQ address of the input
+        """
+        receiver = context.socket(self._input_type)
+        receiver.set_hwm(10000)
+        receiver.connect(endpoint)
+        if self._input_type == zmq.SUB:
+            receiver.setsockopt(zmq.SUBSCRIBE, b'')
+        return receiver
+
     def handle_control_message(self, receiver):
         """Handle control message.
 
@@ -144,23 +351,20 @@ class MetaListener:
         :param: msg_id: message id to use for reply
         """
         status_dict = {}
-        for key in self._writers:
-            writer = self._writers[key]
+        for key, writer in self._writers.items():
             status_dict[key] = {'filename': writer.full_file_name, 'num_processors': writer.number_processes_running,
-                                'written': writer.write_count, 'writing': writer.file_created and not writer.finished}
+                                'written': writer.write_count, 'writing': writer.file_created and not writer.finished,
+                                'frame_sequence': writer.frame_sequence_status(),
+                                'file_move': writer.file_move_status()}
             writer.write_timeout_count = writer.write_timeout_count + 1
 
         reply = IpcMessage(IpcMessage.ACK, 'status', id=msg_id)
         reply.set_param('acquisitions', status_dict)
-
-        # Now delete any finished acquisitions, and stop any stagnant ones
-        for key, value in self._writers.items():
-            if value.finished:
-                del self._writers[key]
-            else:
-                if value.number_processes_running == 0 and value.write_timeout_count > 10 and value.file_created:
-                    self.logger.info('Force stopping stagnant acquisition: ' + str(key))
-                    value.stop()
+        reply.set_param('writer_queue', self.writer_queue_status())
+        reply.set_param('inputs', self.input_status())
+        reply.set_param('writers', self._writers.status())
+        if self._publisher is not None:
+            reply.set_param('publisher', self._publisher.status())
 
         return reply
 
@@ -170,14 +374,25 @@ class MetaListener:
         :param: msg_id: message id to use for reply
         """
         acquisitions_dict = {}
-        for key in self._writers:
-            writer = self._writers[key]
+        for key, writer in self._writers.items():
             acquisitions_dict[key] = {'output_dir': writer.directory, 'flush': writer.flush_frequency,
-                                      'file_prefix': writer.file_prefix}
+                                      'file_prefix': writer.file_prefix, 'swmr': writer.swmr,
+                                      'storage': writer.storage, 'scratch_dir': writer.scratch_directory,
+                                      'join': writer.frame_join is not None}
 
         reply = IpcMessage(IpcMessage.ACK, 'request_configuration', id=msg_id)
         reply.set_param('acquisitions', acquisitions_dict)
         reply.set_param('inputs', self._inputs)
+        reply.set_param('drain_size', self._drain_size)
+        reply.set_param('prewarm', self._prewarm)
+        reply.set_param('journal', self._journal)
+        reply.set_param('max_open_writers', self._writers.max_open)
+        reply.set_param('max_finished_writers', self._writers.max_finished)
+        reply.set_param('idle_timeout', self._idle_timeout)
+        reply.set_param('publish', self._publish)
+        reply.set_param('publish_interval', self._publish_interval)
+        reply.set_param('publish_conflate', self._publish_conflate)
+        reply.set_param('publish_grace', self._publish_grace)
         reply.set_param('default_directory', self._directory)
         reply.set_param('ctrl_port', self._ctrl_port)
         return reply
@@ -188,23 +403,9 @@ class MetaListener:
         :param: msg_id: message id to use for reply
         """
         reply = IpcMessage(IpcMessage.ACK, 'request_version', id=msg_id)
-        
-        version=versioneer.get_versions()["version"]
-        major_version = re.findall(MAJOR_VER_REGEX, version)[0]
-        minor_version = re.findall(MINOR_VER_REGEX, version)[0]
-        patch_version = re.findall(PATCH_VER_REGEX, version)[0]
-        short_version = major_version + "." + minor_version + "." + patch_version
-        
+
         version_dict = {}
-        odin_data_dict = {}
-        
-        odin_data_dict["full"] = version
-        odin_data_dict["major"] = major_version
-        odin_data_dict["minor"] = minor_version
-        odin_data_dict["patch"] = patch_version
-        odin_data_dict["short"] = short_version
-        
-        version_dict["odin-data"] = odin_data_dict
+        version_dict["odin-data"] = self._version
         version_dict["writer"] = self.get_writer_version()
         
         reply.set_param('version', version_dict)
@@ -225,7 +426,53 @@ class MetaListener:
             self._kill_requested = True
         elif 'writer' in params:
             self.logger.info('Setting writer module to ' + str(params['writer']))
-            self._writer_module = params['writer']
+            try:
+                self._registry.writer_class(params['writer'])
+                self._writer_module = params['writer']
+                self._registry.clear_spares()
+                if self._prewarm:
+                    self.queue_call(self.prewarm_writer)
+                reply = IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
+            except Exception as err:
+                self.logger.error('Unable to load writer module ' + str(params['writer']) + ': ' + str(err))
+                reply.set_param('error', 'Unable to load writer module: ' + str(err))
+        elif 'drain_size' in params:
+            self.logger.info('Setting drain size to ' + str(params['drain_size']))
+            self._drain_size = max(int(params['drain_size']), 1)
+            reply = IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
+        elif 'prewarm' in params:
+            self.logger.info('Setting writer pre-warming to ' + str(params['prewarm']))
+            self._prewarm = str(params['prewarm']).lower() in ('true', '1')
+            if self._prewarm:
+                self.queue_call(self.prewarm_writer)
+            else:
+                self._registry.clear_spares()
+            reply = IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
+        elif 'journal' in params:
+            self.logger.info('Setting message journalling to ' + str(params['journal']))
+            self._journal = str(params['journal']).lower() in ('true', '1')
+            reply = IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
+        elif 'max_open_writers' in params or 'max_finished_writers' in params or 'idle_timeout' in params:
+            if 'max_open_writers' in params:
+                self.logger.info('Setting maximum open writers to ' + str(params['max_open_writers']))
+                self._writers.max_open = max(int(params['max_open_writers']), 1)
+            if 'max_finished_writers' in params:
+                self.logger.info('Setting maximum finished writers to ' + str(params['max_finished_writers']))
+                self._writers.max_finished = max(int(params['max_finished_writers']), 0)
+            if 'idle_timeout' in params:
+                self.logger.info('Setting idle writer timeout to ' + str(params['idle_timeout']))
+                self._idle_timeout = max(float(params['idle_timeout']), 0.0)
+            reply = IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
+        elif 'publish' in params:
+            self.logger.info('Setting per-frame publishing to ' + str(params['publish']))
+            self._publish = params['publish'] or ''
+            if 'publish_interval' in params:
+                self._publish_interval = max(float(params['publish_interval']), 0.0)
+            if 'publish_conflate' in params:
+                self._publish_conflate = max(int(params['publish_conflate']), 0)
+            if 'publish_grace' in params:
+                self._publish_grace = max(float(params['publish_grace']), 0.0)
+            self.queue_call(self.open_publisher)
             reply = IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
         elif 'acquisition_id' in params:
             acquisition_id = params['acquisition_id']
@@ -235,43 +482,81 @@ class MetaListener:
                     self.logger.debug('Writer is in writers for acq ' + str(acquisition_id))
                 else:
                     self.logger.debug('Writer not in writers for acquisition [' + str(acquisition_id) + ']')
+                    if self._writers.full():
+                        self.logger.error('Unable to create acquisition [' + str(acquisition_id) +
+                                          ']: too many writers in use')
+                        reply.set_param('error', 'Too many writers in use, maximum is ' +
+                                        str(self._writers.max_open))
+                        return reply
                     self.logger.debug(
                         'Creating new acquisition [' + str(acquisition_id) + '] with default directory ' + str(
                             self._directory))
                     self.create_new_acquisition(self._directory, acquisition_id)
 
+                # The writer is configured on the writer thread, after the messages already received
+                writer = self._writers[acquisition_id]
+
                 if 'output_dir' in params:
                     self.logger.debug('Setting acquisition [' + str(acquisition_id) + '] directory to ' + str(
                         params['output_dir']))
-                    self._writers[acquisition_id].directory = params['output_dir']
+                    self.queue_call(setattr, writer, 'directory', params['output_dir'])
+                    reply = IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
+
+                if 'scratch_dir' in params:
+                    self.logger.debug('Setting acquisition [' + str(acquisition_id) + '] scratch directory to ' + str(
+                        params['scratch_dir']))
+                    self.queue_call(setattr, writer, 'scratch_directory', params['scratch_dir'])
                     reply = IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
 
                 if 'file_prefix' in params:
                     self.logger.debug('Setting acquisition [' + str(acquisition_id) + '] file_prefix to ' + str(
                         params['file_prefix']))
-                    self._writers[acquisition_id].file_prefix = params['file_prefix']
+                    self.queue_call(setattr, writer, 'file_prefix', params['file_prefix'])
                     reply = IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
 
                 if 'flush' in params:
                     self.logger.debug(
                         'Setting acquisition [' + str(acquisition_id) + '] flush to ' + str(params['flush']))
-                    self._writers[acquisition_id].flush_frequency = int(params['flush'])
+                    self.queue_call(setattr, writer, 'flush_frequency', int(params['flush']))
                     reply = IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
 
                 if 'flush_timeout' in params:
                     self.logger.debug('Setting acquisition [' + str(acquisition_id) + '] flush timeout to ' + str(
                         params['flush_timeout']))
-                    self._writers[acquisition_id].flush_timeout = int(params['flush_timeout'])
+                    self.queue_call(setattr, writer, 'flush_timeout', int(params['flush_timeout']))
+                    reply = IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
+
+                if 'swmr' in params:
+                    self.logger.debug('Setting acquisition [' + str(acquisition_id) + '] SWMR mode to ' + str(
+                        params['swmr']))
+                    self.queue_call(setattr, writer, 'swmr', str(params['swmr']).lower() in ('true', '1'))
                     reply = IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
 
+                if 'join' in params:
+                    self.logger.debug('Setting acquisition [' + str(acquisition_id) + '] frame join to ' + str(
+                        params['join']))
+                    self.queue_call(self.set_frame_join, writer, str(params['join']).lower() in ('true', '1'))
+                    reply = IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
+
+                if 'storage' in params:
+                    self.logger.debug('Setting acquisition [' + str(acquisition_id) + '] storage to ' + str(
+                        params['storage']))
+                    if params['storage'] in STORAGE_BACKENDS:
+                        self.queue_call(setattr, writer, 'storage', params['storage'])
+                        reply = IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
+                    else:
+                        reply = IpcMessage(IpcMessage.NACK, 'configure', id=msg_id)
+                        reply.set_param('error', 'Unknown storage backend: ' + str(params['storage']))
+
                 if 'stop' in params:
                     self.logger.info('Stopping acquisition [' + str(acquisition_id) + ']')
-                    self._writers[acquisition_id].stop()
+                    # Stop once the messages already received for the acquisition are written
+                    self.queue_call(self.stop_writer, writer)
                     reply = IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
             else:
                 # If the command is to stop without an acqID then stop all acquisitions
                 if 'stop' in params:
-                    self.stop_all_writers()
+                    self.queue_call(self.stop_all_writers)
                     reply = IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
                 else:
                     reply = IpcMessage(IpcMessage.NACK, 'configure', id=msg_id)
@@ -282,15 +567,178 @@ class MetaListener:
             reply.set_param('error', 'No params in config')
         return reply
 
-    def handle_message(self, receiver):
+    def handle_message(self, receiver, input_index=0):
         """Handle a meta data message.
 
+        All parts of the message are read and added to the current batch for the writer thread.
+
         :param: receiver: ZeroMQ channel to read message from
+        :param: input_index: Index of the input the channel is connected to
         """
         self.logger.debug('Handling message')
 
         try:
-            message = receiver.recv_json()
+            parts = receiver.recv_multipart(copy=False)
+            self.count_received(input_index)
+            self.queue_message(parts, input_index)
+        except Exception as err:
+            self.logger.error('Unexpected Exception receiving message: ' + str(err))
+
+    def drain_messages(self, receiver, input_index=0):
+        """Read all waiting meta data messages from a socket, up to the drain size.
+
+        The messages are added to the current batch for the writer thread, so that a burst of
+        messages is handled in one poll rather than one poll per message.
+
+        :param: receiver: ZeroMQ channel to read messages from
+        :param: input_index: Index of the input the channel is connected to
+        """
+        for _ in range(self._drain_size):
+            try:
+                parts = receiver.recv_multipart(zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                break
+            except Exception as err:
+                self.logger.error('Unexpected Exception receiving message: ' + str(err))
+                break
+            self.count_received(input_index)
+            self.queue_message(parts, input_index)
+
+    def count_received(self, input_index):
+        """Count a message received on an input."""
+        self._messages_received += 1
+        self._input_received[input_index] = self._input_received.get(input_index, 0) + 1
+
+    def queue_message(self, parts, input_index=0):
+        """Add a received message to the current batch, or write it if there is no writer thread.
+
+        :param: parts: List of message parts
+        :param: input_index: Index of the input the message was received on
+        """
+        self.queue_call(self.write_message, parts, input_index)
+
+    def set_frame_join(self, writer, join):
+        """Enable or disable joining the per-frame values of a writer across ranks.
+
+        :param: writer: The writer of the acquisition
+        :param: join: Whether to join per-frame values
+        """
+        if not join:
+            writer.frame_join = None
+        elif writer.frame_join is None:
+            writer.frame_join = FrameJoin()
+
+    def queue_call(self, function, *args):
+        """Add a call to the current batch, so that it is made after the messages already received.
+
+        :param: function: Function to call on the writer thread
+        :param: args: Arguments to call the function with
+        """
+        if self._writer_thread is None:
+            function(*args)
+        else:
+            self._batch.append((function, args))
+
+    def submit_batch(self):
+        """Pass the current batch to the writer thread.
+
+        The batch is held back to collect further messages while the writer queue is full, until
+        it reaches the maximum batch size, at which point receiving blocks until there is space.
+        """
+        if not self._batch or self._writer_thread is None:
+            return
+        try:
+            self._writer_queue.put_nowait(self._batch)
+        except queue.Full:
+            self._queue_full_count += 1
+            if len(self._batch) < self.MAX_BATCH_MESSAGES:
+                return
+            self.logger.warn('Writer queue full, blocking receipt of meta messages')
+            self._stall_count += 1
+            start = time.time()
+            self._writer_queue.put(self._batch)
+            self._stall_time += time.time() - start
+        self._batch = []
+
+    def write_loop(self):
+        """Writer thread loop, writing batches of messages from the writer queue."""
+        while True:
+            try:
+                batch = self._writer_queue.get(timeout=self.FLUSH_CHECK_INTERVAL / 1000.0)
+            except queue.Empty:
+                self.check_flush_timeouts()
+                self.check_writers()
+                self.publish_frames()
+                continue
+
+            if batch is None:
+                break
+
+            for function, args in batch:
+                try:
+                    function(*args)
+                except Exception as err:
+                    self.logger.error('Unexpected Exception in writer call: ' + str(err))
+            self.check_flush_timeouts()
+            self.check_writers()
+            self.publish_frames()
+
+        # The publish socket was created on this thread, so it is closed on it
+        self.close_publisher()
+
+    def stop_writer_thread(self):
+        """Write any remaining batches and stop the writer thread."""
+        if self._writer_thread is None:
+            return
+        if self._batch:
+            self._writer_queue.put(self._batch)
+            self._batch = []
+        self._writer_queue.put(None)
+        self._writer_thread.join()
+        self._writer_thread = None
+
+    def writer_queue_status(self):
+        """Return the status of the writer queue."""
+        return {
+            'depth': self._writer_queue.qsize(),
+            'batch': len(self._batch),
+            'received': self._messages_received,
+            'written': self._messages_written,
+            'queue_full': self._queue_full_count,
+            'stalls': self._stall_count,
+            'stall_time': self._stall_time
+        }
+
+    def input_status(self):
+        """Return the number of messages received and frames missing on each input.
+
+        SUB sockets silently drop messages when their high water mark is reached, so frames
+        missing from the streams of an input are the measure of messages dropped.
+        """
+        inputs = {}
+        for index, endpoint in enumerate(self._inputs.split(',')):
+            inputs[str(index)] = {'endpoint': endpoint, 'received': self._input_received.get(index, 0),
+                                  'missing': 0, 'duplicates': 0}
+        for writer in list(self._writers.values()):
+            for stream, sequence in list(writer.frame_sequences.items()):
+                if str(stream[0]) in inputs:
+                    inputs[str(stream[0])]['missing'] += sequence.missing
+                    inputs[str(stream[0])]['duplicates'] += sequence.duplicates
+        return inputs
+
+    def write_message(self, parts, input_index=0):
+        """Pass a received meta data message to the writer for its acquisition.
+
+        If the message header has a type the data part is decoded and passed to the writer as
+        the 'value' item of the message.  The data part can still be read from the receiver.
+        The frame number of the message, if any, is recorded so that frames missing from each
+        stream of messages are reported.
+
+        :param: parts: List of message parts
+        :param: input_index: Index of the input the message was received on
+        """
+        try:
+            message = json.loads(part_bytes(parts[0]))
             self.logger.debug(message)
             userheader = message['header']
 
@@ -300,24 +748,81 @@ class MetaListener:
                 self.logger.warn('Didnt have acquisition id in header')
                 acquisition_id = ''
 
-            if acquisition_id not in self._writers:
+            writer = self._writers.get(acquisition_id)
+            if writer is None:
                 self.logger.error('No writer for acquisition [' + acquisition_id + ']')
-                receiver.recv()
                 return
-
-            writer = self._writers[acquisition_id]
+            self._writers.touch(acquisition_id)
 
             if writer.finished:
                 self.logger.error('Writer finished for acquisition [' + acquisition_id + ']')
-                receiver.recv()
                 return
 
-            writer.process_message(message, userheader, receiver)
+            if 'type' in message and len(parts) > 1:
+                try:
+                    message['value'] = decode_meta_value(message, parts[1])
+                except Exception as err:
+                    self.logger.warn('Unable to decode meta value: ' + str(err))
+
+            frame = meta_frame_number(message)
+            if frame is not None:
+                stream = (input_index, message.get('plugin'), message.get('parameter'))
+                writer.update_frame_sequence(stream, frame)
+                column, value = meta_frame_value(message)
+                if value is not None:
+                    # Without a rank in the message, each frameProcessor rank normally publishes on its own input
+                    rank = meta_rank(message, input_index)
+                    writer.add_joined_value(column, frame, rank, value)
+                    if self._publisher is not None:
+                        self._publisher.add_value(acquisition_id, frame, rank, column, value)
+
+            if self._journal:
+                self.journal_message(acquisition_id, writer, parts, input_index)
+
+            writer.process_message(message, userheader, ReceivedMessage(parts[1:]))
+
+            if writer.finished:
+                self.close_journal(writer)
 
         except Exception as err:
             self.logger.error('Unexpected Exception handling message: ' + str(err))
+        finally:
+            self._messages_written += 1
 
-        return
+    def journal_message(self, acquisition_id, writer, parts, input_index=0):
+        """Append a message to the journal of its acquisition, creating the journal if needed.
+
+        :param: acquisition_id: Acquisition ID of the message
+        :param: writer: The writer of the acquisition
+        :param: parts: List of message parts
+        :param: input_index: Index of the input the message was received on
+        """
+        try:
+            journal = self._journals.get(acquisition_id)
+            if journal is None:
+                # Journal to the local scratch directory if there is one, as it is written per message
+                directory = writer.scratch_directory or writer.directory
+                file_name = os.path.join(directory, (writer.file_prefix or acquisition_id) + JOURNAL_SUFFIX)
+                header = {'acquisition_id': acquisition_id, 'writer': self._writer_module,
+                          'directory': writer.directory, 'file_prefix': writer.file_prefix,
+                          'flush': writer.flush_frequency, 'swmr': writer.swmr,
+                          'storage': writer.storage, 'join': writer.frame_join is not None}
+                self.logger.info('Journalling acquisition [' + str(acquisition_id) + '] to ' + file_name)
+                journal = MetaJournal(file_name, header)
+                self._journals[acquisition_id] = journal
+            journal.append([part_bytes(part) for part in parts], input_index)
+        except Exception as err:
+            self.logger.error('Unable to journal message for acquisition [' + str(acquisition_id) + ']: ' + str(err))
+
+    def close_journal(self, writer):
+        """Close and remove the journal of a writer, which is no longer needed once it has finished.
+
+        :param: writer: The writer of the acquisition
+        """
+        for acquisition_id, journal in list(self._journals.items()):
+            if self._writers.get(acquisition_id) is writer:
+                journal.close(remove=True)
+                del self._journals[acquisition_id]
 
     def create_new_acquisition(self, directory, acquisition_id):
         """Create a new writer to handle meta messages for a new acquisition.
@@ -325,54 +830,124 @@ class MetaListener:
         :param: directory: Directory to create the meta file in
         :param: acquisition_id: Acquisition ID of the new acquisition
         """
-        # First finish any acquisition that is queued up already which hasn't started
-        for key, value in self._writers.items():
-            if value.finished == False and value.number_processes_running == 0 and value.file_created == False:
-                self.logger.info('Force finishing unused acquisition: ' + str(key))
-                value.finished = True
+        # First finish any acquisition that is queued up already which hasn't started, once the
+        # messages already received, which may start it, are written
+        self.queue_call(self.finish_unused_writers, self._writers.keys())
 
         # Now create new acquisition
         self.logger.info('Creating new acquisition [' + str(acquisition_id) + '] with directory ' + str(directory))
         self._writers[acquisition_id] = self.create_new_writer(directory, acquisition_id)
 
-        # Then check if we have built up too many finished acquisitions and delete them if so
-        if len(self._writers) > 3:
-            for key, value in self._writers.items():
-                if value.finished:
-                    del self._writers[key]
-                    
+        # Create the writer for the next acquisition once the messages already received are written
+        if self._prewarm:
+            self.queue_call(self.prewarm_writer)
+
+    def finish_unused_writers(self, acquisition_ids):
+        """Force finish the writers of acquisitions that have not been started.
+
+        :param: acquisition_ids: List of the acquisition IDs to check
+        """
+        for key in acquisition_ids:
+            value = self._writers.get(key)
+            if value is None:
+                continue
+            if value.finished == False and value.number_processes_running == 0 and value.file_created == False:
+                self.logger.info('Force finishing unused acquisition: ' + str(key))
+                value.finished = True
+
+    def check_flush_timeouts(self):
+        """Flush any writers whose flush timeout has expired."""
+        for key, writer in self._writers.items():
+            if writer.file_created and not writer.finished:
+                try:
+                    writer.check_flush_timeout()
+                except Exception as err:
+                    self.logger.error('Unexpected Exception flushing acquisition [' + str(key) + ']: ' + str(err))
+
+    def check_writers(self):
+        """Close writers that are idle, and evict finished writers."""
+        for key, writer, reason in self._writers.writers_to_close(self._idle_timeout):
+            self.logger.info('Force stopping acquisition [' + str(key) + ']: ' + reason)
+            try:
+                self.stop_writer(writer)
+            except Exception as err:
+                self.logger.error('Unexpected Exception stopping acquisition [' + str(key) + ']: ' + str(err))
+        self._writers.evict_finished()
+
+    def open_publisher(self):
+        """Bind a socket to republish per-frame meta data on, replacing any existing socket."""
+        self.close_publisher()
+        if not self._publish:
+            return
+        try:
+            context = self._context if self._context is not None else zmq.Context.instance()
+            socket = context.socket(zmq.XPUB)
+            socket.bind(self._publish)
+            self._publisher = FramePublisher(socket, self._publish_interval, self._publish_conflate,
+                                             self._publish_grace)
+            self.logger.info('Publishing per-frame meta data on ' + self._publish)
+        except Exception as err:
+            self.logger.error('Unable to publish per-frame meta data on ' + self._publish + ': ' + str(err))
+
+    def publish_frames(self):
+        """Publish the per-frame meta data received since the last publish interval."""
+        if self._publisher is None:
+            return
+        try:
+            self._publisher.publish()
+        except Exception as err:
+            self.logger.error('Unexpected Exception publishing per-frame meta data: ' + str(err))
+
+    def close_publisher(self):
+        """Publish any remaining per-frame meta data and close the publish socket."""
+        if self._publisher is None:
+            return
+        publisher = self._publisher
+        self._publisher = None
+        try:
+            publisher.close()
+        except Exception as err:
+            self.logger.error('Unexpected Exception closing per-frame publisher: ' + str(err))
+
+    def stop_writer(self, writer):
+        """Stop a writer unless it has already finished.
+
+        :param: writer: The writer to stop
+        """
+        if not writer.finished:
+            writer.stop()
+        self.close_journal(writer)
+
     def stop_all_writers(self):
         """Force stop all writers."""
-        for key in self._writers:
+        for key, writer in self._writers.items():
             self.logger.info('Forcing close of writer for acquisition: ' + str(key))
-            writer = self._writers[key]
-            writer.stop()
+            self.stop_writer(writer)
+
+    def wait_for_file_moves(self):
+        """Wait for the files of finished writers to be moved to their destination."""
+        for key, writer in self._writers.items():
+            if writer.moving_file:
+                self.logger.info('Waiting for file of acquisition [' + str(key) + '] to be moved')
+                writer.file_mover.wait()
 
     def create_new_writer(self, directory, acquisition_id):
         """Create a the appropriate writer object.
 
         :param: directory: Directory to create the meta file in
         :param: acquisition_id: Acquisition ID of the new acquisition
-        """        
-        if self._writer_module is None:
-            raise Exception('No writer class configured')
-        
-        module_name = self._writer_module[:self._writer_module.rfind('.')]
-        class_name = self._writer_module[self._writer_module.rfind('.') + 1:]        
-        module = importlib.import_module(module_name, package=None)
-        writer_class = getattr(module, class_name)
-        writer_instance = writer_class(self.logger, directory, acquisition_id)
+        """
+        writer_instance = self._registry.create_writer(self._writer_module, directory, acquisition_id)
         self.logger.debug(writer_instance)
         return writer_instance
 
+    def prewarm_writer(self):
+        """Create a writer in advance of the next acquisition."""
+        try:
+            self._registry.prewarm(self._writer_module, self._directory)
+        except Exception as err:
+            self.logger.error('Unable to pre-warm writer: ' + str(err))
+
     def get_writer_version(self):
         """Get the version from the writer object."""
-        if self._writer_module is None:
-            raise Exception('No writer class configured')
-          
-        module_name = self._writer_module[:self._writer_module.rfind('.')]
-        class_name = self._writer_module[self._writer_module.rfind('.') + 1:]
-        module = importlib.import_module(module_name, package=None)
-        writer_class = getattr(module, class_name)
-        writer_version = writer_class.get_version()
-        return writer_version
+        return self._registry.writer_version(self._writer_module)
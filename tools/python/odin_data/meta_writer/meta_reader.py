@@ -0,0 +1,64 @@
+"""Implementation of odin_data Meta Reader
+
+This module reads meta data files while they are still being written by a MetaWriter in SWMR
+mode, returning the values appended to each dataset since they were last read.
+"""
+import h5py
+import time
+
+
+class MetaReader(object):
+    """Meta Reader class.
+
+    This class polls a meta file written in SWMR mode for new values
+    """
+
+    def __init__(self, file_name, datasets=None):
+        """Initalise the MetaReader object.
+
+        :param file_name: Full path of the meta file to read
+        :param datasets: Names of the datasets to read, all datasets in the file if None
+        """
+        self._hdf5_file = h5py.File(file_name, 'r', libver='latest', swmr=True)
+        if datasets is None:
+            datasets = [name for name in self._hdf5_file if isinstance(self._hdf5_file[name], h5py.Dataset)]
+        self._datasets = dict((name, self._hdf5_file[name]) for name in datasets)
+        self._read_lengths = dict((name, 0) for name in datasets)
+
+    def lengths(self):
+        """Return the number of values currently written to each dataset."""
+        lengths = {}
+        for name, dataset in self._datasets.items():
+            dataset.refresh()
+            lengths[name] = dataset.shape[0]
+        return lengths
+
+    def read_new(self):
+        """Read the values appended to each dataset since the last read.
+
+        :return: Dictionary of dataset name to array of new values, for datasets that have grown
+        """
+        new_values = {}
+        for name, length in self.lengths().items():
+            if length > self._read_lengths[name]:
+                new_values[name] = self._datasets[name][self._read_lengths[name]:length]
+                self._read_lengths[name] = length
+        return new_values
+
+    def poll(self, timeout=None, interval=0.1):
+        """Wait for any dataset to grow and return the new values.
+
+        :param timeout: Maximum time in seconds to wait, or None to wait forever
+        :param interval: Time in seconds between checks of the file
+        :return: Dictionary of dataset name to array of new values, empty if the timeout expired
+        """
+        start = time.time()
+        while True:
+            new_values = self.read_new()
+            if new_values or (timeout is not None and time.time() - start >= timeout):
+                return new_values
+            time.sleep(interval)
+
+    def close(self):
+        """Close the meta file."""
+        self._hdf5_file.close()
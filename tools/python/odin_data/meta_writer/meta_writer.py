@@ -5,10 +5,402 @@ Will need to be subclassed by detector specific implementation.
 
 Matt Taylor, Diamond Light Source
 """
-import h5py
+import collections
+import json
+import numpy
 import os
 import time
 
+from odin_data.meta_writer.file_mover import FileMover
+from odin_data.meta_writer.storage import STORAGE_BACKENDS, Hdf5Storage
+
+
+class DatasetBuffer(object):
+    """Growable NumPy buffer of the values for a single dataset.
+
+    Values are stored in a preallocated array of the dataset dtype which doubles in size when full,
+    so that appending a value or a batch of values does not allocate a Python object per value.
+    """
+
+    INITIAL_SIZE = 1024
+
+    def __init__(self, dtype, value_shape=(), initial_size=INITIAL_SIZE):
+        """Initialise the DatasetBuffer object.
+
+        :param dtype: The type of data
+        :param value_shape: Shape of a single value in the dataset
+        :param initial_size: Number of values to allocate space for initially
+        """
+        self._array = numpy.empty((max(initial_size, 1),) + tuple(value_shape), dtype=dtype)
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __array__(self, dtype=None):
+        # Writers that assign the buffer to a dataset, as they did with lists, write its values
+        if dtype is None:
+            return self.values
+        return self.values.astype(dtype)
+
+    @property
+    def dtype(self):
+        """Return the dtype of the buffer."""
+        return self._array.dtype
+
+    @property
+    def values(self):
+        """Return a view of the values held in the buffer."""
+        return self._array[:self._length]
+
+    def _reserve(self, length):
+        if length > len(self._array):
+            size = len(self._array)
+            while size < length:
+                size *= 2
+            array = numpy.empty((size,) + self._array.shape[1:], dtype=self._array.dtype)
+            array[:self._length] = self._array[:self._length]
+            self._array = array
+
+    def append(self, value):
+        """Append a single value to the buffer.
+
+        :param value: The value to append
+        """
+        self._reserve(self._length + 1)
+        self._array[self._length] = value
+        self._length += 1
+
+    def extend(self, values):
+        """Append an array of values to the buffer.
+
+        :param values: Array of values, the first dimension indexing the values
+        """
+        values = numpy.asarray(values, dtype=self._array.dtype)
+        if values.ndim == len(self._array.shape) - 1:
+            values = values.reshape((1,) + values.shape)
+        self._reserve(self._length + len(values))
+        self._array[self._length:self._length + len(values)] = values
+        self._length += len(values)
+
+    def clear(self):
+        """Discard the values held in the buffer, keeping the allocated space."""
+        self._length = 0
+
+
+class FrameBitmap(object):
+    """Record of the frame numbers received for a parameter, across all of its streams.
+
+    Frames are marked in a boolean array indexed by frame number, which doubles in size when a
+    higher frame is received, so frames can be received in any order or distribution.
+    """
+
+    INITIAL_SIZE = 1024
+
+    def __init__(self):
+        """Initialise the FrameBitmap object."""
+        self._received = numpy.zeros(self.INITIAL_SIZE, dtype=bool)
+        self.first = None
+        self.highest = None
+
+    def add(self, frame):
+        """Mark a frame as received.
+
+        :param frame: The frame number
+        :return: Whether the frame had already been received
+        """
+        if frame >= len(self._received):
+            size = len(self._received)
+            while size <= frame:
+                size *= 2
+            received = numpy.zeros(size, dtype=bool)
+            received[:len(self._received)] = self._received
+            self._received = received
+        if self._received[frame]:
+            return True
+        self._received[frame] = True
+        self.first = frame if self.first is None else min(self.first, frame)
+        self.highest = frame if self.highest is None else max(self.highest, frame)
+        return False
+
+    def missing(self, first=None, last=None):
+        """Return the number of frames not received in a range, by default all frames received.
+
+        :param first: The first frame of the range
+        :param last: The last frame of the range, inclusive
+        """
+        first = self.first if first is None else first
+        last = self.highest if last is None else last
+        if first is None or last is None or last < first:
+            return 0
+        return (last - first + 1) - int(numpy.count_nonzero(self._received[first:last + 1]))
+
+
+class FrameSequence(object):
+    """Frame number accounting for a single stream of meta messages.
+
+    When several frameProcessors are running each one publishes a share of the frames, in any
+    distribution, so the frames received on every stream of a parameter are marked in a shared
+    FrameBitmap.  Frames are counted as missing from a stream if no stream of the parameter has
+    received them within the range of frames of the stream, and as duplicates if they have
+    already been received on any stream.
+    """
+
+    def __init__(self, bitmap=None):
+        """Initialise the FrameSequence object.
+
+        :param bitmap: FrameBitmap shared by the streams of the parameter, or None for a new one
+        """
+        self.bitmap = bitmap if bitmap is not None else FrameBitmap()
+        self.first = None
+        self.last = None
+        self.highest = None
+        self.received = 0
+        self.duplicates = 0
+        self.out_of_order = 0
+        self.invalid = 0
+
+    def update(self, frame):
+        """Record the frame number of a message.
+
+        :param frame: The frame number
+        """
+        self.received += 1
+        if frame < 0:
+            self.invalid += 1
+            return
+        if self.bitmap.add(frame):
+            self.duplicates += 1
+        if self.last is None:
+            self.first = self.highest = frame
+        else:
+            if frame < self.last:
+                self.out_of_order += 1
+            self.first = min(self.first, frame)
+            self.highest = max(self.highest, frame)
+        self.last = frame
+
+    @property
+    def missing(self):
+        """Return the number of frames missing from the range of frames of the stream."""
+        return self.bitmap.missing(self.first, self.highest)
+
+    def status(self):
+        """Return the counters of the sequence as a dictionary."""
+        return {
+            'received': self.received,
+            'missing': self.missing,
+            'duplicates': self.duplicates,
+            'out_of_order': self.out_of_order,
+            'invalid': self.invalid,
+            'first': self.first,
+            'last': self.highest
+        }
+
+
+class FrameJoin(object):
+    """Join of the per-frame meta values published by each frameProcessor rank.
+
+    Values are buffered per column and merged with vectorised inserts into arrays indexed by frame
+    number, so that the values from every rank form a single table with a row per frame holding
+    the rank that published it and a column per parameter.  Frames without a value for a column
+    hold NaN for floating point columns, the maximum value for unsigned integer columns and -1
+    otherwise.  If a frame is published more than once, the last value is kept.  The type of a
+    column is promoted if a value cannot be held by its current type, e.g. to float for a float
+    value in an integer column, when frames holding the fill value are filled for the new type.
+    """
+
+    INITIAL_SIZE = 1024
+
+    def __init__(self):
+        """Initialise the FrameJoin object."""
+        self._pending = collections.OrderedDict()
+        self._columns = collections.OrderedDict()
+        self._ranks = numpy.empty(0, dtype='int32')
+        self._present = numpy.zeros(0, dtype=bool)
+
+    @staticmethod
+    def fill_value(dtype):
+        """Return the value of a column of the given dtype for frames without a value."""
+        if dtype.kind == 'f':
+            return numpy.nan
+        elif dtype.kind == 'u':
+            return numpy.iinfo(dtype).max
+        elif dtype.kind == 'b':
+            return False
+        return -1
+
+    def _pending_buffers(self, column, dtype):
+        if column not in self._pending:
+            if column in self._columns:
+                dtype = numpy.promote_types(self._columns[column].dtype, dtype)
+            self._pending[column] = (DatasetBuffer('int64'), DatasetBuffer('int32'), DatasetBuffer(dtype))
+        frames, ranks, values = self._pending[column]
+        if not numpy.can_cast(dtype, values.dtype):
+            promoted = DatasetBuffer(numpy.promote_types(values.dtype, dtype), initial_size=len(values))
+            promoted.extend(values.values)
+            self._pending[column] = (frames, ranks, promoted)
+        return self._pending[column]
+
+    def _promote_column(self, column, dtype):
+        array = self._columns[column]
+        if numpy.can_cast(dtype, array.dtype):
+            return
+        promoted = numpy.promote_types(array.dtype, dtype)
+        fill = self.fill_value(array.dtype)
+        filled = numpy.isnan(array) if array.dtype.kind == 'f' else array == fill
+        array = array.astype(promoted)
+        array[filled] = self.fill_value(promoted)
+        self._columns[column] = array
+
+    def add_value(self, column, frame, rank, value):
+        """Add the value of a frame to a column, if it is a numeric scalar.
+
+        :param column: The column name
+        :param frame: The frame number of the value
+        :param rank: The rank of the frameProcessor that published the value
+        :param value: The value of the frame
+        :return: Whether the value was added
+        """
+        value = numpy.asarray(value)
+        if value.ndim != 0 or value.dtype.kind not in 'biuf':
+            return False
+        frames, ranks, values = self._pending_buffers(column, value.dtype)
+        frames.append(frame)
+        ranks.append(rank)
+        values.append(value)
+        return True
+
+    def add_values(self, column, frames, ranks, values):
+        """Add the values of an array of frames to a column.
+
+        :param column: The column name
+        :param frames: Array of frame numbers
+        :param ranks: Rank of the frameProcessor that published each value, or a single rank
+        :param values: Array of numeric values
+        """
+        values = numpy.asarray(values)
+        frames = numpy.asarray(frames, dtype='int64')
+        frame_buffer, rank_buffer, value_buffer = self._pending_buffers(column, values.dtype)
+        frame_buffer.extend(frames)
+        rank_buffer.extend(numpy.broadcast_to(numpy.asarray(ranks, dtype='int32'), frames.shape))
+        value_buffer.extend(values)
+
+    def _grow(self, length):
+        if length <= len(self._present):
+            return
+        size = max(length, 2 * len(self._present), self.INITIAL_SIZE)
+        present = numpy.zeros(size, dtype=bool)
+        present[:len(self._present)] = self._present
+        self._present = present
+        ranks = numpy.full(size, -1, dtype='int32')
+        ranks[:len(self._ranks)] = self._ranks
+        self._ranks = ranks
+        for column, array in self._columns.items():
+            grown = numpy.full(size, self.fill_value(array.dtype), dtype=array.dtype)
+            grown[:len(array)] = array
+            self._columns[column] = grown
+
+    def merge(self):
+        """Merge the buffered values of each column into the table."""
+        for column, (frame_buffer, rank_buffer, value_buffer) in self._pending.items():
+            if len(frame_buffer) == 0:
+                continue
+            valid = frame_buffer.values >= 0
+            frames = frame_buffer.values[valid]
+            if len(frames) > 0:
+                self._grow(int(frames.max()) + 1)
+                if column not in self._columns:
+                    dtype = value_buffer.dtype
+                    self._columns[column] = numpy.full(len(self._present), self.fill_value(dtype), dtype=dtype)
+                else:
+                    self._promote_column(column, value_buffer.dtype)
+                self._columns[column][frames] = value_buffer.values[valid]
+                self._ranks[frames] = rank_buffer.values[valid]
+                self._present[frames] = True
+            frame_buffer.clear()
+            rank_buffer.clear()
+            value_buffer.clear()
+
+    def __len__(self):
+        self.merge()
+        return int(numpy.count_nonzero(self._present))
+
+    def table(self):
+        """Return the joined values as a structured array with a row per frame, in frame order.
+
+        The array has a 'frame' and a 'rank' field followed by a field for each column.
+        """
+        self.merge()
+        rows = numpy.nonzero(self._present)[0]
+        dtype = [('frame', '<i8'), ('rank', '<i4')]
+        dtype += [(str(column), array.dtype) for column, array in self._columns.items()]
+        table = numpy.empty(len(rows), dtype=dtype)
+        table['frame'] = rows
+        table['rank'] = self._ranks[rows]
+        for column, array in self._columns.items():
+            table[str(column)] = array[rows]
+        return table
+
+
+def meta_frame_number(message):
+    """Return the frame number of a meta message, or None if it does not have one.
+
+    The frame number is taken from the 'frame' item of the user header, or for frame written
+    messages from the file writer, from the 'frame' item of the value.
+
+    :param message: The decoded meta message, with any decoded value
+    """
+    userheader = message.get('header')
+    if isinstance(userheader, dict) and 'frame' in userheader:
+        return int(userheader['frame'])
+    if message.get('parameter') == 'writeframe' and 'value' in message:
+        try:
+            return int(json.loads(message['value'])['frame'])
+        except (ValueError, KeyError, TypeError):
+            return None
+    return None
+
+
+def meta_rank(message, default=None):
+    """Return the rank of the frameProcessor that published a meta message.
+
+    For frame written messages from the file writer the rank is taken from the 'rank' item of the
+    value, otherwise from the 'rank' item of the user header.
+
+    :param message: The decoded meta message, with any decoded value
+    :param default: The rank to return if the message does not have one
+    """
+    if message.get('parameter') == 'writeframe' and 'value' in message:
+        try:
+            return int(json.loads(message['value'])['rank'])
+        except (ValueError, KeyError, TypeError):
+            pass
+    userheader = message.get('header')
+    if isinstance(userheader, dict) and 'rank' in userheader:
+        return int(userheader['rank'])
+    return default
+
+
+def meta_frame_value(message):
+    """Return the column name and value of a per-frame meta message, to join across ranks.
+
+    For frame written messages from the file writer this is the offset that the frame was written
+    at in the file of its rank, otherwise it is the parameter and decoded value of the message.
+
+    :param message: The decoded meta message, with any decoded value
+    :return: Tuple of the column name and value, the value None if there is none
+    """
+    if message.get('parameter') == 'writeframe':
+        try:
+            return 'offset', int(json.loads(message['value'])['offset'])
+        except (ValueError, KeyError, TypeError):
+            return 'offset', None
+    return message.get('parameter'), message.get('value')
+
 
 class MetaWriter(object):
     """Meta Writer class.
@@ -17,6 +409,17 @@ class MetaWriter(object):
     """
 
     FILE_SUFFIX = '_meta.h5'
+    # Suffix of the dataset recording which frames of a frame indexed dataset have been written
+    WRITTEN_SUFFIX = '_written'
+    # Name of the dataset of the per-frame values joined across frameProcessor ranks
+    FRAME_TABLE = 'frame_table'
+    # Whether buffered values are flushed to the file by frequency and timeout as they arrive, or
+    # None to do so only if write_datasets is not overridden, as writers that override it write
+    # every buffered value when the file is closed
+    INCREMENTAL_FLUSH = None
+    # Maximum ratio of the span of frames to the number of values for which the values of a frame
+    # indexed dataset are written with a single slice write, merged with the values in the dataset
+    MAX_SPAN_RATIO = 4
 
     def __init__(self, logger, directory, acquisition_id):
         """Initalise the MetaWriter object.
@@ -30,21 +433,53 @@ class MetaWriter(object):
         self._num_frames_to_write = -1
         self.number_processes_running = 0
         self.directory = directory
+        # Local directory to write the file in before moving it to the directory once closed
+        self.scratch_directory = None
         self.file_prefix = None
         self.finished = False
         self.write_count = 0
         self.write_timeout_count = 0
         self.flush_frequency = 100
         self.flush_timeout = None
+        self.swmr = False
+        # Name of the storage backend to write the datasets with
+        self.storage = 'hdf5'
         self._last_flushed = time.time()
         self.file_created = False
+        self._storage = None
+        # The h5py file when writing with the HDF5 storage backend
         self._hdf5_file = None
         self.full_file_name = None
+        self.destination_file_name = None
+        self.file_mover = None
 
         self._data_set_definition = {}
         self._hdf5_datasets = {}
         self._data_set_arrays = {}
+        # Number of values of each dataset already written to the file
+        self._data_set_lengths = {}
+        # Frame numbers of the buffered values of frame indexed datasets
+        self._data_set_frames = {}
+        # Completeness of each frame indexed dataset
+        self._frames_written = {}
+        # Frame number accounting for each stream of messages, keyed by input, plugin and parameter
+        self.frame_sequences = {}
+        # Frames received for each plugin and parameter, shared by the streams of each input
+        self.frame_bitmaps = {}
+        # Join of the per-frame values of each rank, if enabled
+        self.frame_join = None
         
+    def assign_acquisition(self, directory, acquisition_id):
+        """Assign a writer created in advance to an acquisition.
+
+        Override to update any state derived from the acquisition ID in the constructor.
+
+        :param directory: Directory to create the meta file in
+        :param acquisition_id: Acquisition ID of the acquisition
+        """
+        self.directory = directory
+        self._acquisition_id = acquisition_id
+
     @staticmethod    
     def get_version():
         """Override to return the version of the writer class."""
@@ -67,54 +502,89 @@ class MetaWriter(object):
 
     def create_file(self):
         """Create the meta file to write data into."""
+        if self.storage not in STORAGE_BACKENDS:
+            raise ValueError('Unknown storage backend: ' + str(self.storage))
+        storage_class = STORAGE_BACKENDS[self.storage]
+        suffix = self.FILE_SUFFIX if storage_class is Hdf5Storage else storage_class.FILE_SUFFIX
         if self.file_prefix:
-            meta_file_name = self.file_prefix + self.FILE_SUFFIX
+            meta_file_name = self.file_prefix + suffix
         else:
-            meta_file_name = self._acquisition_id + self.FILE_SUFFIX
-        self.full_file_name = os.path.join(self.directory, meta_file_name)
+            meta_file_name = self._acquisition_id + suffix
+        self.destination_file_name = os.path.join(self.directory, meta_file_name)
+        if self.scratch_directory:
+            self.full_file_name = os.path.join(self.scratch_directory, meta_file_name)
+        else:
+            self.full_file_name = self.destination_file_name
         self._logger.info("Writing meta data to: %s" % self.full_file_name)
-        self._hdf5_file = h5py.File(self.full_file_name, "w", libver='latest')
+        self._storage = storage_class(self.full_file_name)
+        self._hdf5_file = getattr(self._storage, 'hdf5_file', None)
         self.create_datasets()
+        if self.swmr:
+            # No objects can be created in the file once it is in SWMR mode
+            self._logger.info("Enabling SWMR mode for: %s" % self.full_file_name)
+            self._storage.enable_swmr()
         self.file_created = True
 
     def create_datasets(self):
         """Create datasets for each definition."""
         for dset_name in self._data_set_definition:
             dset = self._data_set_definition[dset_name]
-            self._data_set_arrays[dset_name] = []
-            self._hdf5_datasets[dset_name] = self._hdf5_file.create_dataset(dset_name,
-                                                                            dset['shape'],
-                                                                            maxshape=dset['maxshape'],
-                                                                            dtype=dset['dtype'],
-                                                                            fillvalue=dset['fillvalue'])
+            self._data_set_arrays[dset_name] = DatasetBuffer(dset['dtype'], dset['shape'][1:])
+            self._data_set_lengths[dset_name] = 0
+            shape = dset['shape']
+            if dset.get('indexed'):
+                # Preallocate space for the expected number of frames
+                shape = (max(shape[0], self._num_frames_to_write),) + tuple(shape[1:])
+                self._data_set_lengths[dset_name] = shape[0]
+                self._data_set_lengths[dset_name + self.WRITTEN_SUFFIX] = shape[0]
+                self._data_set_frames[dset_name] = DatasetBuffer('int64')
+                self._frames_written[dset_name] = numpy.zeros(shape[0], dtype=bool)
+                written_name = dset_name + self.WRITTEN_SUFFIX
+                self._hdf5_datasets[written_name] = self._storage.create_dataset(written_name,
+                                                                                 shape[:1],
+                                                                                 maxshape=dset['maxshape'][:1],
+                                                                                 dtype='uint8',
+                                                                                 fillvalue=0)
+            self._hdf5_datasets[dset_name] = self._storage.create_dataset(dset_name,
+                                                                          shape,
+                                                                          maxshape=dset['maxshape'],
+                                                                          dtype=dset['dtype'],
+                                                                          fillvalue=dset['fillvalue'])
 
     def create_dataset_with_data(self, dset_name, data, shape=None):
         """Create a dataset using pre existing data.
 
+        This is not possible once a file is in SWMR mode, so in SWMR mode datasets must be defined
+        before the file is created.
+
         :param dset_name: The dataset name
         :param data: The data to write
         :param shape: Shape of the data
         """
-        if shape is not None:
-            self._hdf5_datasets[dset_name] = self._hdf5_file.create_dataset(dset_name, shape, data=data)
-        else:
-            self._hdf5_datasets[dset_name] = self._hdf5_file.create_dataset(dset_name, data=data)
+        self._hdf5_datasets[dset_name] = self._storage.create_dataset(dset_name, shape, data=data)
         self._hdf5_datasets[dset_name].flush()
 
-    def add_dataset_definition(self, dset_name, shape, maxshape, dtype, fillvalue):
+    def add_dataset_definition(self, dset_name, shape, maxshape, dtype, fillvalue, indexed=False):
         """Add a dataset definition to the list.
 
+        The values of a frame indexed dataset are written at the offset of their frame number,
+        rather than appended, so they can be added in any order.  Frames without a value hold the
+        fill value, and a companion dataset with the WRITTEN_SUFFIX records which frames have been
+        written.
+
         :param dset_name: The dataset name
         :param shape: Shape of the data
         :param maxshape: The maximum shape of the data
         :param dtype: The type of data
         :param fillvalue: The fill value to use
+        :param indexed: Whether the dataset is indexed by frame number
         """
         self._data_set_definition[dset_name] = {
             'shape': shape,
             'maxshape': maxshape,
             'dtype': dtype,
-            'fillvalue': fillvalue
+            'fillvalue': fillvalue,
+            'indexed': indexed
         }
 
     def add_dataset_value(self, dset_name, value):
@@ -126,26 +596,277 @@ class MetaWriter(object):
         self._data_set_arrays[dset_name].append(value)
         # Reset timeout count to 0
         self.write_timeout_count = 0
+        self._check_flush_frequency(dset_name)
+
+    def add_dataset_values(self, dset_name, values):
+        """Append an array of values to the named dataset array.
+
+        :param dset_name: The dataset name
+        :param values: Array of values to append, the first dimension indexing the values
+        """
+        self._data_set_arrays[dset_name].extend(values)
+        # Reset timeout count to 0
+        self.write_timeout_count = 0
+        self._check_flush_frequency(dset_name)
+
+    def add_frame_value(self, dset_name, frame, value):
+        """Add the value of a frame to the named frame indexed dataset.
+
+        :param dset_name: The dataset name
+        :param frame: The frame number of the value
+        :param value: The value of the frame
+        """
+        self._data_set_frames[dset_name].append(frame)
+        self._data_set_arrays[dset_name].append(value)
+        # Reset timeout count to 0
+        self.write_timeout_count = 0
+        self._check_flush_frequency(dset_name)
+
+    def add_frame_values(self, dset_name, frames, values):
+        """Add the values of an array of frames to the named frame indexed dataset.
+
+        :param dset_name: The dataset name
+        :param frames: Array of frame numbers
+        :param values: Array of values, the first dimension indexing the frames
+        """
+        self._data_set_frames[dset_name].extend(frames)
+        self._data_set_arrays[dset_name].extend(values)
+        # Reset timeout count to 0
+        self.write_timeout_count = 0
+        self._check_flush_frequency(dset_name)
+
+    def frames_written(self, dset_name):
+        """Return the number of frames written to the named frame indexed dataset.
+
+        :param dset_name: The dataset name
+        """
+        return int(numpy.count_nonzero(self._frames_written[dset_name]))
+
+    @property
+    def incremental_flush(self):
+        """Return whether buffered values are flushed to the file as they arrive."""
+        if self.INCREMENTAL_FLUSH is not None:
+            return self.INCREMENTAL_FLUSH
+        write_datasets = type(self).write_datasets
+        return getattr(write_datasets, '__func__', write_datasets) is \
+            getattr(MetaWriter.write_datasets, '__func__', MetaWriter.write_datasets)
+
+    def _check_flush_frequency(self, dset_name):
+        if self.flush_frequency and len(self._data_set_arrays[dset_name]) >= self.flush_frequency and \
+                self.incremental_flush:
+            self.flush_datasets()
+
+    def check_flush_timeout(self):
+        """Flush any buffered values if the flush timeout has expired since the last flush.
+
+        This is called periodically by the MetaListener so that values are flushed to disk even
+        when no further messages arrive.
+        """
+        if self.flush_timeout is not None and time.time() - self._last_flushed >= self.flush_timeout and \
+                self.incremental_flush:
+            self.flush_datasets()
+
+    def flush_datasets(self):
+        """Append the buffered values of each dataset to the file and flush it to disk.
+
+        Datasets are grown geometrically so that frequent flushes do not resize them every time,
+        and are trimmed to the number of values written when the file is closed.  In SWMR mode
+        datasets are resized to exactly the number of values written and flushed individually,
+        so that readers only see complete values.
+        """
+        self._last_flushed = time.time()
+        if self._storage is None:
+            return
+        for dset_name in self._data_set_arrays:
+            buffer = self._data_set_arrays[dset_name]
+            if len(buffer) == 0:
+                continue
+            if dset_name in self._data_set_frames:
+                self._flush_frame_indexed(dset_name)
+                continue
+            dataset = self._hdf5_datasets[dset_name]
+            start = self._data_set_lengths[dset_name]
+            end = start + len(buffer)
+            self._grow_dataset(dataset, end)
+            dataset[start:end] = buffer.values
+            self._data_set_lengths[dset_name] = end
+            buffer.clear()
+            if self.swmr:
+                dataset.flush()
+        self._storage.flush()
+
+    def _grow_dataset(self, dataset, length):
+        if length > dataset.shape[0]:
+            size = length if self.swmr else max(length, 2 * dataset.shape[0])
+            if dataset.maxshape[0] is not None:
+                size = min(size, dataset.maxshape[0])
+            dataset.resize((size,) + dataset.shape[1:])
+
+    def _flush_frame_indexed(self, dset_name):
+        # Sort the buffered values by frame, keeping the last value of any repeated frame, and
+        # write them with as few slice writes as possible
+        frame_buffer = self._data_set_frames[dset_name]
+        buffer = self._data_set_arrays[dset_name]
+        dataset = self._hdf5_datasets[dset_name]
+        written_dataset = self._hdf5_datasets[dset_name + self.WRITTEN_SUFFIX]
+        frames = frame_buffer.values
+        values = buffer.values
+
+        # Frames beyond the dataset, or negative, would fail or be written to the wrong offset
+        valid = frames >= 0
+        if dataset.maxshape[0] is not None:
+            valid &= frames < dataset.maxshape[0]
+        if not valid.all():
+            self._logger.error('Discarding %d values of [%s] with frame numbers outside the dataset: %s',
+                               len(frames) - numpy.count_nonzero(valid), dset_name,
+                               frames[~valid][:10].tolist())
+            frames = frames[valid]
+            values = values[valid]
+        frame_buffer.clear()
+        buffer.clear()
+        if len(frames) == 0:
+            return
+
+        order = numpy.argsort(frames, kind='mergesort')
+        frames = frames[order]
+        values = values[order]
+        last = numpy.append(frames[1:] != frames[:-1], True)
+        frames = frames[last]
+        values = values[last]
+
+        length = max(self._data_set_lengths[dset_name], int(frames[-1]) + 1)
+        self._grow_dataset(dataset, length)
+        self._grow_dataset(written_dataset, length)
+        if length > len(self._frames_written[dset_name]):
+            written = numpy.zeros(written_dataset.shape[0], dtype=bool)
+            written[:len(self._frames_written[dset_name])] = self._frames_written[dset_name]
+            self._frames_written[dset_name] = written
+        frames_written = self._frames_written[dset_name]
+
+        first = int(frames[0])
+        end = int(frames[-1]) + 1
+        breaks = numpy.nonzero(numpy.diff(frames) != 1)[0] + 1
+        if len(breaks) and end - first <= self.MAX_SPAN_RATIO * len(frames):
+            # Values from interleaved ranks leave gaps, so merge them into the values already in
+            # the dataset and write the whole span at once rather than a write per run
+            span = numpy.array(dataset[first:end])
+            span[frames - first] = values
+            dataset[first:end] = span
+            frames_written[frames] = True
+        else:
+            for start, stop in zip(numpy.append(0, breaks), numpy.append(breaks, len(frames))):
+                dataset[int(frames[start]):int(frames[stop - 1]) + 1] = values[start:stop]
+                frames_written[int(frames[start]):int(frames[stop - 1]) + 1] = True
+        written_dataset[first:end] = frames_written[first:end]
+
+        self._data_set_lengths[dset_name] = length
+        self._data_set_lengths[dset_name + self.WRITTEN_SUFFIX] = length
+        if self.swmr:
+            dataset.flush()
+            written_dataset.flush()
 
     def write_datasets(self):
-        """Override to perform actions needed to write the data to disk."""
-        self._logger.warn("Parent write_datasets has been called. Should be overridden")
-        for dset_name in self._data_set_definition:
-            self._logger.warn("Length of [%s] dataset: %d", dset_name, len(self._data_set_arrays[dset_name]))
-            self._hdf5_datasets[dset_name].resize((len(self._data_set_arrays[dset_name]),))
-            self._hdf5_datasets[dset_name][0:len(self._data_set_arrays[dset_name])] = self._data_set_arrays[dset_name]
+        """Override to perform actions needed to write the data to disk.
+
+        The base implementation writes any buffered values and trims the datasets to the number
+        of values written.
+        """
+        self.flush_datasets()
+        for dset_name in self._data_set_lengths:
+            length = self._data_set_lengths[dset_name]
+            self._logger.debug("Length of [%s] dataset: %d", dset_name, length)
+            dataset = self._hdf5_datasets[dset_name]
+            dataset.resize((length,) + dataset.shape[1:])
+
+    def update_frame_sequence(self, stream, frame):
+        """Record the frame number of a message received on a stream.
+
+        :param stream: Tuple of the input index, plugin and parameter of the message
+        :param frame: The frame number
+        """
+        if stream not in self.frame_sequences:
+            bitmap = self.frame_bitmaps.setdefault(stream[1:], FrameBitmap())
+            self.frame_sequences[stream] = FrameSequence(bitmap)
+        self.frame_sequences[stream].update(frame)
+
+    def frame_sequence_status(self):
+        """Return the totals of the frame sequence counters of all streams.
+
+        This is called from the control thread while streams may be added on the writer thread, so
+        the streams are copied before they are iterated.
+        """
+        totals = {'received': 0, 'duplicates': 0, 'out_of_order': 0, 'invalid': 0}
+        for sequence in list(self.frame_sequences.values()):
+            for key in totals:
+                totals[key] += getattr(sequence, key)
+        # Frames missing from every stream of a parameter are counted once
+        totals['missing'] = sum(bitmap.missing() for bitmap in list(self.frame_bitmaps.values()))
+        return totals
+
+    def add_joined_value(self, parameter, frame, rank, value):
+        """Add a per-frame value to the frame table, if joining is enabled.
+
+        :param parameter: The parameter name, used as the column name
+        :param frame: The frame number of the value
+        :param rank: The rank of the frameProcessor that published the value
+        :param value: The value
+        """
+        if self.frame_join is not None:
+            self.frame_join.add_value(parameter, frame, rank, value)
+
+    def write_frame_table(self):
+        """Write the values joined across ranks to the file as a single table, once writing is complete."""
+        if self.frame_join is None or self._storage is None or len(self.frame_join) == 0:
+            return
+        self._storage.write_dataset(self.FRAME_TABLE, self.frame_join.table())
+
+    def write_frame_sequences(self):
+        """Write the frame sequence counters of each stream to the file.
+
+        The counters are written once writing is complete.  No objects can be added to a file in
+        SWMR mode, so the storage then reopens the file once to add them.
+        """
+        if not self.frame_sequences or self._storage is None:
+            return
+        attributes = {'frame_sequences': self.frame_sequence_status()}
+        for (input_index, plugin, parameter), sequence in self.frame_sequences.items():
+            name = 'frame_sequences/input{}/{}/{}'.format(input_index, plugin, parameter)
+            attributes[name] = dict((key, value) for key, value in sequence.status().items()
+                                    if value is not None)
+        self._storage.write_attributes(attributes)
 
     def close_file(self):
         """Override to perform actions needed to close the file."""
         self.write_datasets()
 
-        if self._hdf5_file is not None:
+        if self._storage is not None:
             self._logger.info('Closing file ' + self.full_file_name)
-            self._hdf5_file.close()
             self._hdf5_file = None
+            self.write_frame_sequences()
+            self.write_frame_table()
+            self._storage.close()
+            self._storage = None
+            if self.full_file_name != self.destination_file_name:
+                self.move_file()
 
         self.finished = True
 
+    def move_file(self):
+        """Move the closed file from the scratch directory to its destination on a background thread."""
+        self.file_mover = FileMover(self._logger, self.full_file_name, self.destination_file_name)
+        self.file_mover.start()
+
+    def file_move_status(self):
+        """Return the progress of moving the file to its destination, or None if it is not moved."""
+        if self.file_mover is None:
+            return None
+        return self.file_mover.status()
+
+    @property
+    def moving_file(self):
+        """Return whether the file is still being moved to its destination."""
+        return self.file_mover is not None and not self.file_mover.done
+
     def stop(self):
         """Override to perform actions needed to stop writing."""
         self.close_file()
@@ -10,6 +10,7 @@ import os
 
 from odin_data.meta_writer.meta_writer import MetaWriter
 from odin_data.meta_writer.meta_listener import MetaListener
+from odin_data.meta_writer.sharded_meta_listener import ShardedMetaListener
 from odin_data.logconfig import setup_logging, add_graylog_handler, add_logger
 
 def options():
@@ -19,6 +20,13 @@ def options():
     parser.add_argument("-d", "--directory", default="/tmp/", help="Default directory to write meta data files to")
     parser.add_argument("-c", "--ctrl", default="5659", help="Control channel port to listen on")
     parser.add_argument("-w", "--writer", default=None, help="Module path to detector specific meta writer class")
+    parser.add_argument("--drain-size", default=MetaListener.DEFAULT_DRAIN_SIZE, type=int,
+                        help="Maximum number of messages to read from an input per poll")
+    parser.add_argument("--shards", default=0, type=int,
+                        help="Number of worker processes to write acquisitions in, 0 to write in this process")
+    parser.add_argument("--publish", default=None,
+                        help="Endpoint to republish merged per-frame meta data on, with the port offset or "
+                             "the name suffixed by the shard index for each shard when using shards")
     parser.add_argument("-l", "--loglevel", default="INFO", help="Logging level")
     parser.add_argument("--logserver", default=None, help="Graylog server address and :port")
     parser.add_argument("--staticlogfields", default=None, help="Comma separated list of key=value fields to be attached to every log message")
@@ -41,7 +49,12 @@ def main():
     add_logger("meta_listener", {"level": args.loglevel, "propagate": True})
     setup_logging()
     
-    ml = MetaListener(args.directory, args.inputs, args.ctrl, args.writer)
+    if args.shards > 0:
+        ml = ShardedMetaListener(args.directory, args.inputs, args.ctrl, args.writer, args.shards,
+                                 args.drain_size, publish=args.publish)
+    else:
+        ml = MetaListener(args.directory, args.inputs, args.ctrl, args.writer, args.drain_size,
+                          publish=args.publish)
 
     ml.run()
 
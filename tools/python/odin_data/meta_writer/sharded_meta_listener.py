@@ -0,0 +1,373 @@
+"""Implementation of odin_data Sharded Meta Listener
+
+This module listens on one or more ZeroMQ sockets for meta messages which it routes by acquisition
+ID to a pool of MetaListener worker processes, so that the writers of concurrent acquisitions run on
+separate cores. Control messages are answered centrally, forwarding them to the workers as needed.
+Per-frame meta data is republished by each worker on its own endpoint, derived from the publish
+endpoint by shard_endpoint.
+"""
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+import zmq
+
+from odin_data.ipc_message import IpcMessage
+from odin_data.meta_writer.meta_listener import MetaListener, part_bytes
+
+
+def shard_endpoint(endpoint, shard):
+    """Return the endpoint of a shard for an endpoint of the sharded listener.
+
+    The port of a TCP endpoint is offset by the shard index, and other endpoints are suffixed with
+    it, e.g. tcp://*:5000 is tcp://*:5001 for shard 1 and ipc:///tmp/meta is ipc:///tmp/meta_1.
+
+    :param endpoint: ZeroMQ address, or an empty string for none
+    :param shard: Index of the shard
+    """
+    if not endpoint:
+        return endpoint
+    address, _, port = endpoint.rpartition(':')
+    if endpoint.startswith('tcp://') and port.isdigit():
+        return address + ':' + str(int(port) + shard)
+    return endpoint + '_' + str(shard)
+
+
+def run_shard(directory, endpoint, ctrl_endpoint, writer_module, drain_size, publish=None):
+    """Run a MetaListener worker for a shard, receiving messages routed to it.
+
+    :param directory: Directory to create the meta files in
+    :param endpoint: ZeroMQ address that the routed messages are pushed to
+    :param ctrl_endpoint: ZeroMQ address to use for control messages
+    :param writer_module: Detector writer class
+    :param drain_size: Maximum number of messages to read per poll
+    :param publish: ZeroMQ address to republish per-frame meta data on, or None
+    """
+    listener = MetaListener(directory, endpoint, ctrl_endpoint, writer_module, drain_size, zmq.PULL,
+                            publish=publish)
+    listener.run()
+
+
+class ShardedMetaListener(MetaListener):
+    """Sharded Meta Listener class.
+
+    This class routes incoming meta data messages to MetaListener worker processes, each of which
+    owns the writers of the acquisitions assigned to it
+    """
+
+    # Time in milliseconds to wait for a worker to reply to a control message
+    SHARD_REPLY_TIMEOUT = 2000
+
+    def __init__(self, directory, inputs, ctrl, writer_module, shards,
+                 drain_size=MetaListener.DEFAULT_DRAIN_SIZE, publish=None):
+        """Initalise the ShardedMetaListener object.
+
+        :param directory: Directory to create the meta file in
+        :param inputs: Comma separated list of input ZMQ addresses
+        :param ctrl: Port, or full ZMQ address, to use for control messages
+        :param writer_module: Detector writer class
+        :param shards: Number of worker processes
+        :param drain_size: Maximum number of messages to read from a ready input socket per poll
+        :param publish: ZeroMQ address that the endpoints of the shards to republish per-frame meta
+        data on are derived from, or None
+        """
+        MetaListener.__init__(self, directory, inputs, ctrl, writer_module, drain_size, publish=publish)
+        self._num_shards = max(int(shards), 1)
+        self._shard_endpoints = []
+        for index in range(self._num_shards):
+            base = 'ipc://{}/meta_listener_{}_{}'.format(tempfile.gettempdir(), os.getpid(), index)
+            self._shard_endpoints.append((base + '_data', base + '_ctrl'))
+        self._processes = []
+        self._shard_data = []
+        self._shard_ctrl = []
+        self._shard_msg_id = 0
+        self._acquisition_shards = {}
+        self._shard_routed = [0] * self._num_shards
+        self._unrouted = 0
+
+    def run(self):
+        """Main application loop."""
+        self.logger.info('Starting sharded Meta listener with %d shards...', self._num_shards)
+
+        # Start the workers before creating the context, as it cannot be shared across a fork
+        self.start_shards()
+
+        receiver_list = []
+        context = zmq.Context()
+        ctrl_socket = None
+
+        try:
+            inputs_list = self._inputs.split(',')
+            ctrl_socket = self.create_control_socket(context)
+            for x in inputs_list:
+                receiver_list.append(self.create_input_socket(context, x))
+
+            for data_endpoint, ctrl_endpoint in self._shard_endpoints:
+                shard_data = context.socket(zmq.PUSH)
+                shard_data.set_hwm(10000)
+                shard_data.bind(data_endpoint)
+                self._shard_data.append(shard_data)
+                shard_ctrl = context.socket(zmq.DEALER)
+                shard_ctrl.connect(ctrl_endpoint)
+                self._shard_ctrl.append(shard_ctrl)
+
+            poller = zmq.Poller()
+            for receiver in receiver_list:
+                poller.register(receiver, zmq.POLLIN)
+            poller.register(ctrl_socket, zmq.POLLIN)
+
+            self.logger.info('Listening to inputs ' + str(inputs_list))
+
+            while self._kill_requested == False:
+                socks = dict(poller.poll(self.FLUSH_CHECK_INTERVAL))
+                for index, receiver in enumerate(receiver_list):
+                    if socks.get(receiver) == zmq.POLLIN:
+                        self.route_messages(receiver, index)
+
+                if socks.get(ctrl_socket) == zmq.POLLIN:
+                    self.handle_control_message(ctrl_socket)
+
+            self.logger.info('Finished listening')
+        except Exception as err:
+            self.logger.error('Unexpected Exception: ' + str(err))
+
+        self.stop_shards()
+
+        for socket in receiver_list + self._shard_data + self._shard_ctrl:
+            socket.close(linger=0)
+        self._shard_data = []
+        self._shard_ctrl = []
+
+        if ctrl_socket is not None:
+            ctrl_socket.close(linger=100)
+
+        context.term()
+
+        # Remove the socket files of the ipc endpoints
+        for endpoints in self._shard_endpoints:
+            for endpoint in endpoints:
+                path = endpoint[len('ipc://'):]
+                if os.path.exists(path):
+                    os.remove(path)
+
+        self.logger.info("Finished run")
+
+    def start_shards(self):
+        """Start a worker process for each shard."""
+        for shard, (data_endpoint, ctrl_endpoint) in enumerate(self._shard_endpoints):
+            process = multiprocessing.Process(target=run_shard,
+                                              args=(self._directory, data_endpoint, ctrl_endpoint,
+                                                    self._writer_module, self._drain_size,
+                                                    shard_endpoint(self._publish, shard)))
+            process.daemon = True
+            process.start()
+            self.logger.info('Started meta listener shard with pid %d', process.pid)
+            self._processes.append(process)
+
+    def stop_shards(self):
+        """Stop the worker processes, which close their writers."""
+        for shard in range(len(self._shard_ctrl)):
+            if self._processes[shard].is_alive():
+                self.send_to_shard(shard, 'configure', {'kill': True})
+        for process in self._processes:
+            process.join(self.SHARD_REPLY_TIMEOUT / 1000.0)
+            if process.is_alive():
+                self.logger.warn('Terminating meta listener shard with pid %d', process.pid)
+                process.terminate()
+        self._processes = []
+
+    def route_messages(self, receiver, input_index=0):
+        """Read waiting meta data messages and push them to the shard of their acquisition.
+
+        :param: receiver: ZeroMQ channel to read messages from
+        :param: input_index: Index of the input the channel is connected to
+        """
+        for _ in range(self._drain_size):
+            try:
+                parts = receiver.recv_multipart(zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                break
+            except Exception as err:
+                self.logger.error('Unexpected Exception receiving message: ' + str(err))
+                break
+            self.count_received(input_index)
+            self.route_message(parts)
+
+    def route_message(self, parts):
+        """Push a meta data message to the shard of its acquisition.
+
+        :param: parts: List of message parts
+        """
+        try:
+            userheader = json.loads(part_bytes(parts[0]))['header']
+            acquisition_id = userheader.get('acqID', '') if isinstance(userheader, dict) else ''
+        except Exception as err:
+            self.logger.error('Unexpected Exception decoding message header: ' + str(err))
+            self._unrouted += 1
+            return
+
+        shard = self._acquisition_shards.get(acquisition_id)
+        if shard is None:
+            self.logger.error('No shard for acquisition [' + acquisition_id + ']')
+            self._unrouted += 1
+            return
+
+        self._shard_data[shard].send_multipart(parts, copy=False)
+        self._shard_routed[shard] += 1
+
+    def assign_shard(self, acquisition_id):
+        """Return the shard of an acquisition, assigning the least loaded shard to a new one.
+
+        :param: acquisition_id: Acquisition ID
+        """
+        if acquisition_id not in self._acquisition_shards:
+            loads = [0] * self._num_shards
+            for shard in self._acquisition_shards.values():
+                loads[shard] += 1
+            shard = loads.index(min(loads))
+            self.logger.info('Assigning acquisition [' + str(acquisition_id) + '] to shard ' + str(shard))
+            self._acquisition_shards[acquisition_id] = shard
+        return self._acquisition_shards[acquisition_id]
+
+    def send_to_shard(self, shard, msg_val, params=None):
+        """Send a control message to a shard and wait for its reply.
+
+        :param: shard: Index of the shard
+        :param: msg_val: Message value
+        :param: params: Dictionary of message parameters
+        :return: Reply IpcMessage, or None if the shard did not reply in time
+        """
+        self._shard_msg_id += 1
+        message = IpcMessage('cmd', msg_val, id=self._shard_msg_id)
+        if params:
+            for key, value in params.items():
+                message.set_param(key, value)
+        socket = self._shard_ctrl[shard]
+        socket.send(message.encode())
+
+        deadline = time.time() + self.SHARD_REPLY_TIMEOUT / 1000.0
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0 or not socket.poll(remaining * 1000):
+                self.logger.error('No reply from meta listener shard ' + str(shard))
+                return None
+            reply = IpcMessage(from_str=socket.recv())
+            # Discard any late replies to earlier messages
+            if reply.get_msg_id() == self._shard_msg_id:
+                return reply
+
+    def send_to_all_shards(self, msg_val, params, msg_id):
+        """Send a control message to every shard, acknowledging it only if all shards do.
+
+        :param: msg_val: Message value
+        :param: params: Dictionary of message parameters
+        :param: msg_id: message id to use for reply
+        """
+        reply = IpcMessage(IpcMessage.ACK, msg_val, id=msg_id)
+        for shard in range(self._num_shards):
+            shard_reply = self.send_to_shard(shard, msg_val, params)
+            if shard_reply is None or shard_reply.get_msg_type() != IpcMessage.ACK:
+                reply = IpcMessage(IpcMessage.NACK, msg_val, id=msg_id)
+                reply.set_param('error', 'Shard ' + str(shard) + ' failed to process ' + msg_val)
+        return reply
+
+    def handle_configure_message(self, params, msg_id):
+        """Handle configure message, forwarding it to the shards it applies to.
+
+        :param: params: dictionary of configuration parameters
+        :param: msg_id: message id to use for reply
+        """
+        if 'kill' in params:
+            self.logger.info('Kill requested')
+            self._kill_requested = True
+            return IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
+        elif ('writer' in params or 'drain_size' in params or 'journal' in params or 'max_open_writers' in params or
+              'max_finished_writers' in params or 'idle_timeout' in params):
+            MetaListener.handle_configure_message(self, params, msg_id)
+            return self.send_to_all_shards('configure', params, msg_id)
+        elif 'publish' in params:
+            MetaListener.handle_configure_message(self, params, msg_id)
+            # Each shard publishes the acquisitions it writes on its own endpoint
+            reply = IpcMessage(IpcMessage.ACK, 'configure', id=msg_id)
+            for shard in range(self._num_shards):
+                shard_params = dict(params)
+                shard_params['publish'] = shard_endpoint(self._publish, shard)
+                shard_reply = self.send_to_shard(shard, 'configure', shard_params)
+                if shard_reply is None or shard_reply.get_msg_type() != IpcMessage.ACK:
+                    reply = IpcMessage(IpcMessage.NACK, 'configure', id=msg_id)
+                    reply.set_param('error', 'Shard ' + str(shard) + ' failed to process configure')
+            return reply
+        elif 'prewarm' in params:
+            # Only the shards create writers
+            self._prewarm = str(params['prewarm']).lower() in ('true', '1')
+            return self.send_to_all_shards('configure', params, msg_id)
+        elif 'acquisition_id' in params:
+            if params['acquisition_id'] is None:
+                return self.send_to_all_shards('configure', params, msg_id)
+            shard = self.assign_shard(params['acquisition_id'])
+            reply = self.send_to_shard(shard, 'configure', params)
+            if reply is None:
+                reply = IpcMessage(IpcMessage.NACK, 'configure', id=msg_id)
+                reply.set_param('error', 'Shard ' + str(shard) + ' failed to process configure')
+            reply.set_msg_id(msg_id)
+            return reply
+
+        reply = IpcMessage(IpcMessage.NACK, 'configure', id=msg_id)
+        reply.set_param('error', 'No params in config')
+        return reply
+
+    def handle_status_message(self, msg_id):
+        """Handle status message, merging the status of the acquisitions of each shard.
+
+        :param: msg_id: message id to use for reply
+        """
+        acquisitions = {}
+        shards = []
+        for shard in range(self._num_shards):
+            shard_status = {
+                'pid': self._processes[shard].pid if shard < len(self._processes) else None,
+                'alive': shard < len(self._processes) and self._processes[shard].is_alive(),
+                'routed': self._shard_routed[shard]
+            }
+            reply = self.send_to_shard(shard, 'status')
+            if reply is not None:
+                shard_acquisitions = reply.get_param('acquisitions', {})
+                acquisitions.update(shard_acquisitions)
+                shard_status['acquisitions'] = list(shard_acquisitions)
+                shard_status['writer_queue'] = reply.get_param('writer_queue', {})
+                if reply.get_param('publisher', {}):
+                    shard_status['publisher'] = reply.get_param('publisher')
+                # Forget acquisitions that the shard has finished with
+                for acquisition_id, assigned in list(self._acquisition_shards.items()):
+                    if assigned == shard and acquisition_id not in shard_acquisitions:
+                        del self._acquisition_shards[acquisition_id]
+            shards.append(shard_status)
+
+        reply = IpcMessage(IpcMessage.ACK, 'status', id=msg_id)
+        reply.set_param('acquisitions', acquisitions)
+        reply.set_param('inputs', self.input_status())
+        reply.set_param('shards', shards)
+        reply.set_param('unrouted', self._unrouted)
+        return reply
+
+    def handle_request_config_message(self, msg_id):
+        """Handle request config message, merging the acquisitions of each shard.
+
+        :param: msg_id: message id to use for reply
+        """
+        reply = MetaListener.handle_request_config_message(self, msg_id)
+        acquisitions = {}
+        for shard in range(self._num_shards):
+            shard_reply = self.send_to_shard(shard, 'request_configuration')
+            if shard_reply is not None:
+                acquisitions.update(shard_reply.get_param('acquisitions', {}))
+        reply.set_param('acquisitions', acquisitions)
+        reply.set_param('shards', self._num_shards)
+        reply.set_param('publish_shards', [shard_endpoint(self._publish, shard) for shard in range(self._num_shards)])
+        return reply
+
+    def open_publisher(self):
+        """Per-frame meta data is republished by the shards, not by the sharded listener."""
+        return
@@ -0,0 +1,303 @@
+"""Implementation of odin_data Meta Writer storage backends
+
+This module provides the storage that a MetaWriter writes its datasets to.  The HDF5 backend
+writes a single HDF5 file with h5py.  The NPY backend writes each dataset to its own memory-mapped
+.npy file in a directory, which is cheaper to append to, and can be converted to an HDF5 file once
+the acquisition is complete.
+
+A backend is created with the full path of the file to write, and provides create_dataset, flush,
+enable_swmr, close, write_dataset and write_attributes methods.  The datasets it creates support the h5py dataset
+operations used by the MetaWriter: shape, maxshape, resize, flush and slice assignment.
+"""
+import json
+import os
+import struct
+
+import h5py
+import numpy
+
+
+class Hdf5Storage(object):
+    """HDF5 storage backend, writing all datasets to one HDF5 file."""
+
+    FILE_SUFFIX = '_meta.h5'
+
+    def __init__(self, file_name):
+        """Initalise the Hdf5Storage object, creating the file.
+
+        :param file_name: Full path of the HDF5 file
+        """
+        self.file_name = file_name
+        self.hdf5_file = h5py.File(file_name, 'w', libver='latest')
+        self.swmr = False
+
+    def create_dataset(self, name, shape=None, maxshape=None, dtype=None, fillvalue=None, data=None):
+        """Create a dataset, either empty or holding existing data.
+
+        :param name: The dataset name
+        :param shape: Shape of the data
+        :param maxshape: The maximum shape of the data
+        :param dtype: The type of data
+        :param fillvalue: The fill value to use
+        :param data: Existing data to write to the dataset
+        """
+        if data is not None:
+            return self.hdf5_file.create_dataset(name, shape, data=data)
+        return self.hdf5_file.create_dataset(name, shape, maxshape=maxshape, dtype=dtype, fillvalue=fillvalue)
+
+    def enable_swmr(self):
+        """Allow the file to be read while it is written. No objects can be created afterwards."""
+        self.hdf5_file.swmr_mode = True
+        self.swmr = True
+
+    def flush(self):
+        """Flush the file to disk."""
+        self.hdf5_file.flush()
+
+    def close(self):
+        """Close the file."""
+        if self.hdf5_file is not None:
+            self.hdf5_file.close()
+            self.hdf5_file = None
+
+    def _writable_file(self):
+        # No objects can be created in a file in SWMR mode, so it is reopened once to add them
+        if self.swmr:
+            self.close()
+            self.swmr = False
+        if self.hdf5_file is None:
+            self.hdf5_file = h5py.File(self.file_name, 'a')
+        return self.hdf5_file
+
+    def write_dataset(self, name, data):
+        """Write a dataset once writing is complete, reopening the file if it is in SWMR mode.
+
+        :param name: The dataset name
+        :param data: The data to write
+        """
+        self._writable_file().create_dataset(name, data=data)
+
+    def write_attributes(self, attributes):
+        """Write attributes to groups once writing is complete, reopening the file if it is in SWMR mode.
+
+        :param attributes: Dictionary of group path to dictionary of attributes
+        """
+        hdf5_file = self._writable_file()
+        for path, attrs in attributes.items():
+            group = hdf5_file.require_group(path)
+            for key, value in attrs.items():
+                group.attrs[key] = value
+
+
+class NpyDataset(object):
+    """Dataset stored in a memory-mapped .npy file.
+
+    Space is reserved in the file beyond the values written so that the dataset can be grown
+    without remapping it, and the shape in the .npy header is padded so that it can be rewritten
+    in place as the dataset grows.  The file is trimmed to the shape of the dataset when closed.
+
+    Values written to the shared memory map are immediately visible to readers of the file and
+    survive the writing process dying, so they are only synced to disk when the dataset is closed.
+    """
+
+    # Minimum number of values to reserve space for in the file
+    CHUNK_SIZE = 1024
+
+    def __init__(self, file_name, shape, maxshape, dtype, fillvalue):
+        """Initalise the NpyDataset object, creating the file.
+
+        :param file_name: Full path of the .npy file
+        :param shape: Shape of the data
+        :param maxshape: The maximum shape of the data
+        :param dtype: The type of data
+        :param fillvalue: The fill value to use
+        """
+        self.file_name = file_name
+        self.dtype = numpy.dtype(dtype)
+        if self.dtype.hasobject:
+            raise TypeError('Object dtypes cannot be stored in a .npy dataset')
+        self._shape = tuple(int(size) for size in shape)
+        self.maxshape = tuple(maxshape) if maxshape is not None else self._shape
+        self._fillvalue = fillvalue
+        self._row_size = self.dtype.itemsize * int(numpy.prod(self._shape[1:]))
+
+        # Size the header for the largest possible shape so it never needs to move
+        max_header = self._header_text((2 ** 63,) * len(self._shape))
+        self._header_length = 64 * ((10 + len(max_header) + 1 + 63) // 64)
+
+        self._file = open(file_name, 'w+b')
+        self._map = None
+        self._array = None
+        self._capacity = 0
+        self._reserve(self._shape[0])
+        self._write_header()
+
+    def _header_text(self, shape):
+        return "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (
+            numpy.lib.format.dtype_to_descr(self.dtype), tuple(int(size) for size in shape))
+
+    def _write_header(self):
+        text = self._header_text(self._shape)
+        text += ' ' * (self._header_length - 10 - len(text) - 1) + '\n'
+        self._file.seek(0)
+        self._file.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(text)) + text.encode('latin1'))
+        self._file.flush()
+
+    def _reserve(self, length):
+        # Extend the file and remap it if there is not space for the given number of values
+        if self._map is not None and length <= self._capacity:
+            return
+        previous = self._capacity
+        self._capacity = max(length, 2 * self._capacity, self.CHUNK_SIZE)
+        self._map = None
+        self._array = None
+        self._file.truncate(self._header_length + self._capacity * self._row_size)
+        self._map = numpy.memmap(self._file, dtype=self.dtype, mode='r+', offset=self._header_length,
+                                 shape=(self._capacity,) + self._shape[1:])
+        # Index a plain array view of the map, which is much cheaper than indexing the memmap
+        self._array = self._map.view(numpy.ndarray)
+        if self._fillvalue:
+            self._array[previous:] = self._fillvalue
+
+    @property
+    def shape(self):
+        """Return the shape of the values written to the dataset."""
+        return self._shape
+
+    def __len__(self):
+        return self._shape[0]
+
+    def resize(self, shape):
+        """Resize the dataset, reserving space in the file if it is grown.
+
+        :param shape: New shape of the dataset
+        """
+        if self.maxshape[0] is not None and shape[0] > self.maxshape[0]:
+            raise ValueError('Unable to resize dataset beyond its maximum shape')
+        self._reserve(shape[0])
+        self._shape = (int(shape[0]),) + self._shape[1:]
+        self._write_header()
+
+    def __getitem__(self, key):
+        return self._array[:self._shape[0]][key]
+
+    def __setitem__(self, key, value):
+        self._array[:self._shape[0]][key] = value
+
+    def flush(self):
+        """Values written are visible to readers without flushing."""
+
+    def close(self):
+        """Close the dataset, trimming the file to the values written."""
+        if self._file.closed:
+            return
+        self._map.flush()
+        self._map = None
+        self._array = None
+        self._file.truncate(self._header_length + self._shape[0] * self._row_size)
+        self._file.close()
+
+
+class NpyStorage(object):
+    """NPY storage backend, writing each dataset to a memory-mapped .npy file in a directory."""
+
+    FILE_SUFFIX = '_meta'
+    ATTRIBUTES_FILE = 'attributes.json'
+
+    def __init__(self, file_name):
+        """Initalise the NpyStorage object, creating the directory.
+
+        :param file_name: Full path of the directory
+        """
+        self.file_name = file_name
+        if not os.path.isdir(file_name):
+            os.makedirs(file_name)
+        self._datasets = []
+
+    def _dataset_file_name(self, name):
+        file_name = os.path.join(self.file_name, name + '.npy')
+        if not os.path.isdir(os.path.dirname(file_name)):
+            os.makedirs(os.path.dirname(file_name))
+        return file_name
+
+    def create_dataset(self, name, shape=None, maxshape=None, dtype=None, fillvalue=None, data=None):
+        """Create a dataset, either empty or holding existing data.
+
+        :param name: The dataset name
+        :param shape: Shape of the data
+        :param maxshape: The maximum shape of the data
+        :param dtype: The type of data
+        :param fillvalue: The fill value to use
+        :param data: Existing data to write to the dataset
+        """
+        if data is not None:
+            data = numpy.asarray(data)
+            if shape is not None:
+                data = data.reshape(shape)
+            numpy.save(self._dataset_file_name(name), data)
+            return numpy.load(self._dataset_file_name(name), mmap_mode='r')
+        dataset = NpyDataset(self._dataset_file_name(name), shape, maxshape, dtype, fillvalue)
+        self._datasets.append(dataset)
+        return dataset
+
+    def enable_swmr(self):
+        """The .npy files can always be read while they are written."""
+
+    def flush(self):
+        """Values written are visible to readers without flushing."""
+
+    def close(self):
+        """Close the datasets."""
+        for dataset in self._datasets:
+            dataset.close()
+        self._datasets = []
+
+    def write_dataset(self, name, data):
+        """Write a dataset once writing is complete.
+
+        :param name: The dataset name
+        :param data: The data to write
+        """
+        numpy.save(self._dataset_file_name(name), data)
+
+    def write_attributes(self, attributes):
+        """Merge attributes into the attributes file of the directory.
+
+        :param attributes: Dictionary of group path to dictionary of attributes
+        """
+        attributes_file = os.path.join(self.file_name, self.ATTRIBUTES_FILE)
+        stored = {}
+        if os.path.exists(attributes_file):
+            with open(attributes_file) as json_file:
+                stored = json.load(json_file)
+        for path, attrs in attributes.items():
+            stored.setdefault(path, {}).update(attrs)
+        with open(attributes_file, 'w') as json_file:
+            json.dump(stored, json_file, default=lambda value: value.item())
+
+
+STORAGE_BACKENDS = {
+    'hdf5': Hdf5Storage,
+    'npy': NpyStorage
+}
+
+
+def convert_to_hdf5(directory, file_name):
+    """Write the datasets and attributes of an NPY storage directory to an HDF5 file.
+
+    :param directory: Full path of the NPY storage directory
+    :param file_name: Full path of the HDF5 file to create
+    """
+    with h5py.File(file_name, 'w', libver='latest') as hdf5_file:
+        for root, _, files in os.walk(directory):
+            for npy_file in sorted(files):
+                path = os.path.join(root, npy_file)
+                if npy_file.endswith('.npy'):
+                    name = os.path.relpath(path, directory)[:-len('.npy')].replace(os.sep, '/')
+                    hdf5_file.create_dataset(name, data=numpy.load(path, mmap_mode='r'))
+                elif path == os.path.join(directory, NpyStorage.ATTRIBUTES_FILE):
+                    with open(path) as json_file:
+                        for group_path, attrs in json.load(json_file).items():
+                            group = hdf5_file.require_group(group_path)
+                            for key, value in attrs.items():
+                                group.attrs[key] = value
@@ -0,0 +1,98 @@
+"""Meta Writer storage benchmark
+
+Appends values to the datasets of a MetaWriter with each storage backend and reports the sustained
+rate at which they are written, including flushing them to disk at the flush frequency.
+"""
+import argparse
+import logging
+import shutil
+import tempfile
+import time
+
+import numpy
+
+from odin_data.meta_writer.meta_writer import MetaWriter
+from odin_data.meta_writer.storage import STORAGE_BACKENDS
+
+
+def run_storage_benchmark(storage, num_values, flush_frequency=100, batch_size=1, directory=None):
+    """Measure the rate at which values are appended to the datasets of a MetaWriter.
+
+    Each value is a frame number, a timestamp and a counter, as for typical per-frame meta data.
+
+    :param storage: Name of the storage backend
+    :param num_values: Number of values to append to each dataset
+    :param flush_frequency: Number of buffered values at which the datasets are flushed
+    :param batch_size: Number of values appended per call
+    :param directory: Directory to write to, a temporary directory if None
+    :return: Dictionary of results
+    """
+    temporary = directory is None
+    if temporary:
+        directory = tempfile.mkdtemp()
+    try:
+        writer = MetaWriter(logging.getLogger('storage_benchmark'), directory, 'benchmark_' + storage)
+        writer.storage = storage
+        writer.flush_frequency = flush_frequency
+        writer.add_dataset_definition('frame', (0,), (None,), 'uint64', 0)
+        writer.add_dataset_definition('timestamp', (0,), (None,), 'float64', 0)
+        writer.add_dataset_definition('counter', (0,), (None,), 'int32', 0)
+        writer.create_file()
+
+        frames = numpy.arange(num_values, dtype='uint64')
+        timestamps = numpy.linspace(0.0, 1.0, num_values)
+        counters = numpy.arange(num_values, dtype='int32')
+
+        start = time.time()
+        for first in range(0, num_values, batch_size):
+            last = min(first + batch_size, num_values)
+            if batch_size == 1:
+                writer.add_dataset_value('frame', frames[first])
+                writer.add_dataset_value('timestamp', timestamps[first])
+                writer.add_dataset_value('counter', counters[first])
+            else:
+                writer.add_dataset_values('frame', frames[first:last])
+                writer.add_dataset_values('timestamp', timestamps[first:last])
+                writer.add_dataset_values('counter', counters[first:last])
+        writer.close_file()
+        duration = time.time() - start
+    finally:
+        if temporary:
+            shutil.rmtree(directory)
+
+    return {
+        'storage': storage,
+        'values': num_values,
+        'flush_frequency': flush_frequency,
+        'batch_size': batch_size,
+        'duration': duration,
+        'rate': num_values / duration
+    }
+
+
+def options():
+    """Parse program arguments."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--values", default=100000, type=int, help="Number of values to append")
+    parser.add_argument("--storage", default=",".join(sorted(STORAGE_BACKENDS)),
+                        help="Comma separated list of storage backends to compare")
+    parser.add_argument("-f", "--flush", default="1,100,10000",
+                        help="Comma separated list of flush frequencies to compare")
+    parser.add_argument("-b", "--batch-size", default=1, type=int, help="Number of values appended per call")
+    parser.add_argument("-d", "--directory", default=None, help="Directory to write to")
+    return parser.parse_args()
+
+
+def main():
+    """Run the benchmark for each storage backend and flush frequency and print the results."""
+    args = options()
+    for storage in args.storage.split(','):
+        for flush_frequency in [int(flush) for flush in args.flush.split(',')]:
+            result = run_storage_benchmark(storage, args.values, flush_frequency, args.batch_size,
+                                           args.directory)
+            print("{storage:>6s} flush {flush_frequency:6d}: {values} values in {duration:.3f}s "
+                  "at {rate:.0f} values/s".format(**result))
+
+
+if __name__ == "__main__":
+    main()
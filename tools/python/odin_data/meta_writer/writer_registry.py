@@ -0,0 +1,248 @@
+"""Implementation of odin_data Writer Registry
+
+This module resolves the MetaWriter classes used by a MetaListener, caching each class and its
+version once they have been loaded, and holds pre-warmed writer instances ready to be assigned to
+the next acquisition.  It also holds the writers of each acquisition, bounding the number of
+finished writers kept and of writers in use.
+"""
+import collections
+import importlib
+import threading
+import time
+
+
+class WriterRegistry(object):
+    """Writer Registry class.
+
+    This class loads and validates writer classes from their module path and creates writers
+    """
+
+    # Methods a class must provide to be used as a writer
+    WRITER_METHODS = ('get_version', 'process_message', 'stop')
+
+    def __init__(self, logger):
+        """Initalise the WriterRegistry object.
+
+        :param logger: Logger to use
+        """
+        self._logger = logger
+        self._classes = {}
+        self._versions = {}
+        # Pre-warmed writer instances, keyed by writer module
+        self._spares = {}
+        # Writers may be pre-warmed on the writer thread and taken on the control thread
+        self._lock = threading.Lock()
+
+    def writer_class(self, writer_module):
+        """Return the writer class of a module path, loading and validating it on first use.
+
+        :param writer_module: Full path of the writer class, e.g. package.module.Class
+        """
+        if writer_module is None:
+            raise Exception('No writer class configured')
+
+        if writer_module not in self._classes:
+            module_name = writer_module[:writer_module.rfind('.')]
+            class_name = writer_module[writer_module.rfind('.') + 1:]
+            module = importlib.import_module(module_name, package=None)
+            writer_class = getattr(module, class_name)
+            for method in self.WRITER_METHODS:
+                if not callable(getattr(writer_class, method, None)):
+                    raise Exception('Writer class ' + writer_module + ' has no ' + method + ' method')
+            self._logger.debug('Loaded writer class ' + writer_module)
+            self._classes[writer_module] = writer_class
+        return self._classes[writer_module]
+
+    def writer_version(self, writer_module):
+        """Return the version of a writer class, which is only requested from the class once.
+
+        :param writer_module: Full path of the writer class
+        """
+        if writer_module not in self._versions:
+            self._versions[writer_module] = self.writer_class(writer_module).get_version()
+        return self._versions[writer_module]
+
+    def prewarm(self, writer_module, directory):
+        """Create a writer ready to be assigned to the next acquisition, if there is not one already.
+
+        :param writer_module: Full path of the writer class
+        :param directory: Default directory of the writer
+        """
+        writer_class = self.writer_class(writer_module)
+        if not callable(getattr(writer_class, 'assign_acquisition', None)):
+            self._logger.debug('Writer class ' + writer_module + ' cannot be pre-warmed')
+            return
+        with self._lock:
+            if writer_module in self._spares:
+                return
+        writer = writer_class(self._logger, directory, None)
+        with self._lock:
+            self._spares.setdefault(writer_module, writer)
+
+    def create_writer(self, writer_module, directory, acquisition_id):
+        """Create a writer for an acquisition, taking the pre-warmed writer if there is one.
+
+        :param writer_module: Full path of the writer class
+        :param directory: Directory to create the meta file in
+        :param acquisition_id: Acquisition ID of the new acquisition
+        """
+        writer_class = self.writer_class(writer_module)
+        with self._lock:
+            writer = self._spares.pop(writer_module, None)
+        if writer is None:
+            return writer_class(self._logger, directory, acquisition_id)
+        writer.assign_acquisition(directory, acquisition_id)
+        return writer
+
+    def spares(self):
+        """Return the writer modules that have a pre-warmed writer."""
+        with self._lock:
+            return sorted(self._spares)
+
+    def clear_spares(self):
+        """Discard any pre-warmed writers."""
+        with self._lock:
+            self._spares = {}
+
+
+class AcquisitionWriters(object):
+    """Acquisition Writers class.
+
+    This class holds the writer of each acquisition in least recently used order.  The least
+    recently used finished writers are evicted beyond a maximum number, whether the maximum number
+    of writers are in use can be checked, and the idle writers that should be closed can be listed.  It can be
+    used from the control and writer threads of a MetaListener.
+    """
+
+    def __init__(self, max_finished, max_open):
+        """Initalise the AcquisitionWriters object.
+
+        :param max_finished: Maximum number of finished writers to keep
+        :param max_open: Maximum number of writers in use
+        """
+        self.max_finished = max_finished
+        self.max_open = max_open
+        self.evicted = 0
+        self._writers = collections.OrderedDict()
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, acquisition_id):
+        with self._lock:
+            return acquisition_id in self._writers
+
+    def __getitem__(self, acquisition_id):
+        with self._lock:
+            return self._writers[acquisition_id]
+
+    def get(self, acquisition_id, default=None):
+        with self._lock:
+            return self._writers.get(acquisition_id, default)
+
+    def __setitem__(self, acquisition_id, writer):
+        with self._lock:
+            self._writers.pop(acquisition_id, None)
+            self._writers[acquisition_id] = writer
+            self._last_used[acquisition_id] = time.time()
+        self.evict_finished()
+
+    def __delitem__(self, acquisition_id):
+        with self._lock:
+            del self._writers[acquisition_id]
+            del self._last_used[acquisition_id]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._writers)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        """Return a list of the acquisition IDs, least recently used first."""
+        with self._lock:
+            return list(self._writers.keys())
+
+    def values(self):
+        """Return a list of the writers, least recently used first."""
+        with self._lock:
+            return list(self._writers.values())
+
+    def items(self):
+        """Return a list of (acquisition ID, writer) tuples, least recently used first."""
+        with self._lock:
+            return list(self._writers.items())
+
+    def touch(self, acquisition_id):
+        """Mark the writer of an acquisition as the most recently used.
+
+        :param acquisition_id: Acquisition ID
+        """
+        with self._lock:
+            writer = self._writers.pop(acquisition_id, None)
+            if writer is not None:
+                self._writers[acquisition_id] = writer
+                self._last_used[acquisition_id] = time.time()
+
+    def idle_time(self, acquisition_id):
+        """Return the time in seconds since the writer of an acquisition was last used.
+
+        :param acquisition_id: Acquisition ID
+        """
+        with self._lock:
+            return time.time() - self._last_used[acquisition_id]
+
+    @staticmethod
+    def removable(writer):
+        """Return whether a writer has finished, including moving its file to its destination."""
+        return writer.finished and not getattr(writer, 'moving_file', False)
+
+    def evict_finished(self):
+        """Remove the least recently used finished writers beyond the maximum number to keep.
+
+        :return: List of the acquisition IDs removed
+        """
+        with self._lock:
+            finished = [key for key, writer in self._writers.items() if self.removable(writer)]
+            evicted = finished[:max(len(finished) - self.max_finished, 0)]
+            for key in evicted:
+                del self._writers[key]
+                del self._last_used[key]
+            self.evicted += len(evicted)
+        return evicted
+
+    @staticmethod
+    def in_use(writer):
+        """Return whether a writer has an open file or frame processors writing to it."""
+        return not writer.finished and (writer.file_created or writer.number_processes_running > 0)
+
+    def full(self):
+        """Return whether the maximum number of writers in use has been reached."""
+        with self._lock:
+            return len([writer for writer in self._writers.values() if self.in_use(writer)]) >= self.max_open
+
+    def writers_to_close(self, idle_timeout):
+        """Return the writers with an open file that are idle, least recently used first.
+
+        A writer is idle if no frame processors are writing to it and it has not been used for the
+        idle timeout.  Writers that frame processors are still writing to are never closed.
+
+        :param idle_timeout: Time in seconds after which an idle writer is closed
+        :return: List of (acquisition ID, writer, reason) tuples
+        """
+        now = time.time()
+        with self._lock:
+            return [(key, writer, 'idle') for key, writer in self._writers.items()
+                    if writer.file_created and not writer.finished and writer.number_processes_running == 0
+                    and now - self._last_used[key] >= idle_timeout]
+
+    def status(self):
+        """Return the number of writers held, with an open file and finished, and evicted."""
+        with self._lock:
+            writers = list(self._writers.values())
+        return {
+            'writers': len(writers),
+            'open': len([writer for writer in writers if writer.file_created and not writer.finished]),
+            'finished': len([writer for writer in writers if writer.finished]),
+            'evicted': self.evicted
+        }
@@ -3,12 +3,17 @@ Created on 6th September 2017
 
 :author: Alan Greer
 """
+import copy
 import json
 import logging
+import random
+import time
 from odin_data.ipc_tornado_client import IpcTornadoClient
-from odin_data.util import remove_prefix, remove_suffix
+from odin_data.util import remove_prefix, remove_suffix, ParameterVersions, etag_matches, \
+    not_modified_response
 from odin.adapters.adapter import ApiAdapter, ApiAdapterResponse, request_types, response_types
-from tornado import escape
+from odin_data.ipc_message import IpcMessageException
+from tornado import escape, gen
 from tornado.ioloop import IOLoop
 
 
@@ -24,9 +29,16 @@ class OdinDataAdapter(ApiAdapter):
     ERROR_FAILED_GET = "Unable to successfully complete the GET request"
     ERROR_FAILED_PUT = "Unable to successfully complete the PUT request"
     ERROR_PUT_MISMATCH = "The size of parameter array does not match the number of clients"
+    ERROR_BATCH_FORMAT = "Batch request must be a JSON object mapping configuration paths to values"
 
     SUPPORTED_COMMANDS = ['reset_statistics', 'request_version', 'shutdown']
-    
+
+    DEFAULT_UPDATE_INTERVAL = 0.5
+    DEFAULT_IDLE_UPDATE_INTERVAL = 2.0
+    DEFAULT_MAX_BACKOFF_INTERVAL = 10.0
+    DEFAULT_UPDATE_JITTER = 0.1
+    DEFAULT_CONFIG_ACK_TIMEOUT = 5.0
+
     def __init__(self, **kwargs):
         """
         Initialise the OdinDataAdapter object
@@ -40,8 +52,14 @@ class OdinDataAdapter(ApiAdapter):
         self._clients = []
         self._client_connections = []
         self._update_interval = None
+        self._idle_update_interval = None
+        self._max_backoff_interval = None
+        self._update_jitter = None
+        self._config_ack_timeout = None
+        self._client_schedules = []
         self._config_file = []
-        self._config_params = {}
+        self._config_journal = []
+        self._versions = ParameterVersions()
 
         logging.debug(kwargs)
 
@@ -68,24 +86,78 @@ class OdinDataAdapter(ApiAdapter):
             logging.debug("Creating client {}:{}".format(ep['ip_address'], ep['port']))
             self._clients.append(IpcTornadoClient(ep['ip_address'], ep['port']))
             self._client_connections.append(False)
+            self._client_schedules.append({'failures': 0, 'last_status': None, 'active': False})
             self._config_file.append('')
+            self._config_journal.append({})
 
         self._kwargs['count'] = len(self._clients)
         # Allocate the status list
-        self._status = {'status/error': ''}
-
-        # Setup the time between client update requests
-        self._update_interval = float(self.options.get('update_interval', 0.5))
+        self._status = {'status/error': '', 'status/config_push': []}
+        for _ in self._clients:
+            self._status['status/config_push'].append({
+                'file': '',
+                'state': 'idle',
+                'messages': 0,
+                'acked': 0,
+                'nacked': 0,
+                'duration': 0.0,
+                'error': ''
+            })
+        self._config_push_count = [0] * len(self._clients)
+
+        # Time to wait for each configuration message to be acknowledged by a client
+        self._config_ack_timeout = float(self.options.get('config_ack_timeout',
+                                                          self.DEFAULT_CONFIG_ACK_TIMEOUT))
+        self._kwargs['config_ack_timeout'] = self._config_ack_timeout
+
+        # Setup the time between client update requests.  Active clients are polled every
+        # update_interval, idle clients every idle_update_interval and disconnected clients
+        # back off exponentially up to max_backoff_interval
+        self._update_interval = float(self.options.get('update_interval',
+                                                       self.DEFAULT_UPDATE_INTERVAL))
+        self._idle_update_interval = max(
+            float(self.options.get('idle_update_interval', self.DEFAULT_IDLE_UPDATE_INTERVAL)),
+            self._update_interval
+        )
+        self._max_backoff_interval = max(
+            float(self.options.get('max_backoff_interval', self.DEFAULT_MAX_BACKOFF_INTERVAL)),
+            self._update_interval
+        )
+        self._update_jitter = float(self.options.get('update_jitter', self.DEFAULT_UPDATE_JITTER))
         self._kwargs['update_interval'] = self._update_interval
+        self._kwargs['idle_update_interval'] = self._idle_update_interval
+        self._kwargs['max_backoff_interval'] = self._max_backoff_interval
+        self._kwargs['update_jitter'] = self._update_jitter
         self.update_loop()
 
     def set_error(self, err):
         # Record the error message into the status
         self._status['status/error'] = err
+        self._versions.bump('status')
 
     def clear_error(self):
         # Clear the error message out of the status dict
-        self._status['status/error'] = ''
+        if self._status['status/error']:
+            self._status['status/error'] = ''
+            self._versions.bump('status')
+
+    def parameter_etag(self, path):
+        """Return the ETag for the current version of the parameters at a path.
+
+        The tag combines the version of the adapter's own parameters with the version of the
+        matching subtree of each client's parameters, so it changes whenever any of them do.
+
+        :param path: URI path of the GET request
+        :return: quoted ETag string
+        """
+        subtree = path.strip('/').split('/')[0]
+        client_versions = []
+        for client in self._clients:
+            if subtree in client.parameters:
+                client_versions.append(client.versions.version(subtree))
+            else:
+                client_versions.append(client.versions.version())
+        return self._versions.etag(path, *client_versions)
 
     @request_types('application/json', 'application/vnd.odin-native')
     @response_types('application/json', default='application/json')
@@ -101,6 +173,12 @@ class OdinDataAdapter(ApiAdapter):
         status_code = 200
         response = {}
 
+        # Skip building the response if the client already holds the current version
+        etag = self.parameter_etag(path)
+        if etag_matches(request, etag):
+            return ApiAdapterResponse(not_modified_response(etag), status_code=status_code)
+        response['etag'] = etag
+
         # Check if the adapter type is being requested
         request_command = path.strip('/')
         if not request_command:
@@ -186,8 +264,19 @@ class OdinDataAdapter(ApiAdapter):
         request_command = path.strip('/')
 
         try:
-            # Request should start with either config/ or command/
-            if request_command.startswith("config/"):
+            # Request should start with either config/ or command/, or be a batch of configuration
+            if request_command == "batch":
+                try:
+                    items = json.loads(str(escape.url_unescape(request.body)))
+                except ValueError:
+                    items = None
+                if isinstance(items, dict):
+                    response, status_code = self.process_batch_configuration(items)
+                else:
+                    status_code = 503
+                    response['error'] = OdinDataAdapter.ERROR_BATCH_FORMAT
+
+            elif request_command.startswith("config/"):
                 request_command = remove_prefix(request_command, "config/")  # Take the rest of the URI
 
                 # Parse the parameters
@@ -200,15 +289,8 @@ class OdinDataAdapter(ApiAdapter):
 
                 # Do not store this configuration if it is the config file
                 if not request_command.startswith('config_file'):
-                    # Check if the parameter is a dict, and if so then merge.  Otherwise replace the value
-                    if request_command in self._config_params:
-                        if isinstance(self._config_params[request_command], dict):
-                            self._config_params[request_command].update(parameters)
-                        else:
-                            self._config_params[request_command] = parameters
-                    else:
-                        self._config_params[request_command] = parameters
-                    logging.debug("Stored config items: %s", self._config_params)
+                    self.journal_configuration(request_command, parameters)
+                    logging.debug("Stored config items: %s", self._config_journal)
                 response, status_code = self.process_configuration(request_command, parameters)
 
                 if self.require_version_check(request_command):
@@ -237,6 +319,8 @@ class OdinDataAdapter(ApiAdapter):
         except Exception as ex:
             self.set_error(str(ex))
             raise
+        finally:
+            self._versions.bump()
 
         return ApiAdapterResponse(response, status_code=status_code)
 
@@ -297,6 +381,75 @@ class OdinDataAdapter(ApiAdapter):
             response, status_code = self.send_to_clients(request_command, parameters, client_index)
         return response, status_code
 
+    def process_batch_configuration(self, items):
+        """Process a batch of configuration items in a single message for each client.
+
+        The items are merged with uri_params_to_dictionary into one nested configure message
+        for each client, which is then sent once.  Paths are relative to config/ and, as for a
+        single PUT, may end in a client index or have a list of values with one for each client.
+
+        :param items: dict mapping configuration paths to values
+        :return: tuple of response dict, with the result for each path, and status code
+        """
+        status_code = 200
+        results = {}
+        messages = [{} for _ in self._clients]
+        client_paths = [[] for _ in self._clients]
+        version_check = False
+
+        # Sorted so that parent paths are merged before any of their children
+        for path in sorted(items):
+            request_command = remove_prefix(path.strip('/'), "config/")
+            value = items[path]
+            client_index, uri_items = self.parse_uri(request_command)
+            command_path = '/'.join(uri_items)
+
+            if command_path == '' or command_path.startswith('config_file'):
+                results[path] = 'Invalid path for a batch request: {}'.format(path)
+                continue
+            if client_index >= len(self._clients):
+                results[path] = 'Invalid client index: {}'.format(client_index)
+                continue
+            if isinstance(value, list) and (client_index != -1 or len(value) != len(self._clients)):
+                results[path] = OdinDataAdapter.ERROR_PUT_MISMATCH
+                continue
+
+            if client_index == -1:
+                indexes = range(len(self._clients))
+            else:
+                indexes = [client_index]
+            for index in indexes:
+                param_set = value[index] if isinstance(value, list) else value
+                if isinstance(value, list) and not param_set:
+                    continue
+                command, param_dict = OdinDataAdapter.uri_params_to_dictionary(command_path, param_set)
+                OdinDataAdapter.merge_configuration(messages[index], {command: param_dict})
+                client_paths[index].append(path)
+
+            self.journal_configuration(request_command, value)
+            results[path] = 'ok'
+            if self.require_version_check(command_path) or self.require_version_check(uri_items[0]):
+                version_check = True
+
+        for index, message in enumerate(messages):
+            if message:
+                logging.debug("Sending batch configuration to client %d: %s", index, message)
+                send_response, send_status = self.send_to_clients(None, message, index)
+                if send_status != 200:
+                    for path in client_paths[index]:
+                        results[path] = send_response.get('error', OdinDataAdapter.ERROR_FAILED_TO_SEND)
+
+        if version_check:
+            self.request_version()
+
+        response = {'results': results}
+        errors = [result for result in results.values() if result != 'ok']
+        if errors:
+            status_code = 503
+            response['error'] = errors[0]
+            self.set_error(errors[0])
+        return response, status_code
+
     def process_configuration_file(self, config_file_path, client_index):
         status_code = 200
         response = {}
@@ -305,13 +458,9 @@ class OdinDataAdapter(ApiAdapter):
             try:
                 with open(config_file_path) as config_file:
                     config_obj = json.load(config_file)
-                    # Loop over the items in the object and send them all to the client(s)
-                    for message in config_obj:
-                        # for command in message:
-                        logging.debug("Sending message: %s", message)
-                        response, status_code = self.send_to_clients(None, message, client_index)
-                        if status_code != 200:
-                            return response, status_code
+                # Send all of the messages in the object to the client(s)
+                response, status_code = self.push_configuration(config_obj, client_index,
+                                                                config_file_path)
 
             except IOError as io_error:
                 logging.error("Failed to open configuration file: {}".format(io_error))
@@ -325,40 +474,130 @@ class OdinDataAdapter(ApiAdapter):
             logging.info("Not loading configuration file from an empty path")
         return response, status_code
 
+    def push_configuration(self, messages, client_index=-1, source=''):
+        """Push a list of configuration messages to the client(s).
+
+        The messages are pipelined, being sent one after the other to every client without
+        waiting in between, which preserves their order for each client.  The ACK or NACK replies
+        are then collected in the background and the progress of each client is reported in
+        status/config_push.
+
+        :param messages: list of configuration dicts to send
+        :param client_index: index of the client to send to, or -1 for all clients
+        :param source: description of where the messages came from, e.g. the config file path
+        :return: tuple of response dict and status code for sending the messages
+        """
+        status_code = 200
+        response = {}
+        if client_index == -1:
+            indexes = range(len(self._clients))
+        else:
+            indexes = [client_index]
+
+        start_time = time.time()
+        reply_futures = []
+        for message in messages:
+            logging.debug("Sending message: %s", message)
+            response, status_code = self.send_to_clients(None, message, client_index,
+                                                         reply_futures=reply_futures)
+            if status_code != 200:
+                break
+
+        for index in indexes:
+            self._config_push_count[index] += 1
+            futures = [future for (future_index, future) in reply_futures if future_index == index]
+            self._status['status/config_push'][index] = {
+                'file': source,
+                'state': 'pending',
+                'messages': len(futures),
+                'acked': 0,
+                'nacked': 0,
+                'duration': 0.0,
+                'error': response.get('error', '')
+            }
+            self._track_configuration_push(index, self._config_push_count[index], futures,
+                                           start_time)
+        self._versions.bump('status')
+
+        return response, status_code
+
+    @gen.coroutine
+    def _track_configuration_push(self, index, push_count, futures, start_time):
+        """Collect the replies to a configuration push for a single client.
+
+        :param index: index of the client
+        :param push_count: count of the push for this client, to ignore superseded pushes
+        :param futures: reply futures for each message sent to the client
+        :param start_time: time the push was started
+        """
+        push_status = self._status['status/config_push'][index]
+        for future in futures:
+            try:
+                yield future
+                push_status['acked'] += 1
+            except IpcMessageException as err:
+                push_status['nacked'] += 1
+                push_status['error'] = str(err)
+            self._versions.bump('status')
+            if push_count != self._config_push_count[index]:
+                # A newer push for this client has superseded this one
+                return
+
+        push_status['duration'] = time.time() - start_time
+        if push_status['nacked'] == 0 and push_status['error'] == '':
+            push_status['state'] = 'complete'
+        else:
+            push_status['state'] = 'failed'
+        self._versions.bump('status')
+        logging.debug("Configuration push to client %d %s in %.3fs", index, push_status['state'],
+                      push_status['duration'])
+
+    def journal_configuration(self, request_command, parameters):
+        """Record configuration in the per client journal of effective configuration.
+
+        The journal holds a single nested dict for each client, where the last value written to
+        each leaf path wins, so it can be replayed as one message when the client reconnects.
+
+        :param request_command: URI of the configuration, optionally ending in a client index
+        :param parameters: configuration value, or a list of values with one for each client
+        """
+        client_index, uri_items = self.parse_uri(request_command)
+        request_command = '/'.join(uri_items) or None
+        if client_index == -1:
+            indexes = range(len(self._clients))
+        else:
+            indexes = [client_index]
+
+        for index in indexes:
+            param_set = parameters
+            if isinstance(parameters, list):
+                if client_index != -1 or len(parameters) != len(self._clients):
+                    # The message will be rejected by send_to_clients so do not record it
+                    return
+                param_set = parameters[index]
+                if not param_set:
+                    continue
+            command, param_dict = OdinDataAdapter.uri_params_to_dictionary(request_command, param_set)
+            if command is not None:
+                param_dict = {command: param_dict}
+            if isinstance(param_dict, dict):
+                OdinDataAdapter.merge_configuration(self._config_journal[index], param_dict)
+
     def process_reconnection(self, client):
         # We have been notified that a client has reconnected.
-        # Loop over all stored configuration, sending any that needs to be processed
+        # Replay the configuration file followed by the journal of all other stored configuration
         logging.debug("Processing reconnection for client: %d", client)
         # First load the configuration file
         self.process_configuration_file(self._config_file[client], client)
 
-        # Now check all other stored parameters
-        for request_command in self._config_params:
-            parameters = self._config_params[request_command]
-            # Check if the request ends in an index and is it a match for our client
-            client_index = -1
-            uri_items = request_command.split('/')
-            # Check for an integer
+        # Now send the compacted journal for this client as a single message
+        if self._config_journal[client]:
+            logging.debug("Replaying configuration journal for client %d: %s",
+                          client, self._config_journal[client])
             try:
-                index = int(uri_items[-1])
-                if index >= 0:
-                    # This is a valid index so remove the value from the URI
-                    request_command = remove_suffix(request_command, "/" + uri_items[-1])
-                    # Set the client index for submitting config to
-                    client_index = index
-                    logging.debug("URI without index: %s", request_command)
-            except ValueError:
-                # This is OK, there is simply no index provided
-                pass
-
-            if client_index == -1 or client_index == client:
-                if client_index == -1:
-                    request_command = request_command + "/{}".format(client)
-                logging.debug("Client index match for request: %s with parameters: %s", request_command, parameters)
-                try:
-                    self.process_configuration(request_command, parameters)
-                except Exception as ex:
-                    logging.error(ex)
+                self.send_to_clients(None, copy.deepcopy(self._config_journal[client]), client)
+            except Exception as ex:
+                logging.error(ex)
 
         # Finally request version information
         self.request_version(client)
@@ -402,7 +641,7 @@ class OdinDataAdapter(ApiAdapter):
             response = {'error': OdinDataAdapter.ERROR_FAILED_TO_SEND}
         return response, status_code
 
-    def send_to_clients(self, request_command, parameters, client_index=-1):
+    def send_to_clients(self, request_command, parameters, client_index=-1, reply_futures=None):
         status_code = 200
         response = {}
 
@@ -420,12 +659,12 @@ class OdinDataAdapter(ApiAdapter):
                 response['error'] = OdinDataAdapter.ERROR_PUT_MISMATCH
             else:
                 # Loop over the clients and parameters, sending each one
-                for client, param_set in zip(self._clients, parameters):
+                for index, param_set in enumerate(parameters):
                     if param_set:
                         try:
                             command, parameters = OdinDataAdapter.uri_params_to_dictionary(request_command,
                                                                                            param_set)
-                            client.send_configuration(parameters, command)
+                            self.send_client_configuration(index, parameters, command, reply_futures)
                         except Exception as err:
                             logging.debug(OdinDataAdapter.ERROR_FAILED_TO_SEND)
                             logging.error("Error: %s", err)
@@ -437,9 +676,9 @@ class OdinDataAdapter(ApiAdapter):
             if client_index == -1:
                 # We are sending the value to all clients
                 command, parameters = OdinDataAdapter.uri_params_to_dictionary(request_command, parameters)
-                for client in self._clients:
+                for index in range(len(self._clients)):
                     try:
-                        client.send_configuration(parameters, command)
+                        self.send_client_configuration(index, parameters, command, reply_futures)
                     except Exception as err:
                         logging.debug(OdinDataAdapter.ERROR_FAILED_TO_SEND)
                         logging.error("Error: %s", err)
@@ -449,7 +688,7 @@ class OdinDataAdapter(ApiAdapter):
                 # A client index has been specified
                 try:
                     command, parameters = OdinDataAdapter.uri_params_to_dictionary(request_command, parameters)
-                    self._clients[client_index].send_configuration(parameters, command)
+                    self.send_client_configuration(client_index, parameters, command, reply_futures)
                 except Exception as err:
                     logging.debug(OdinDataAdapter.ERROR_FAILED_TO_SEND)
                     logging.error("Error: %s", err)
@@ -457,6 +696,23 @@ class OdinDataAdapter(ApiAdapter):
                     response = {'error': OdinDataAdapter.ERROR_FAILED_TO_SEND}
         return response, status_code
 
+    def send_client_configuration(self, client_index, parameters, command=None, reply_futures=None):
+        """Send a configuration message to a single client.
+
+        :param client_index: index of the client to send to
+        :param parameters: configuration parameters to send
+        :param command: optional parameter name to send the parameters under
+        :param reply_futures: if a list is given the reply is tracked and a tuple of the client
+            index and reply future is appended to it
+        """
+        client = self._clients[client_index]
+        if reply_futures is None:
+            client.send_configuration(parameters, command)
+        else:
+            future = client.send_configuration_with_reply(parameters, command,
+                                                          timeout=self._config_ack_timeout)
+            reply_futures.append((client_index, future))
+
     @staticmethod
     def traverse_parameters(param_set, uri_items):
         try:
@@ -467,6 +723,23 @@ class OdinDataAdapter(ApiAdapter):
             item_dict = None
         return item_dict
 
+    @staticmethod
+    def merge_configuration(target, source):
+        """Merge a nested configuration dict into another, leaf by leaf.
+
+        Nested dicts are merged recursively, any other value replaces the existing value.
+
+        :param target: dict to merge into
+        :param source: dict of new configuration
+        :return: the updated target dict
+        """
+        for key, value in source.items():
+            if isinstance(value, dict) and isinstance(target.get(key), dict):
+                OdinDataAdapter.merge_configuration(target[key], value)
+            else:
+                target[key] = copy.deepcopy(value)
+        return target
+
     @staticmethod
     def uri_params_to_dictionary(request_command, parameters):
         # Check to see if the request contains more than one item
@@ -495,48 +768,101 @@ class OdinDataAdapter(ApiAdapter):
         return command, param_dict
 
     def update_loop(self):
-        """Handle background update loop tasks.
-        This method handles background update tasks executed periodically in the tornado
-        IOLoop instance. This includes requesting the status from the underlying application
-        and preparing the JSON encoded reply in a format that can be easily parsed.
+        """Start the background update loop tasks.
+
+        Each client is polled on its own schedule within the tornado IOLoop instance, see
+        update_client.  The first poll of each client is staggered across one update interval
+        so that the clients do not all reply at the same moment.
         """
-        logging.debug("Updating status from client...")
+        for index in range(len(self._clients)):
+            self._schedule_client_update(index, random.uniform(0.0, self._update_interval))
 
-        # Handle background tasks
-        # Loop over all connected clients and obtain the status
-        index = 0
-        for client in self._clients:
-            try:
-                # First check for stale status within a client (1 seconds)
-                #client.check_for_stale_status(1.0)
-                # Now check for a transition from disconnected to connected
-                if not client.connected():
-                    self._client_connections[index] = False
-                else:
-                    if not self._client_connections[index]:
-                        self._client_connections[index] = True
-                        # Reconnection event so push configuration
-                        logging.debug("Client reconnection event")
-                        self.process_reconnection(index)
+    def _schedule_client_update(self, index, delay):
+        IOLoop.instance().call_later(delay, self.update_client, index)
 
+    def update_client(self, index):
+        """Handle background update tasks for a single client.
+
+        This method requests the status from the underlying application and processes any
+        reconnection, before rescheduling itself after the delay returned by next_update_delay.
+
+        :param index: index of the client to update
+        """
+        logging.debug("Updating status from client %d...", index)
+
+        client = self._clients[index]
+        try:
+            # Now check for a transition from disconnected to connected
+            if not client.connected():
+                self._client_connections[index] = False
+            else:
+                if not self._client_connections[index]:
+                    self._client_connections[index] = True
+                    # Reconnection event so push configuration
+                    logging.debug("Client reconnection event")
+                    self.process_reconnection(index)
+
+        except Exception as e:
+            # Exception caught, log the error but do not stop the update loop
+            logging.error("Unhandled exception: %s", e)
+
+        # Request parameter updates
+        for parameter_tree in ["status", "request_configuration"]:
+            try:
+                client.send_request(parameter_tree)
             except Exception as e:
-                # Exception caught, log the error but do not stop the update loop
+                # Log the error, but do not stop the update loop
                 logging.error("Unhandled exception: %s", e)
 
-            # Request parameter updates
-            for parameter_tree in ["status", "request_configuration"]:
-                try:
-                    client.send_request(parameter_tree)
-                except Exception as e:
-                    # Log the error, but do not stop the update loop
-                    logging.error("Unhandled exception: %s", e)
+        try:
+            self.process_updates()
+        except Exception as e:
+            logging.error("Unhandled exception: %s", e)
 
-            index += 1
+        # Schedule the next update of this client
+        self._schedule_client_update(index, self.next_update_delay(index))
 
-            self.process_updates()
+    def next_update_delay(self, index):
+        """Calculate the delay before the next update of a client.
+
+        Connected clients that are active are polled every update_interval and idle clients every
+        idle_update_interval.  Disconnected clients back off exponentially from update_interval up
+        to max_backoff_interval.  A random jitter is then applied to spread out the client replies.
+
+        :param index: index of the client
+        :return: delay in seconds
+        """
+        schedule = self._client_schedules[index]
+        if not self._clients[index].connected():
+            delay = min(self._update_interval * 2 ** schedule['failures'], self._max_backoff_interval)
+            if delay < self._max_backoff_interval:
+                schedule['failures'] += 1
+        else:
+            schedule['failures'] = 0
+            schedule['active'] = self.client_active(index)
+            if schedule['active']:
+                delay = self._update_interval
+            else:
+                delay = self._idle_update_interval
+
+        return delay * (1.0 + random.uniform(-self._update_jitter, self._update_jitter))
+
+    def client_active(self, index):
+        """Check if a client is currently active and so should be polled at the faster rate.
 
-        # Schedule the update loop to run in the IOLoop instance again after appropriate interval
-        IOLoop.instance().call_later(self._update_interval, self.update_loop)
+        By default a client is considered active if its status has changed since the previous
+        check, ignoring the timestamp.  Child classes can extend this with explicit checks,
+        for example whether an acquisition is running.
+
+        :param index: index of the client
+        :return: True if the client is active
+        """
+        schedule = self._client_schedules[index]
+        status = dict(self._clients[index].parameters.get('status', {}))
+        status.pop('timestamp', None)
+        active = schedule['last_status'] is not None and status != schedule['last_status']
+        schedule['last_status'] = status
+        return active
 
     def require_version_check(self, parameter):
         """Check if a version request is required after the configuration parameter has been submitted.
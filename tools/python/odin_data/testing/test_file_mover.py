@@ -0,0 +1,98 @@
+import logging
+import os
+import shutil
+import tempfile
+
+import h5py
+from nose.tools import assert_equal, assert_false, assert_true
+
+from odin_data.meta_writer.file_mover import FileMover
+from odin_data.meta_writer.meta_writer import MetaWriter
+
+
+class CopyingFileMover(FileMover):
+    """File mover that copies files as if the destination were on another filesystem."""
+
+    def same_filesystem(self):
+        return False
+
+
+class CorruptingFileMover(CopyingFileMover):
+    """File mover whose copies never match the checksum of the source."""
+
+    def checksum(self, file_name):
+        return 'corrupt'
+
+
+class TestFileMover:
+
+    def setup(self):
+        self.scratch = tempfile.mkdtemp()
+        self.directory = tempfile.mkdtemp()
+        self.logger = logging.getLogger('test_file_mover')
+        self.source = os.path.join(self.scratch, 'test_meta.h5')
+        with open(self.source, 'wb') as source_file:
+            source_file.write(os.urandom(10000))
+        self.destination = os.path.join(self.directory, 'test_meta.h5')
+
+    def teardown(self):
+        shutil.rmtree(self.scratch)
+        shutil.rmtree(self.directory)
+
+    def move(self, mover_class, source=None, destination=None):
+        mover = mover_class(self.logger, source or self.source, destination or self.destination)
+        mover.CHUNK_SIZE = 1024
+        mover.start()
+        mover.wait()
+        return mover
+
+    def test_rename(self):
+        mover = self.move(FileMover)
+        assert_equal(mover.state, 'complete')
+        assert_equal(mover.bytes_copied, 10000)
+        assert_true(os.path.exists(self.destination))
+        assert_false(os.path.exists(self.source))
+
+    def test_copy_verified(self):
+        checksum = FileMover(self.logger, self.source, self.destination).checksum(self.source)
+        mover = self.move(CopyingFileMover)
+        status = mover.status()
+        assert_equal(status['state'], 'complete')
+        assert_equal(status['bytes_total'], 10000)
+        assert_equal(status['bytes_copied'], 10000)
+        assert_true(status['duration'] >= 0)
+        assert_equal(mover.checksum(self.destination), checksum)
+        assert_false(os.path.exists(self.source))
+
+    def test_copy_directory(self):
+        source = os.path.join(self.scratch, 'test_meta')
+        os.makedirs(os.path.join(source, 'group'))
+        shutil.move(self.source, os.path.join(source, 'group', 'value.npy'))
+        destination = os.path.join(self.directory, 'test_meta')
+        mover = self.move(CopyingFileMover, source, destination)
+        assert_equal(mover.state, 'complete')
+        assert_equal(mover.files, 1)
+        assert_true(os.path.exists(os.path.join(destination, 'group', 'value.npy')))
+        assert_false(os.path.exists(source))
+
+    def test_checksum_mismatch(self):
+        mover = self.move(CorruptingFileMover)
+        assert_equal(mover.state, 'failed')
+        assert_true('Checksum' in mover.error)
+        assert_equal(os.listdir(self.directory), [])
+        assert_true(os.path.exists(self.source))
+
+    def test_writer_scratch_directory(self):
+        writer = MetaWriter(self.logger, self.directory, 'test_acq')
+        writer.scratch_directory = self.scratch
+        writer.add_dataset_definition('frame', (0,), (None,), 'int64', -1)
+        writer.create_file()
+        assert_equal(os.path.dirname(writer.full_file_name), self.scratch)
+        writer.add_dataset_values('frame', [0, 1, 2])
+        writer.close_file()
+        writer.file_mover.wait()
+
+        assert_false(writer.moving_file)
+        assert_equal(writer.file_move_status()['state'], 'complete')
+        with h5py.File(writer.destination_file_name, 'r') as meta_file:
+            assert_equal(meta_file['frame'][:].tolist(), [0, 1, 2])
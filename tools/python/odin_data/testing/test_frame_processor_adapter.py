@@ -0,0 +1,137 @@
+import sys
+import tempfile
+
+from nose.tools import assert_equal, assert_true, assert_raises
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from odin_data.ipc_message import IpcMessage
+from odin_data.frame_processor_adapter import FrameProcessorAdapter
+
+if sys.version_info[0] == 3:  # pragma: no cover
+    from unittest.mock import Mock
+else:                         # pragma: no cover
+    from mock import Mock
+
+
+class TestFrameProcessorAdapterStart:
+
+    def setup(self):
+        self.adapter = FrameProcessorAdapter(endpoints="127.0.0.1:15000, 127.0.0.1:15001")
+        for client in self.adapter._clients:
+            client.ctrl_channel._monitor_stream.close()
+            client.ctrl_channel._stream.close()
+            client.ctrl_channel = Mock()
+        self.adapter._param['config/hdf/file/path'] = tempfile.gettempdir()
+        self.adapter._param['config/hdf/file/name'] = 'test'
+        self.adapter._param['config/hdf/frames'] = 100
+        self.adapter._param['config/hdf/acquisition_id'] = 'acq'
+
+    def sent(self, index):
+        return [IpcMessage(from_str=call[0][0])
+                for call in self.adapter._clients[index].ctrl_channel.send.call_args_list]
+
+    def reply(self, index, msg_type, error=None):
+        request = [msg for msg in self.sent(index) if msg.get_msg_val() == 'configure'][-1]
+        reply = IpcMessage(msg_type, 'configure', id=request.get_msg_id())
+        if error is not None:
+            reply.set_param('error', error)
+        self.adapter._clients[index]._callback([reply.encode()])
+        IOLoop.current().run_sync(lambda: gen.sleep(0.01))
+
+    def test_single_message_per_client(self):
+        response, status_code = self.adapter.start_acquisition()
+        assert_equal(status_code, 200)
+        # The clients have not replied yet, so the start is reported as pending
+        assert_equal(response, {'acquisition_start': 'pending', 'acquisition_id': 'acq'})
+        for rank in range(2):
+            sent = self.sent(rank)
+            assert_equal(len(sent), 1)
+            assert_equal(sent[0].attrs['params'], {
+                'hdf': {
+                    'process': {'number': 2, 'rank': rank},
+                    'frames': 100,
+                    'acquisition_id': 'acq',
+                    'file': {'path': tempfile.gettempdir(), 'name': 'test', 'extension': 'h5'},
+                    'write': True
+                }
+            })
+        assert_equal(self.adapter._status['status/acquisition_start']['state'], 'pending')
+
+    def test_ready_after_all_acks(self):
+        self.adapter.start_acquisition()
+        start_status = self.adapter._status['status/acquisition_start']
+        self.reply(1, IpcMessage.ACK)
+        assert_equal(start_status['state'], 'pending')
+        assert_equal(start_status['clients'][1]['state'], 'ready')
+        self.reply(0, IpcMessage.ACK)
+        assert_equal(start_status['state'], 'ready')
+        assert_true(start_status['latency'] >= start_status['clients'][1]['latency'])
+
+    def test_failed_client(self):
+        self.adapter.start_acquisition()
+        self.reply(0, IpcMessage.ACK)
+        self.reply(1, IpcMessage.NACK, 'Unable to open file')
+        start_status = self.adapter._status['status/acquisition_start']
+        assert_equal(start_status['state'], 'failed')
+        assert_equal(start_status['clients'][1]['error'], 'Unable to open file')
+        assert_true('Unable to open file' in self.adapter._status['status/error'])
+
+
+class TestFrameProcessorAdapterNextAcquisition:
+
+    def setup(self):
+        self.adapter = FrameProcessorAdapter(endpoints="127.0.0.1:15000, 127.0.0.1:15001")
+        for client in self.adapter._clients:
+            client.ctrl_channel._monitor_stream.close()
+            client.ctrl_channel._stream.close()
+            client.ctrl_channel = Mock()
+        self.adapter._param['config/hdf/file/path'] = tempfile.gettempdir()
+        self.adapter._param['config/hdf/file/name'] = 'test'
+        self.adapter._param['config/hdf/acquisition_id'] = 'acq'
+        self.adapter._next_param['config/next/hdf/file/path'] = tempfile.gettempdir()
+        self.adapter._next_param['config/next/hdf/file/name'] = 'test_next'
+        self.adapter._next_param['config/next/hdf/acquisition_id'] = 'acq_next'
+        self.adapter._next_param['config/next/hdf/frames'] = 50
+
+    def sent(self, index):
+        return [IpcMessage(from_str=call[0][0])
+                for call in self.adapter._clients[index].ctrl_channel.send.call_args_list]
+
+    def reply(self, index, msg_type):
+        request = [msg for msg in self.sent(index) if msg.get_msg_val() == 'configure'][-1]
+        reply = IpcMessage(msg_type, 'configure', id=request.get_msg_id())
+        self.adapter._clients[index]._callback([reply.encode()])
+        IOLoop.current().run_sync(lambda: gen.sleep(0.01))
+
+    def test_stage_and_promote(self):
+        response, status_code = self.adapter.stage_next_acquisition()
+        assert_equal(status_code, 200)
+        assert_equal(self.sent(0)[0].attrs['params'], {
+            'hdf': {
+                'frames': 50,
+                'acquisition_id': 'acq_next',
+                'file': {'path': tempfile.gettempdir(), 'name': 'test_next', 'extension': 'h5'}
+            }
+        })
+        next_status = self.adapter._status['status/next_acquisition']
+        self.reply(0, IpcMessage.ACK)
+        assert_equal(next_status['state'], 'delivering')
+        self.reply(1, IpcMessage.ACK)
+        assert_equal(next_status['state'], 'staged')
+
+        # The current acquisition completes and the clients start the staged one
+        self.adapter._clients[1].parameters['status'] = {
+            'hdf': {'writing': True, 'acquisition_id': 'acq_next'}
+        }
+        self.adapter.process_updates()
+        assert_equal(next_status['state'], 'active')
+        assert_equal(self.adapter._param['config/hdf/acquisition_id'], 'acq_next')
+        assert_equal(self.adapter._param['config/hdf/file/name'], 'test_next')
+        assert_equal(self.adapter._param['config/hdf/frames'], 50)
+
+    def test_stage_rejects_identical_file(self):
+        self.adapter._next_param['config/next/hdf/file/name'] = 'test'
+        assert_raises(RuntimeError, self.adapter.stage_next_acquisition)
+        assert_equal(self.adapter._status['status/next_acquisition']['state'], 'failed')
+        assert_equal(self.adapter._clients[0].ctrl_channel.send.call_count, 0)
@@ -0,0 +1,167 @@
+import numpy
+import zmq
+from nose.tools import assert_equal, assert_false, assert_true
+
+from odin_data.meta_writer.frame_publisher import FramePublisher, decode_frame_records
+
+
+class RecordingSocket(object):
+    """Socket that records the messages sent on it."""
+
+    def __init__(self):
+        self.messages = []
+        self.closed = False
+
+    def set_hwm(self, hwm):
+        self.hwm = hwm
+
+    def setsockopt(self, option, value):
+        pass
+
+    def recv(self, flags=0):
+        raise zmq.Again()
+
+    def send_multipart(self, parts, flags=0):
+        self.messages.append(parts)
+
+    def close(self, linger=None):
+        self.closed = True
+
+
+class TestFramePublisher:
+
+    def setup(self):
+        self.socket = RecordingSocket()
+        self.publisher = FramePublisher(self.socket, interval=60.0)
+
+    def test_merge_ranks(self):
+        for frame in range(4):
+            assert_true(self.publisher.add_value('acq', frame, frame % 2, 'count', numpy.int32(frame * 10)))
+            assert_true(self.publisher.add_value('acq', frame, frame % 2, 'time', float(frame) / 2))
+        assert_false(self.publisher.add_value('acq', 0, 0, 'name', 'text'))
+        assert_equal(self.publisher.pending(), 4)
+
+        self.publisher.publish(force=True)
+        assert_equal(len(self.socket.messages), 1)
+        assert_equal(self.socket.messages[0][0], b'acq')
+        header, records = decode_frame_records(self.socket.messages[0])
+        assert_equal(header['records'], 4)
+        assert_equal((header['first'], header['last']), (0, 3))
+        assert_equal(records['frame'].tolist(), [0, 1, 2, 3])
+        assert_equal(records['rank'].tolist(), [0, 1, 0, 1])
+        assert_equal(records['count'].tolist(), [0, 10, 20, 30])
+        assert_equal(records['time'].tolist(), [0.0, 0.5, 1.0, 1.5])
+        assert_equal(self.publisher.pending(), 0)
+
+    def test_missing_values_filled(self):
+        self.publisher.add_value('acq', 0, 0, 'count', numpy.int32(1))
+        self.publisher.add_value('acq', 1, 0, 'time', 2.0)
+        self.publisher.publish(force=True)
+        _, records = decode_frame_records(self.socket.messages[0])
+        assert_equal(records['count'].tolist(), [1, -1])
+        assert_true(numpy.isnan(records['time'][0]))
+
+    def test_incomplete_records_held(self):
+        self.publisher.interval = 0.0
+        for frame in range(3):
+            self.publisher.add_value('acq', frame, 0, 'count', frame)
+        self.publisher.add_value('acq', 0, 1, 'time', 0.5)
+        self.publisher.add_value('acq', 1, 1, 'time', 1.5)
+        # Frame 2 has no time yet, so it is held back rather than published twice
+        self.publisher.publish()
+        _, records = decode_frame_records(self.socket.messages[0])
+        assert_equal(records['frame'].tolist(), [0, 1])
+        assert_equal(self.publisher.pending(), 1)
+        self.publisher.add_value('acq', 2, 1, 'time', 2.5)
+        self.publisher.publish()
+        _, records = decode_frame_records(self.socket.messages[1])
+        assert_equal(records['frame'].tolist(), [2])
+        assert_equal(records['count'].tolist(), [2])
+        assert_equal(records['time'].tolist(), [2.5])
+
+    def test_grace_period(self):
+        self.publisher.interval = 0.0
+        self.publisher.add_value('acq', 0, 0, 'count', 1)
+        self.publisher.add_value('acq', 0, 0, 'time', 0.5)
+        self.publisher.add_value('acq', 1, 0, 'count', 2)
+        self.publisher.publish()
+        assert_equal(self.publisher.pending(), 1)
+        self.publisher.grace = 0.0
+        self.publisher.publish()
+        _, records = decode_frame_records(self.socket.messages[1])
+        assert_equal(records['frame'].tolist(), [1])
+        assert_true(numpy.isnan(records['time'][0]))
+
+    def test_dtype_promoted(self):
+        self.publisher.add_value('acq', 0, 0, 'value', numpy.int32(1))
+        self.publisher.add_value('acq', 1, 0, 'value', 2.5)
+        self.publisher.add_value('acq', 2, 0, 'value', numpy.int64(2 ** 40))
+        self.publisher.publish(force=True)
+        _, records = decode_frame_records(self.socket.messages[0])
+        assert_equal(records['value'].dtype, numpy.float64)
+        assert_equal(records['value'].tolist(), [1.0, 2.5, 2.0 ** 40])
+
+    def test_interval(self):
+        self.publisher.publish(force=True)
+        self.publisher.add_value('acq', 0, 0, 'count', 1)
+        self.publisher.publish()
+        assert_equal(len(self.socket.messages), 0)
+        self.publisher.interval = 0.0
+        self.publisher.publish()
+        assert_equal(len(self.socket.messages), 1)
+
+    def test_batches(self):
+        self.publisher.MAX_BATCH_RECORDS = 3
+        for frame in range(7):
+            self.publisher.add_value('acq', frame, 0, 'count', frame)
+        self.publisher.add_value('other', 0, 0, 'count', 0)
+        self.publisher.publish(force=True)
+        assert_equal([parts[0] for parts in self.socket.messages], [b'acq'] * 3 + [b'other'])
+        assert_equal(self.publisher.status()['published'], 8)
+        assert_equal(self.publisher.status()['messages'], 4)
+
+    def test_conflate(self):
+        self.publisher.conflate = 2
+        for frame in range(5):
+            self.publisher.add_value('acq', frame, 0, 'count', frame)
+        self.publisher.publish(force=True)
+        _, records = decode_frame_records(self.socket.messages[0])
+        assert_equal(records['frame'].tolist(), [3, 4])
+        assert_equal(self.publisher.status()['conflated'], 3)
+
+    def test_close_publishes_pending(self):
+        self.publisher.add_value('acq', 0, 0, 'count', 1)
+        self.publisher.close()
+        assert_equal(len(self.socket.messages), 1)
+        assert_true(self.socket.closed)
+
+    def test_slow_subscriber_drops_counted(self):
+        context = zmq.Context.instance()
+        socket = context.socket(zmq.XPUB)
+        socket.bind('inproc://test_frame_publisher')
+        subscriber = context.socket(zmq.SUB)
+        subscriber.set_hwm(10)
+        subscriber.connect('inproc://test_frame_publisher')
+        subscriber.setsockopt(zmq.SUBSCRIBE, b'')
+        # Wait for the subscription to reach the publisher
+        socket.setsockopt(zmq.RCVTIMEO, 2000)
+        socket.recv()
+        publisher = FramePublisher(socket, interval=0.0)
+        # Nothing is read from the subscriber until all are sent, so messages beyond the high water
+        # mark are dropped without blocking
+        total = publisher.SEND_HWM * 3
+        for frame in range(total):
+            publisher.add_value('acq', frame, 0, 'count', frame)
+            publisher.publish()
+        status = publisher.status()
+        assert_true(status['dropped'] > 0)
+        assert_equal(status['messages'] + status['dropped'], total)
+
+        received = 0
+        while subscriber.poll(100):
+            subscriber.recv_multipart()
+            received += 1
+        assert_equal(received, status['messages'])
+        assert_equal(status['published'], received)
+        publisher.close()
+        subscriber.close(linger=0)
@@ -0,0 +1,92 @@
+import sys
+
+from nose.tools import assert_equal
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from odin_data.ipc_message import IpcMessage
+from odin_data.frame_receiver_adapter import FrameReceiverAdapter
+
+if sys.version_info[0] == 3:  # pragma: no cover
+    from unittest.mock import Mock
+else:                         # pragma: no cover
+    from mock import Mock
+
+
+class TestFrameReceiverAdapterDecoderConfig:
+
+    def setup(self):
+        self.adapter = FrameReceiverAdapter(endpoints="127.0.0.1:15000, 127.0.0.1:15001")
+        for client in self.adapter._clients:
+            client.ctrl_channel._monitor_stream.close()
+            client.ctrl_channel._stream.close()
+            client.ctrl_channel = Mock()
+
+    def sent(self, index, msg_type=IpcMessage.ACK):
+        # Reply to the messages sent to a client and return their parameters
+        client = self.adapter._clients[index]
+        sent = [IpcMessage(from_str=call[0][0]) for call in client.ctrl_channel.send.call_args_list]
+        client.ctrl_channel.send.reset_mock()
+        sent = [msg for msg in sent if msg.get_msg_val() == 'configure']
+        for msg in sent:
+            client._callback([IpcMessage(msg_type, msg.get_msg_val(), id=msg.get_msg_id()).encode()])
+        IOLoop.current().run_sync(lambda: gen.sleep(0.01))
+        return [msg.attrs['params'] for msg in sent]
+
+    def test_full_config_sent_on_change(self):
+        self.adapter.send_to_clients('decoder_config', {'enable_packet_logging': False, 'frame_timeout_ms': 1000})
+        self.sent(0)
+        self.adapter.send_to_clients('decoder_config/frame_timeout_ms', 2000)
+        assert_equal(self.sent(0), [{'decoder_config': {'enable_packet_logging': False,
+                                                        'frame_timeout_ms': 2000}}])
+
+    def test_unchanged_config_skipped(self):
+        self.adapter.send_to_clients(None, {'decoder_config': {'frame_timeout_ms': 1000},
+                                            'rx_ports': '8000'})
+        self.sent(0)
+        assert_equal(self.sent(1), [{'decoder_config': {'frame_timeout_ms': 1000}, 'rx_ports': '8000'}])
+        self.adapter.send_to_clients('decoder_config/frame_timeout_ms', 1000)
+        assert_equal(self.sent(0), [])
+        assert_equal(self.sent(1), [])
+        # Other items are still sent without the unchanged decoder config
+        self.adapter.send_to_clients(None, {'decoder_config': {'frame_timeout_ms': 1000},
+                                            'rx_ports': '8001'})
+        assert_equal(self.sent(1), [{'rx_ports': '8001'}])
+
+    def test_single_client_change(self):
+        self.adapter.send_to_clients('decoder_config/frame_timeout_ms', 1000)
+        self.sent(0)
+        self.sent(1)
+        self.adapter.send_to_clients('decoder_config/frame_timeout_ms', 3000, 1)
+        assert_equal(self.sent(0), [])
+        assert_equal(self.sent(1), [{'decoder_config': {'frame_timeout_ms': 3000}}])
+
+    def test_reconnection_resends(self):
+        self.adapter.send_to_clients('decoder_config/frame_timeout_ms', 1000)
+        self.sent(0)
+        self.adapter.process_reconnection(0)
+        self.adapter.send_to_clients('decoder_config/frame_timeout_ms', 1000)
+        assert_equal(self.sent(0)[-1], {'decoder_config': {'frame_timeout_ms': 1000}})
+
+    def test_rejected_config_resent(self):
+        self.adapter.send_to_clients('decoder_config/frame_timeout_ms', 1000)
+        self.sent(0, IpcMessage.NACK)
+        self.adapter.send_to_clients('decoder_config/frame_timeout_ms', 1000)
+        assert_equal(self.sent(0), [{'decoder_config': {'frame_timeout_ms': 1000}}])
+        # Once acknowledged the unchanged config is not sent again
+        self.adapter.send_to_clients('decoder_config/frame_timeout_ms', 1000)
+        assert_equal(self.sent(0), [])
+
+    def test_per_client_config_merged(self):
+        self.adapter.send_to_clients('decoder_config', {'enable_packet_logging': False, 'frame_timeout_ms': 1000})
+        self.sent(0)
+        self.sent(1)
+        # Each client is sent its full decoder config, merged with its own items
+        self.adapter.send_to_clients('decoder_config/frame_timeout_ms', [2000, 3000])
+        assert_equal(self.sent(0), [{'decoder_config': {'enable_packet_logging': False, 'frame_timeout_ms': 2000}}])
+        assert_equal(self.sent(1), [{'decoder_config': {'enable_packet_logging': False, 'frame_timeout_ms': 3000}}])
+        # and the acknowledged config of each client is its full config, so an unchanged config is skipped
+        self.adapter.send_to_clients(None, [{'decoder_config': {'frame_timeout_ms': 2000}, 'rx_ports': '8000'},
+                                            {'decoder_config': {'frame_timeout_ms': 4000}}])
+        assert_equal(self.sent(0), [{'rx_ports': '8000'}])
+        assert_equal(self.sent(1), [{'decoder_config': {'enable_packet_logging': False, 'frame_timeout_ms': 4000}}])
@@ -187,11 +187,13 @@ class TestLiveViewProxyAdapter(OdinTestServer):
     def test_adapter_get(self):
         response = self.adapter.get(self.path, self.request)
         assert_equal(response.status_code, 200)
-        assert_true("target_endpoint" in response.data)
-        assert_equal(len(response.data["nodes"]), len(self.config_node_list))
-        for key in response.data["nodes"]:
+        assert_true("etag" in response.data)
+        tree = response.data["value"]
+        assert_true("target_endpoint" in tree)
+        assert_equal(len(tree["nodes"]), len(self.config_node_list))
+        for key in tree["nodes"]:
             assert_true(key in self.config_node_list)
-            assert_equal(response.data["nodes"][key]["endpoint"], self.config_node_list[key])
+            assert_equal(tree["nodes"][key]["endpoint"], self.config_node_list[key])
 
     def test_adapter_put_reset(self):
         self.request.body = '{"reset": 0}'
@@ -0,0 +1,100 @@
+import json
+import os
+import shutil
+import struct
+import tempfile
+
+import h5py
+from nose.tools import assert_equal, assert_false, assert_true
+
+from odin_data.meta_writer.journal_replay import replay_journal
+from odin_data.meta_writer.meta_journal import MetaJournal, read_journal
+from odin_data.meta_writer.meta_listener import MetaListener
+from odin_data.meta_writer.meta_writer import MetaWriter
+
+
+class ValueWriter(MetaWriter):
+    """Meta writer writing the integer values sent to it."""
+
+    def __init__(self, logger, directory, acquisition_id):
+        super(ValueWriter, self).__init__(logger, directory, acquisition_id)
+        self.add_dataset_definition('value', (0,), (None,), 'int32', -1)
+
+    def process_message(self, message, userheader, receiver):
+        if not self.file_created:
+            self.create_file()
+        self.add_dataset_value('value', message['value'])
+
+
+class SmallJournal(MetaJournal):
+    """Meta journal extended in small chunks."""
+
+    CHUNK_SIZE = 64
+
+
+def value_message(value, acquisition_id='acq'):
+    header = {'header': {'acqID': acquisition_id}, 'parameter': 'value', 'type': 'integer'}
+    return [json.dumps(header).encode(), struct.pack('<i', value)]
+
+
+class TestMetaJournal:
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'acq_meta.journal')
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_read_records(self):
+        journal = SmallJournal(self.file_name, {'acquisition_id': 'acq'})
+        for value in range(10):
+            journal.append([b'header', struct.pack('<i', value)], value % 2)
+        journal.sync()
+
+        # Records can be read while the journal is open
+        header, records = read_journal(self.file_name)
+        assert_equal(header, {'acquisition_id': 'acq'})
+        assert_equal(len(records), 10)
+        assert_equal(records[3], (1, [b'header', struct.pack('<i', 3)]))
+
+        journal.close()
+        assert_equal(len(read_journal(self.file_name)[1]), 10)
+
+    def test_torn_record_ignored(self):
+        journal = MetaJournal(self.file_name, {})
+        journal.append([b'first'])
+        journal.append([b'second'])
+        journal.close()
+
+        with open(self.file_name, 'r+b') as journal_file:
+            journal_file.seek(-1, os.SEEK_END)
+            journal_file.write(b'X')
+        header, records = read_journal(self.file_name)
+        assert_equal(records, [(0, [b'first'])])
+
+    def test_replay(self):
+        listener = MetaListener(self.directory, '', 0, 'odin_data.testing.test_meta_journal.ValueWriter')
+        listener.handle_configure_message({'journal': True}, 1)
+        listener.handle_configure_message({'acquisition_id': 'acq', 'output_dir': self.directory}, 2)
+        for value in range(5):
+            listener.write_message(value_message(value))
+        # The writer dies before closing the file
+        listener._journals['acq'].close()
+
+        meta_file_name = os.path.join(self.directory, 'acq_meta.h5')
+        os.remove(meta_file_name)
+        assert_equal(replay_journal(self.file_name), meta_file_name)
+        with h5py.File(meta_file_name, 'r') as meta_file:
+            assert_equal(meta_file['value'][:].tolist(), [0, 1, 2, 3, 4])
+
+    def test_journal_removed_when_finished(self):
+        listener = MetaListener(self.directory, '', 0, 'odin_data.testing.test_meta_journal.ValueWriter')
+        listener.handle_configure_message({'journal': True}, 1)
+        listener.handle_configure_message({'acquisition_id': 'acq', 'output_dir': self.directory}, 2)
+        listener.write_message(value_message(1))
+        assert_true(os.path.exists(self.file_name))
+
+        listener.stop_writer(listener._writers['acq'])
+        assert_false(os.path.exists(self.file_name))
+        assert_equal(listener._journals, {})
@@ -0,0 +1,343 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy
+import zmq
+from nose.tools import assert_equal, assert_false, assert_true
+
+from odin_data.ipc_message import IpcMessage
+from odin_data.meta_writer.benchmark import run_benchmark
+from odin_data.meta_writer.frame_publisher import decode_frame_records
+from odin_data.meta_writer.meta_listener import MetaListener, decode_meta_value
+from odin_data.meta_writer.meta_writer import MetaWriter
+
+
+class RecordingWriter(MetaWriter):
+    """Meta writer recording the messages passed to it."""
+
+    def __init__(self, logger, directory, acquisition_id):
+        super(RecordingWriter, self).__init__(logger, directory, acquisition_id)
+        self.events = []
+        self.values = []
+
+    def process_message(self, message, userheader, receiver):
+        self.values.append(message.get('value'))
+        self.events.append((message['parameter'], receiver.recv()))
+
+    def stop(self):
+        self.events.append(('stop', None))
+        self.finished = True
+
+
+class StartingWriter(RecordingWriter):
+    """Writer that counts the frame processors that start the acquisition."""
+
+    def process_message(self, message, userheader, receiver):
+        super(StartingWriter, self).process_message(message, userheader, receiver)
+        if message['parameter'] == 'startacquisition':
+            self.number_processes_running += 1
+
+
+class WaitingSocket(object):
+    """Socket with a number of messages waiting to be received."""
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+
+    def recv_multipart(self, flags=0, copy=True):
+        if not self.messages:
+            raise zmq.Again()
+        return self.messages.pop(0)
+
+
+def meta_message(parameter, data, acquisition_id='acq'):
+    return [json.dumps({'header': {'acqID': acquisition_id}, 'parameter': parameter}), data]
+
+
+class TestMetaListener:
+
+    def setup(self):
+        self.listener = MetaListener('/tmp', 'tcp://127.0.0.1:5558', 5659,
+                                     'odin_data.testing.test_meta_listener.RecordingWriter')
+        self.listener.handle_configure_message({'acquisition_id': 'acq'}, 1)
+        self.writer = self.listener._writers['acq']
+
+    def test_write_without_thread(self):
+        self.listener.queue_message(meta_message('frame', b'1'))
+        self.listener.queue_message(meta_message('frame', b'2', 'other'))
+        assert_equal(self.writer.events, [('frame', b'1')])
+
+    def test_writer_thread_preserves_order(self):
+        self.listener._writer_thread = threading.Thread(target=self.listener.write_loop)
+        self.listener._writer_thread.start()
+
+        self.listener.queue_message(meta_message('frame', b'1'))
+        self.listener.queue_message(meta_message('frame', b'2'))
+        self.listener.handle_configure_message({'acquisition_id': 'acq', 'stop': True}, 2)
+        # The stop is queued behind the messages received before it
+        assert_equal(self.writer.events, [])
+        assert_equal(self.listener.writer_queue_status()['batch'], 3)
+
+        self.listener.submit_batch()
+        self.listener.stop_writer_thread()
+        assert_equal(self.writer.events, [('frame', b'1'), ('frame', b'2'), ('stop', None)])
+        status = self.listener.writer_queue_status()
+        assert_equal(status['written'], 2)
+        assert_equal(status['depth'], 0)
+
+    def test_writer_configured_on_writer_thread(self):
+        self.listener._writer_thread = threading.Thread(target=self.listener.write_loop)
+        reply = self.listener.handle_configure_message(
+            {'acquisition_id': 'acq', 'flush': 10, 'swmr': True, 'join': True, 'file_prefix': 'run'}, 2)
+        assert_equal(reply.get_msg_type(), IpcMessage.ACK)
+        # The writer is not changed from the control thread while it may be writing
+        assert_equal(self.writer.flush_frequency, 100)
+        assert_equal(self.writer.frame_join, None)
+        assert_equal(self.listener.writer_queue_status()['batch'], 4)
+
+        self.listener._writer_thread.start()
+        self.listener.submit_batch()
+        self.listener.stop_writer_thread()
+        assert_equal(self.writer.flush_frequency, 10)
+        assert_true(self.writer.swmr)
+        assert_equal(self.writer.file_prefix, 'run')
+        assert_true(self.writer.frame_join is not None)
+
+    def test_started_writer_not_force_finished(self):
+        listener = MetaListener('/tmp', 'tcp://127.0.0.1:5558', 5659,
+                                'odin_data.testing.test_meta_listener.StartingWriter')
+        listener.handle_configure_message({'acquisition_id': 'acq'}, 1)
+        listener._writer_thread = threading.Thread(target=listener.write_loop)
+        # The next acquisition is configured while the start of the first is still queued
+        listener.queue_message(meta_message('startacquisition', b''))
+        listener.handle_configure_message({'acquisition_id': 'next'}, 2)
+        listener.queue_message(meta_message('frame', b'1'))
+        listener.handle_configure_message({'acquisition_id': 'unused'}, 3)
+
+        listener._writer_thread.start()
+        listener.submit_batch()
+        listener.stop_writer_thread()
+        writer = listener._writers['acq']
+        assert_false(writer.finished)
+        assert_equal(writer.events, [('startacquisition', b''), ('frame', b'1')])
+        # The acquisition that was never started is still finished
+        assert_true(listener._writers['next'].finished)
+        assert_false(listener._writers['unused'].finished)
+
+    def test_full_queue_holds_batch(self):
+        self.listener._writer_thread = threading.Thread(target=self.listener.write_loop)
+        for _ in range(self.listener.WRITER_QUEUE_SIZE):
+            self.listener.queue_message(meta_message('frame', b'1'))
+            self.listener.submit_batch()
+        self.listener.queue_message(meta_message('frame', b'2'))
+        self.listener.submit_batch()
+        status = self.listener.writer_queue_status()
+        assert_equal(status['queue_full'], 1)
+        assert_equal(status['batch'], 1)
+        assert_equal(status['stalls'], 0)
+
+        self.listener._writer_thread.start()
+        self.listener.stop_writer_thread()
+        assert_equal(len(self.writer.events), self.listener.WRITER_QUEUE_SIZE + 1)
+        assert_equal(self.writer.events[-1], ('frame', b'2'))
+
+    def test_drain_messages(self):
+        self.listener._drain_size = 3
+        socket = WaitingSocket([meta_message('frame', str(i).encode()) for i in range(5)])
+        self.listener.drain_messages(socket)
+        assert_equal(len(self.writer.events), 3)
+        self.listener.drain_messages(socket)
+        self.listener.drain_messages(socket)
+        assert_equal(len(self.writer.events), 5)
+        assert_equal(self.listener.writer_queue_status()['received'], 5)
+
+    def test_decode_values(self):
+        frame = zmq.Frame(numpy.array([7], dtype='<u8').tobytes())
+        value = decode_meta_value({'type': 'uint64'}, frame)
+        assert_equal(value, 7)
+        assert_equal(value.dtype, numpy.dtype('uint64'))
+        assert_equal(decode_meta_value({'type': 'double'}, numpy.array([1.5]).tobytes()), 1.5)
+        assert_equal(decode_meta_value({'type': 'string'}, zmq.Frame(b'abc')), u'abc')
+
+        data = numpy.arange(6, dtype='<i2')
+        value = decode_meta_value({'type': 'raw', 'header': {'dtype': '<i2', 'shape': [2, 3]}},
+                                  zmq.Frame(data.tobytes()))
+        assert_equal(value.shape, (2, 3))
+        assert_equal(value.tolist(), [[0, 1, 2], [3, 4, 5]])
+        assert_false(value.flags.writeable)
+
+    def test_writer_receives_decoded_value(self):
+        parts = [zmq.Frame(json.dumps({'header': {'acqID': 'acq'}, 'parameter': 'frame',
+                                       'type': 'integer'}).encode()),
+                 zmq.Frame(numpy.array([42], dtype='<i4').tobytes())]
+        self.listener.write_message(parts)
+        assert_equal(self.writer.values, [42])
+        # The data part can still be read as bytes
+        assert_equal(self.writer.events[0][1], numpy.array([42], dtype='<i4').tobytes())
+
+    def test_input_status(self):
+        for frame in [0, 1, 2, 5]:
+            self.listener.handle_message(WaitingSocket([[json.dumps({
+                'header': {'acqID': 'acq', 'frame': frame}, 'plugin': 'p', 'parameter': 'frame'
+            }), b'']]))
+        reply = self.listener.handle_status_message(1)
+        assert_equal(reply.get_param('inputs')['0']['received'], 4)
+        assert_equal(reply.get_param('inputs')['0']['missing'], 2)
+        assert_equal(reply.get_param('acquisitions')['acq']['frame_sequence']['missing'], 2)
+
+
+class TestMetaListenerWriterRegistry:
+
+    def setup(self):
+        self.listener = MetaListener('/tmp', 'tcp://127.0.0.1:5558', 5659,
+                                     'odin_data.testing.test_meta_listener.RecordingWriter')
+
+    def test_request_version(self):
+        reply = self.listener.handle_request_version_message(1)
+        assert_equal(reply.get_param('version')['odin-data'], self.listener._version)
+        assert_equal(reply.get_param('version')['writer'], {})
+
+    def test_invalid_writer_rejected(self):
+        reply = self.listener.handle_configure_message({'writer': 'odin_data.testing.Missing'}, 1)
+        assert_equal(reply.get_msg_type(), IpcMessage.NACK)
+        assert_equal(self.listener._writer_module, 'odin_data.testing.test_meta_listener.RecordingWriter')
+
+    def test_prewarmed_writer(self):
+        self.listener.handle_configure_message({'prewarm': True}, 1)
+        spare = self.listener._registry._spares[self.listener._writer_module]
+
+        self.listener.handle_configure_message({'acquisition_id': 'acq', 'flush': 10}, 2)
+        writer = self.listener._writers['acq']
+        assert_true(writer is spare)
+        assert_equal(writer._acquisition_id, 'acq')
+        # A writer is ready for the next acquisition
+        assert_false(self.listener._registry._spares[self.listener._writer_module] is spare)
+
+        self.listener.handle_configure_message({'prewarm': False}, 3)
+        assert_equal(self.listener._registry.spares(), [])
+
+
+class TestMetaListenerWriterLifetime:
+
+    def setup(self):
+        self.listener = MetaListener('/tmp', 'tcp://127.0.0.1:5558', 5659,
+                                     'odin_data.testing.test_meta_listener.RecordingWriter')
+
+    def test_idle_writer_stopped(self):
+        self.listener.handle_configure_message({'acquisition_id': 'acq', 'flush': 10}, 1)
+        writer = self.listener._writers['acq']
+        writer.file_created = True
+        self.listener.check_writers()
+        assert_equal(writer.events, [])
+
+        reply = self.listener.handle_configure_message({'idle_timeout': 0}, 2)
+        assert_equal(reply.get_msg_type(), IpcMessage.ACK)
+        self.listener.check_writers()
+        assert_equal(writer.events, [('stop', None)])
+
+        # Finished writers are reported as not writing rather than removed by status requests
+        for msg_id in [3, 4]:
+            reply = self.listener.handle_status_message(msg_id)
+            assert_equal(reply.get_param('writers')['finished'], 1)
+            assert_false(reply.get_param('acquisitions')['acq']['writing'])
+
+        # and are evicted beyond the maximum number of finished writers
+        self.listener.handle_configure_message({'max_finished_writers': 0}, 5)
+        self.listener.check_writers()
+        assert_false('acq' in self.listener._writers)
+
+
+    def test_busy_writer_not_stopped(self):
+        self.listener.handle_configure_message({'idle_timeout': 0, 'max_open_writers': 1}, 1)
+        self.listener.handle_configure_message({'acquisition_id': 'acq'}, 2)
+        writer = self.listener._writers['acq']
+        writer.file_created = True
+        writer.number_processes_running = 1
+        self.listener.check_writers()
+        assert_equal(writer.events, [])
+
+        # A new acquisition is refused rather than closing a writer in use
+        reply = self.listener.handle_configure_message({'acquisition_id': 'next'}, 3)
+        assert_equal(reply.get_msg_type(), IpcMessage.NACK)
+        assert_false('next' in self.listener._writers)
+        assert_equal(self.listener.handle_request_config_message(4).get_param('max_open_writers'), 1)
+
+        writer.finished = True
+        reply = self.listener.handle_configure_message({'acquisition_id': 'next'}, 5)
+        assert_true('next' in self.listener._writers)
+
+
+class TestMetaListenerFrameJoin:
+
+    def test_join_inputs(self):
+        listener = MetaListener('/tmp', 'tcp://127.0.0.1:5558', 5659,
+                                'odin_data.testing.test_meta_listener.RecordingWriter')
+        listener.handle_configure_message({'acquisition_id': 'acq', 'join': True}, 1)
+        for frame in range(4):
+            header = {'header': {'acqID': 'acq', 'frame': frame}, 'parameter': 'count', 'type': 'integer'}
+            listener.write_message([json.dumps(header), numpy.int32(frame).tobytes()], frame % 2)
+        table = listener._writers['acq'].frame_join.table()
+        assert_equal(table['rank'].tolist(), [0, 1, 0, 1])
+        assert_equal(table['count'].tolist(), [0, 1, 2, 3])
+
+    def test_join_writeframe_rank(self):
+        listener = MetaListener('/tmp', 'tcp://127.0.0.1:5558', 5659,
+                                'odin_data.testing.test_meta_listener.RecordingWriter')
+        listener.handle_configure_message({'acquisition_id': 'acq', 'join': True}, 1)
+        # Both ranks publish on the same input, with the rank only in the value
+        for frame in range(4):
+            value = json.dumps({'frame': frame, 'offset': frame // 2, 'rank': frame % 2, 'proc': 2})
+            header = {'header': {'acqID': 'acq'}, 'plugin': 'hdf', 'parameter': 'writeframe',
+                      'type': 'string'}
+            listener.write_message([json.dumps(header), value.encode()])
+        table = listener._writers['acq'].frame_join.table()
+        assert_equal(table['rank'].tolist(), [0, 1, 0, 1])
+        assert_equal(table['offset'].tolist(), [0, 0, 1, 1])
+
+
+class TestMetaListenerPublish:
+
+    def test_publish_frames(self):
+        endpoint = 'inproc://test_meta_listener_publish'
+        listener = MetaListener('/tmp', 'tcp://127.0.0.1:5558', 5659,
+                                'odin_data.testing.test_meta_listener.RecordingWriter')
+        reply = listener.handle_configure_message({'publish': endpoint, 'publish_interval': 60}, 1)
+        assert_equal(reply.get_msg_type(), IpcMessage.ACK)
+        assert_equal(listener.handle_request_config_message(2).get_param('publish'), endpoint)
+
+        subscriber = zmq.Context.instance().socket(zmq.SUB)
+        subscriber.connect(endpoint)
+        subscriber.setsockopt(zmq.SUBSCRIBE, b'acq')
+        subscriber.setsockopt(zmq.RCVTIMEO, 2000)
+        time.sleep(0.1)
+
+        listener.handle_configure_message({'acquisition_id': 'acq'}, 3)
+        for frame in range(4):
+            header = {'header': {'acqID': 'acq', 'frame': frame, 'rank': frame % 2},
+                      'parameter': 'count', 'type': 'integer'}
+            listener.write_message([json.dumps(header), numpy.int32(frame).tobytes()])
+        assert_equal(listener.handle_status_message(4).get_param('publisher')['pending'], 4)
+
+        listener.close_publisher()
+        _, records = decode_frame_records(subscriber.recv_multipart())
+        subscriber.close(linger=0)
+        assert_equal(records['frame'].tolist(), [0, 1, 2, 3])
+        assert_equal(records['rank'].tolist(), [0, 1, 0, 1])
+        assert_equal(records['count'].tolist(), [0, 1, 2, 3])
+
+
+class TestMetaListenerBenchmark:
+
+    def test_publishers(self):
+        endpoint = 'ipc://{}/test_benchmark_{}'.format(tempfile.gettempdir(), os.getpid())
+        result = run_benchmark(500, publishers=2, endpoint=endpoint, ctrl=endpoint + '_ctrl', value_type='raw',
+                               size=64)
+        assert_equal(result['published'], 1000)
+        assert_equal(result['received'] + result['dropped'], 1000)
+        assert_equal(result['written'], result['received'])
+        assert_true(0 <= result['latency_p50'] <= result['latency_max'])
+        if os.path.exists(endpoint[len('ipc://'):] + '_ctrl'):
+            os.remove(endpoint[len('ipc://'):] + '_ctrl')
@@ -0,0 +1,275 @@
+import logging
+import os
+import shutil
+import tempfile
+
+import h5py
+import numpy
+from nose.tools import assert_equal, assert_false, assert_true
+
+from odin_data.meta_writer.meta_reader import MetaReader
+from odin_data.meta_writer.meta_writer import DatasetBuffer, FrameBitmap, FrameJoin, FrameSequence, MetaWriter, \
+    meta_frame_number, meta_frame_value, meta_rank
+
+
+class TestDatasetBuffer:
+
+    def test_append_and_grow(self):
+        buffer = DatasetBuffer('int32', initial_size=2)
+        for value in range(5):
+            buffer.append(value)
+        assert_equal(len(buffer), 5)
+        assert_equal(buffer.values.dtype, numpy.dtype('int32'))
+        assert_equal(list(buffer.values), [0, 1, 2, 3, 4])
+        assert_equal(buffer[-1], 4)
+
+    def test_extend(self):
+        buffer = DatasetBuffer('float64', value_shape=(2,), initial_size=1)
+        buffer.extend([[1, 2], [3, 4], [5, 6]])
+        buffer.extend([7, 8])
+        assert_equal(buffer.values.shape, (4, 2))
+        assert_equal(buffer.values[3].tolist(), [7.0, 8.0])
+        buffer.clear()
+        assert_equal(len(buffer), 0)
+
+
+class TestFrameSequence:
+
+    def test_interleaved_frames(self):
+        sequence = FrameSequence()
+        # Every second frame from one of two frameProcessors, with the other not received
+        for frame in [1, 3, 5, 7, 7, 9]:
+            sequence.update(frame)
+        assert_equal(sequence.duplicates, 1)
+        assert_equal(sequence.missing, 4)
+        sequence.update(11)
+        sequence.update(10)
+        assert_equal(sequence.out_of_order, 1)
+
+    def test_blocks_across_ranks(self):
+        # Two frameProcessors each handling blocks of two frames, with frame 5 dropped
+        bitmap = FrameBitmap()
+        rank0 = FrameSequence(bitmap)
+        rank1 = FrameSequence(bitmap)
+        for frame in [0, 1, 4]:
+            rank0.update(frame)
+        for frame in [2, 3, 6, 7, 7]:
+            rank1.update(frame)
+        assert_equal(rank0.missing, 0)
+        assert_equal(rank1.missing, 1)
+        assert_equal(rank1.duplicates, 1)
+        assert_equal(bitmap.missing(), 1)
+        # A late frame is no longer missing
+        rank0.update(5)
+        assert_equal(rank1.missing, 0)
+        assert_equal(rank0.duplicates, 0)
+        rank0.update(-1)
+        assert_equal(rank0.invalid, 1)
+
+    def test_frame_number(self):
+        assert_equal(meta_frame_number({'header': {'frame': 3}}), 3)
+        assert_equal(meta_frame_number({'header': {'acqID': 'a'}, 'parameter': 'writeframe',
+                                        'value': '{"frame": 4, "offset": 2}'}), 4)
+        assert_equal(meta_frame_number({'header': {'acqID': 'a'}, 'parameter': 'createfile'}), None)
+
+    def test_rank_and_value(self):
+        writeframe = {'header': {'acqID': 'a'}, 'parameter': 'writeframe',
+                      'value': '{"frame": 4, "offset": 2, "rank": 3, "proc": 4}'}
+        assert_equal(meta_rank(writeframe, 0), 3)
+        assert_equal(meta_frame_value(writeframe), ('offset', 2))
+        assert_equal(meta_rank({'header': {'rank': 1}, 'parameter': 'count', 'value': 5}, 0), 1)
+        assert_equal(meta_rank({'header': {}, 'parameter': 'count', 'value': 5}, 2), 2)
+        assert_equal(meta_frame_value({'header': {}, 'parameter': 'count', 'value': 5}), ('count', 5))
+
+
+class TestFrameJoin:
+
+    def test_join_ranks(self):
+        join = FrameJoin()
+        # Two ranks each handling every second frame, with frame 4 not published
+        join.add_values('exposure', [0, 2], 0, [0.5, 2.5])
+        join.add_values('exposure', [1, 3, 5], [1, 1, 1], [1.5, 3.5, 5.5])
+        for frame in [0, 1, 2, 3]:
+            assert_true(join.add_value('count', frame, frame % 2, frame * 10))
+        assert_false(join.add_value('name', 0, 0, 'text'))
+        assert_equal(len(join), 5)
+
+        join.add_value('exposure', 6, 0, 6.5)
+        table = join.table()
+        assert_equal(table.dtype.names, ('frame', 'rank', 'exposure', 'count'))
+        assert_equal(table['frame'].tolist(), [0, 1, 2, 3, 5, 6])
+        assert_equal(table['rank'].tolist(), [0, 1, 0, 1, 1, 0])
+        assert_equal(table['exposure'].tolist(), [0.5, 1.5, 2.5, 3.5, 5.5, 6.5])
+        assert_equal(table['count'].tolist(), [0, 10, 20, 30, -1, -1])
+
+    def test_dtype_promoted(self):
+        join = FrameJoin()
+        join.add_value('x', 0, 0, 1)
+        join.add_value('x', 1, 0, 2.5)
+        table = join.table()
+        assert_equal(table['x'].dtype, numpy.float64)
+        assert_equal(table['x'].tolist(), [1.0, 2.5])
+
+        # A merged integer column is promoted, with the frames it has no value for filled with NaN
+        join.add_value('y', 0, 0, numpy.int32(3))
+        join.table()
+        join.add_value('y', 2, 0, 4.5)
+        table = join.table()
+        assert_equal(table['y'].dtype, numpy.float64)
+        assert_equal(table['y'][[0, 2]].tolist(), [3.0, 4.5])
+        assert_true(numpy.isnan(table['y'][1]))
+
+
+class ArrayWriter(MetaWriter):
+    """Writer overriding write_datasets to write every buffered value at close, as detector writers do."""
+
+    def write_datasets(self):
+        for dset_name in self._data_set_definition:
+            length = len(self._data_set_arrays[dset_name])
+            self._hdf5_datasets[dset_name].resize((length,) + self._hdf5_datasets[dset_name].shape[1:])
+            self._hdf5_datasets[dset_name][0:length] = self._data_set_arrays[dset_name]
+
+
+class TestMetaWriter:
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.writer = MetaWriter(logging.getLogger('test'), self.directory, 'test_acq')
+        self.writer.add_dataset_definition('frame', (0,), (None,), 'int64', -1)
+        self.writer.add_dataset_definition('position', (0, 2), (None, 2), 'float32', 0)
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_values(self):
+        self.writer.create_file()
+        self.writer.add_dataset_value('frame', 0)
+        self.writer.add_dataset_values('frame', numpy.arange(1, 4))
+        self.writer.add_dataset_values('position', numpy.ones((3, 2)))
+        self.writer.close_file()
+
+        assert_true(self.writer.finished)
+        with h5py.File(os.path.join(self.directory, 'test_acq_meta.h5'), 'r') as meta_file:
+            assert_equal(meta_file['frame'][:].tolist(), [0, 1, 2, 3])
+            assert_equal(meta_file['position'].shape, (3, 2))
+
+    def test_incremental_flush(self):
+        self.writer.flush_frequency = 3
+        self.writer.create_file()
+        self.writer.add_dataset_values('frame', [0, 1])
+        assert_equal(self.writer._data_set_lengths['frame'], 0)
+        self.writer.add_dataset_value('frame', 2)
+        # Buffered values are written and the dataset has grown to hold them
+        assert_equal(self.writer._data_set_lengths['frame'], 3)
+        assert_equal(len(self.writer._data_set_arrays['frame']), 0)
+        assert_equal(self.writer._hdf5_datasets['frame'][0:3].tolist(), [0, 1, 2])
+        self.writer.add_dataset_values('frame', [3, 4, 5, 6])
+        assert_equal(self.writer._hdf5_datasets['frame'].shape, (7,))
+        self.writer.add_dataset_values('frame', [7, 8, 9])
+        assert_equal(self.writer._hdf5_datasets['frame'].shape, (14,))
+        self.writer.close_file()
+
+        with h5py.File(os.path.join(self.directory, 'test_acq_meta.h5'), 'r') as meta_file:
+            assert_equal(meta_file['frame'][:].tolist(), list(range(10)))
+
+    def test_overridden_write_datasets_not_flushed(self):
+        writer = ArrayWriter(logging.getLogger('test'), self.directory, 'test_acq')
+        writer.add_dataset_definition('frame', (0,), (None,), 'int64', -1)
+        writer.flush_frequency = 3
+        writer.flush_timeout = 0
+        assert_false(writer.incremental_flush)
+        writer.create_file()
+        writer.add_dataset_values('frame', numpy.arange(5))
+        writer.check_flush_timeout()
+        assert_equal(len(writer._data_set_arrays['frame']), 5)
+        writer.close_file()
+
+        with h5py.File(os.path.join(self.directory, 'test_acq_meta.h5'), 'r') as meta_file:
+            assert_equal(meta_file['frame'][:].tolist(), list(range(5)))
+
+    def test_flush_timeout(self):
+        self.writer.flush_frequency = 0
+        self.writer.flush_timeout = 0
+        self.writer.create_file()
+        self.writer.add_dataset_values('frame', [0, 1])
+        assert_equal(self.writer._data_set_lengths['frame'], 0)
+        self.writer.check_flush_timeout()
+        assert_equal(self.writer._data_set_lengths['frame'], 2)
+        self.writer.close_file()
+
+    def test_swmr_read_while_writing(self):
+        self.writer.swmr = True
+        self.writer.flush_frequency = 2
+        self.writer.create_file()
+        self.writer.add_dataset_values('frame', [0, 1])
+
+        reader = MetaReader(self.writer.full_file_name)
+        try:
+            new_values = reader.poll(timeout=1.0)
+            assert_equal(new_values['frame'].tolist(), [0, 1])
+            assert_true('position' not in new_values)
+            assert_equal(reader.poll(timeout=0.0), {})
+            self.writer.add_dataset_values('frame', [2, 3])
+            assert_equal(reader.poll(timeout=1.0)['frame'].tolist(), [2, 3])
+        finally:
+            reader.close()
+        self.writer.close_file()
+
+    def test_frame_sequences_written(self):
+        self.writer.swmr = True
+        self.writer.create_file()
+        for frame in [0, 1, 3]:
+            self.writer.update_frame_sequence((0, 'plugin', 'frame'), frame)
+        assert_equal(self.writer.frame_sequence_status()['missing'], 1)
+        self.writer.close_file()
+
+        with h5py.File(os.path.join(self.directory, 'test_acq_meta.h5'), 'r') as meta_file:
+            assert_equal(meta_file['frame_sequences'].attrs['missing'], 1)
+            assert_equal(meta_file['frame_sequences/input0/plugin/frame'].attrs['received'], 3)
+
+    def test_frame_indexed_writes(self):
+        self.writer.add_dataset_definition('exposure', (0,), (None,), 'float64', -1.0, indexed=True)
+        self.writer._num_frames_to_write = 8
+        self.writer.flush_frequency = 4
+        self.writer.create_file()
+        # Interleaved values from two frameProcessors, with frame 5 missing and frame 2 repeated
+        self.writer.add_frame_values('exposure', [1, 3, 0, 2], [1.0, 3.0, 0.0, 9.0])
+        self.writer.add_frame_value('exposure', 6, 6.0)
+        self.writer.add_frame_values('exposure', [2, 4], [2.0, 4.0])
+        self.writer.add_frame_value('exposure', 9, 9.0)
+        self.writer.add_frame_value('exposure', 7, 7.0)
+        # Frame 7 is still buffered
+        assert_equal(self.writer.frames_written('exposure'), 7)
+        self.writer.close_file()
+        assert_equal(self.writer.frames_written('exposure'), 8)
+
+        with h5py.File(os.path.join(self.directory, 'test_acq_meta.h5'), 'r') as meta_file:
+            assert_equal(meta_file['exposure'][:].tolist(),
+                         [0.0, 1.0, 2.0, 3.0, 4.0, -1.0, 6.0, 7.0, -1.0, 9.0])
+            assert_equal(meta_file['exposure_written'][:].tolist(), [1, 1, 1, 1, 1, 0, 1, 1, 0, 1])
+
+    def test_frame_indexed_interleaved_and_invalid(self):
+        self.writer.add_dataset_definition('exposure', (0,), (8,), 'float64', -1.0, indexed=True)
+        self.writer.create_file()
+        self.writer.add_frame_values('exposure', [6, 0, 2, 4, -1, 8], [6.0, 0.0, 2.0, 4.0, 9.0, 9.0])
+        self.writer.flush_datasets()
+        assert_equal(self.writer.frames_written('exposure'), 4)
+        self.writer.add_frame_values('exposure', [1, 3, 7], [1.0, 3.0, 7.0])
+        self.writer.close_file()
+
+        with h5py.File(os.path.join(self.directory, 'test_acq_meta.h5'), 'r') as meta_file:
+            assert_equal(meta_file['exposure'][:].tolist(), [0.0, 1.0, 2.0, 3.0, 4.0, -1.0, 6.0, 7.0])
+            assert_equal(meta_file['exposure_written'][:].tolist(), [1, 1, 1, 1, 1, 0, 1, 1])
+
+    def test_frame_table_written(self):
+        self.writer.swmr = True
+        self.writer.frame_join = FrameJoin()
+        self.writer.create_file()
+        for frame in range(4):
+            self.writer.add_joined_value('exposure', frame, frame % 2, float(frame))
+        self.writer.close_file()
+
+        with h5py.File(os.path.join(self.directory, 'test_acq_meta.h5'), 'r') as meta_file:
+            table = meta_file[MetaWriter.FRAME_TABLE][:]
+            assert_equal(table['rank'].tolist(), [0, 1, 0, 1])
+            assert_equal(table['exposure'].tolist(), [0.0, 1.0, 2.0, 3.0])
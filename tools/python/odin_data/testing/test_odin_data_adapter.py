@@ -0,0 +1,278 @@
+import json
+import sys
+import tempfile
+
+from nose.tools import assert_equal, assert_true, assert_false
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from odin_data.ipc_message import IpcMessage
+from odin_data.meta_listener_adapter import MetaListenerAdapter
+from odin_data.odin_data_adapter import OdinDataAdapter
+
+if sys.version_info[0] == 3:  # pragma: no cover
+    from unittest.mock import Mock
+else:                         # pragma: no cover
+    from mock import Mock
+
+
+def reply_to(client, msg_type, error=None):
+    """Reply to every message sent through a mocked client control channel."""
+    for call in client.ctrl_channel.send.call_args_list:
+        request = IpcMessage(from_str=call[0][0])
+        reply = IpcMessage(msg_type, request.get_msg_val(), id=request.get_msg_id())
+        if error is not None:
+            reply.set_param('error', error)
+        client._callback([reply.encode()])
+
+
+class TestOdinDataAdapterSchedule:
+
+    def setup(self):
+        self.adapter = OdinDataAdapter(endpoints="127.0.0.1:15000, 127.0.0.1:15001",
+                                       update_interval=0.5,
+                                       idle_update_interval=2.0,
+                                       max_backoff_interval=4.0,
+                                       update_jitter=0.0)
+
+    def teardown(self):
+        for client in self.adapter._clients:
+            client.ctrl_channel._monitor_stream.close()
+            client.ctrl_channel._stream.close()
+
+    def test_disconnected_backoff(self):
+        delays = [self.adapter.next_update_delay(0) for _ in range(5)]
+        assert_equal(delays, [0.5, 1.0, 2.0, 4.0, 4.0])
+
+    def test_idle_and_active(self):
+        client = self.adapter._clients[1]
+        client.parameters['status'] = {'connected': True, 'frames': 0, 'timestamp': 'a'}
+        # First check has nothing to compare against so the client is idle
+        assert_equal(self.adapter.next_update_delay(1), 2.0)
+        # A changed timestamp alone does not make the client active
+        client.parameters['status'] = {'connected': True, 'frames': 0, 'timestamp': 'b'}
+        assert_equal(self.adapter.next_update_delay(1), 2.0)
+        client.parameters['status'] = {'connected': True, 'frames': 10, 'timestamp': 'c'}
+        assert_equal(self.adapter.next_update_delay(1), 0.5)
+        assert_true(self.adapter._client_schedules[1]['active'])
+
+    def test_reconnection_resets_backoff(self):
+        client = self.adapter._clients[0]
+        self.adapter.next_update_delay(0)
+        self.adapter.next_update_delay(0)
+        client.parameters['status'] = {'connected': True}
+        assert_equal(self.adapter.next_update_delay(0), 2.0)
+        assert_equal(self.adapter._client_schedules[0]['failures'], 0)
+        assert_false(self.adapter._client_schedules[0]['active'])
+
+    def test_jitter(self):
+        self.adapter._update_jitter = 0.1
+        for _ in range(20):
+            self.adapter._client_schedules[0]['failures'] = 0
+            delay = self.adapter.next_update_delay(0)
+            assert_true(0.45 <= delay <= 0.55)
+
+
+class TestOdinDataAdapterConfigPush:
+
+    def setup(self):
+        self.adapter = OdinDataAdapter(endpoints="127.0.0.1:15000, 127.0.0.1:15001",
+                                       config_ack_timeout=1.0)
+        for client in self.adapter._clients:
+            client.ctrl_channel._monitor_stream.close()
+            client.ctrl_channel._stream.close()
+            client.ctrl_channel = Mock()
+
+        self.config_file = tempfile.NamedTemporaryFile(mode='w+', suffix='.json')
+        json.dump([{'plugin': {'load': 'a'}}, {'plugin': {'connect': 'b'}}], self.config_file)
+        self.config_file.flush()
+
+    def teardown(self):
+        self.config_file.close()
+
+    def spin(self):
+        IOLoop.current().run_sync(lambda: gen.sleep(0.01))
+
+    def test_push_messages_in_order(self):
+        response, status_code = self.adapter.process_configuration_file(self.config_file.name, -1)
+        assert_equal(status_code, 200)
+        for client in self.adapter._clients:
+            sent = [IpcMessage(from_str=call[0][0]) for call in client.ctrl_channel.send.call_args_list]
+            assert_equal([msg.attrs['params'] for msg in sent],
+                         [{'plugin': {'load': 'a'}}, {'plugin': {'connect': 'b'}}])
+        for push in self.adapter._status['status/config_push']:
+            assert_equal(push['state'], 'pending')
+            assert_equal(push['messages'], 2)
+
+    def test_push_acknowledged(self):
+        self.adapter.process_configuration_file(self.config_file.name, -1)
+        reply_to(self.adapter._clients[0], IpcMessage.ACK)
+        reply_to(self.adapter._clients[1], IpcMessage.NACK, 'bad plugin')
+        self.spin()
+        pushes = self.adapter._status['status/config_push']
+        assert_equal(pushes[0]['state'], 'complete')
+        assert_equal(pushes[0]['acked'], 2)
+        assert_true(pushes[0]['duration'] > 0.0)
+        assert_equal(pushes[1]['state'], 'failed')
+        assert_equal(pushes[1]['nacked'], 2)
+        assert_equal(pushes[1]['error'], 'bad plugin')
+
+    def test_push_single_client(self):
+        self.adapter.process_configuration_file(self.config_file.name, 1)
+        assert_equal(self.adapter._clients[0].ctrl_channel.send.call_count, 0)
+        assert_equal(self.adapter._clients[1].ctrl_channel.send.call_count, 2)
+        assert_equal(self.adapter._status['status/config_push'][0]['state'], 'idle')
+
+
+class TestOdinDataAdapterJournal:
+
+    def setup(self):
+        self.adapter = OdinDataAdapter(endpoints="127.0.0.1:15000, 127.0.0.1:15001")
+        for client in self.adapter._clients:
+            client.ctrl_channel._monitor_stream.close()
+            client.ctrl_channel._stream.close()
+            client.ctrl_channel = Mock()
+
+    def test_merge_configuration(self):
+        target = {'hdf': {'frames': 1, 'file': {'path': '/a'}}, 'plugin': 'x'}
+        OdinDataAdapter.merge_configuration(target, {'hdf': {'file': {'name': 'b'}}, 'plugin': {'y': 1}})
+        assert_equal(target, {'hdf': {'frames': 1, 'file': {'path': '/a', 'name': 'b'}},
+                              'plugin': {'y': 1}})
+
+    def test_journal_last_write_wins(self):
+        self.adapter.journal_configuration('hdf', {'frames': 10, 'file': {'path': '/tmp'}})
+        self.adapter.journal_configuration('hdf/frames', 20)
+        self.adapter.journal_configuration('hdf/frames/1', 30)
+        self.adapter.journal_configuration('hdf/file/name', ['a', 'b'])
+        assert_equal(self.adapter._config_journal[0],
+                     {'hdf': {'frames': 20, 'file': {'path': '/tmp', 'name': 'a'}}})
+        assert_equal(self.adapter._config_journal[1],
+                     {'hdf': {'frames': 30, 'file': {'path': '/tmp', 'name': 'b'}}})
+
+    def test_reconnection_replays_single_message(self):
+        self.adapter.journal_configuration('hdf/frames', 20)
+        self.adapter.journal_configuration('hdf/acquisition_id', 'test')
+        self.adapter.process_reconnection(1)
+        sent = [IpcMessage(from_str=call[0][0])
+                for call in self.adapter._clients[1].ctrl_channel.send.call_args_list]
+        assert_equal([msg.get_msg_val() for msg in sent], ['configure', 'request_version'])
+        assert_equal(sent[0].attrs['params'], {'hdf': {'frames': 20, 'acquisition_id': 'test'}})
+        assert_equal(self.adapter._clients[0].ctrl_channel.send.call_count, 0)
+
+
+class TestOdinDataAdapterBatch:
+
+    def setup(self):
+        self.adapter = OdinDataAdapter(endpoints="127.0.0.1:15000, 127.0.0.1:15001")
+        for client in self.adapter._clients:
+            client.ctrl_channel._monitor_stream.close()
+            client.ctrl_channel._stream.close()
+            client.ctrl_channel = Mock()
+
+    def sent(self, index):
+        return [IpcMessage(from_str=call[0][0])
+                for call in self.adapter._clients[index].ctrl_channel.send.call_args_list]
+
+    def test_batch_single_message_per_client(self):
+        response, status_code = self.adapter.process_batch_configuration({
+            'config/hdf/frames': 10,
+            'hdf/file/name': ['a', 'b'],
+            'hdf/acquisition_id/1': 'acq',
+            'plugin': {'connect': {'index': 'hdf'}}
+        })
+        assert_equal(status_code, 200)
+        assert_equal(set(response['results'].values()), {'ok'})
+        sent_0 = self.sent(0)
+        sent_1 = self.sent(1)
+        assert_equal(len(sent_0), 1)
+        assert_equal(len(sent_1), 1)
+        assert_equal(sent_0[0].attrs['params'], {'hdf': {'frames': 10, 'file': {'name': 'a'}},
+                                                'plugin': {'connect': {'index': 'hdf'}}})
+        assert_equal(sent_1[0].attrs['params'], {'hdf': {'frames': 10, 'file': {'name': 'b'},
+                                                         'acquisition_id': 'acq'},
+                                                'plugin': {'connect': {'index': 'hdf'}}})
+
+    def test_batch_reports_failed_paths(self):
+        response, status_code = self.adapter.process_batch_configuration({
+            'hdf/frames': 10,
+            'hdf/file/name': ['a'],
+            'config_file': '/tmp/config.json',
+            'hdf/frames/4': 1
+        })
+        assert_equal(status_code, 503)
+        assert_equal(response['results']['hdf/frames'], 'ok')
+        assert_equal(response['results']['hdf/file/name'], OdinDataAdapter.ERROR_PUT_MISMATCH)
+        assert_true(response['results']['config_file'].startswith('Invalid path'))
+        assert_true(response['results']['hdf/frames/4'].startswith('Invalid client index'))
+        assert_equal(self.sent(0)[0].attrs['params'], {'hdf': {'frames': 10}})
+
+
+class TestOdinDataAdapterVersions:
+
+    def setup(self):
+        self.adapter = OdinDataAdapter(endpoints="127.0.0.1:15000, 127.0.0.1:15001")
+        for client in self.adapter._clients:
+            client.ctrl_channel._monitor_stream.close()
+            client.ctrl_channel._stream.close()
+            client.ctrl_channel = Mock()
+        self.request = Mock()
+        self.request.headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
+
+    def status_reply(self, client, frames):
+        reply = IpcMessage(IpcMessage.ACK, 'status', id=1)
+        reply.set_param('hdf', {'frames_written': frames})
+        client._callback([reply.encode()])
+
+    def test_conditional_get(self):
+        client = self.adapter._clients[0]
+        self.status_reply(client, 1)
+        response = self.adapter.get('status/hdf/frames_written', self.request)
+        etag = response.data['etag']
+        assert_equal(response.data['value'], [1, None])
+
+        self.request.headers['If-None-Match'] = etag
+        response = self.adapter.get('status/hdf/frames_written', self.request)
+        assert_equal(response.data, {'etag': etag, 'not_modified': True})
+
+        # A repeated status with only a new timestamp leaves the version unchanged
+        self.status_reply(client, 1)
+        response = self.adapter.get('status/hdf/frames_written', self.request)
+        assert_true(response.data['not_modified'])
+
+        self.status_reply(client, 2)
+        response = self.adapter.get('status/hdf/frames_written', self.request)
+        assert_equal(response.data['value'], [2, None])
+        assert_true(response.data['etag'] != etag)
+
+
+class TestMetaListenerAdapterVersions:
+
+    def setup(self):
+        self.adapter = MetaListenerAdapter(endpoints="127.0.0.1:15000")
+        client = self.adapter._clients[0]
+        client.ctrl_channel._monitor_stream.close()
+        client.ctrl_channel._stream.close()
+        client.ctrl_channel = Mock()
+        self.request = Mock()
+        self.request.headers = {'Accept': 'application/json', 'Content-Type': 'application/json'}
+
+    def test_readback_versioned(self):
+        adapter = self.adapter
+        client = adapter._clients[0]
+        adapter.acquisitionID = 'acq'
+        client.parameters['status'] = {'acquisitions': {'acq': {'filename': 'a.h5', 'num_processors': 1,
+                                                                'writing': True, 'written': 5}}}
+        response = adapter.get('status/written', self.request)
+        etag = response.data['etag']
+        assert_equal(response.data['value'], 0)
+
+        # The readback copy changes without a new status reply
+        adapter.process_updates()
+        self.request.headers['If-None-Match'] = etag
+        response = adapter.get('status/written', self.request)
+        assert_equal(response.data['value'], 5)
+        assert_true(response.data['etag'] != etag)
+
+        adapter.process_updates()
+        self.request.headers['If-None-Match'] = response.data['etag']
+        assert_true(adapter.get('status/written', self.request).data['not_modified'])
@@ -0,0 +1,105 @@
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy
+import zmq
+from nose.tools import assert_equal, assert_true
+
+from odin_data.ipc_message import IpcMessage
+from odin_data.meta_writer.frame_publisher import decode_frame_records
+from odin_data.meta_writer.sharded_meta_listener import ShardedMetaListener, shard_endpoint
+
+
+def test_shard_endpoint():
+    assert_equal(shard_endpoint('tcp://*:5000', 1), 'tcp://*:5001')
+    assert_equal(shard_endpoint('ipc:///tmp/meta', 1), 'ipc:///tmp/meta_1')
+    assert_equal(shard_endpoint('', 1), '')
+
+
+class TestShardedMetaListener:
+
+    def setup(self):
+        base = 'ipc://{}/test_sharded_meta_listener_{}'.format(tempfile.gettempdir(), os.getpid())
+        self.input_endpoint = base + '_input'
+        self.ctrl_endpoint = base + '_ctrl'
+        self.context = zmq.Context()
+        self.publisher = self.context.socket(zmq.PUB)
+        self.publisher.bind(self.input_endpoint)
+        self.listener = ShardedMetaListener('/tmp', self.input_endpoint, self.ctrl_endpoint,
+                                            'odin_data.testing.test_meta_listener.RecordingWriter', 2)
+        self.thread = threading.Thread(target=self.listener.run)
+        self.thread.start()
+        self.ctrl = self.context.socket(zmq.DEALER)
+        self.ctrl.connect(self.ctrl_endpoint)
+        self.msg_id = 0
+
+    def teardown(self):
+        self.send('configure', {'kill': True})
+        self.thread.join()
+        self.ctrl.close(linger=0)
+        self.publisher.close(linger=0)
+        self.context.term()
+        publish = [self.input_endpoint + '_publish_' + str(shard) for shard in range(2)]
+        for endpoint in [self.input_endpoint, self.ctrl_endpoint] + publish:
+            if os.path.exists(endpoint[len('ipc://'):]):
+                os.remove(endpoint[len('ipc://'):])
+
+    def send(self, msg_val, params=None):
+        self.msg_id += 1
+        message = IpcMessage('cmd', msg_val, id=self.msg_id)
+        for key, value in (params or {}).items():
+            message.set_param(key, value)
+        self.ctrl.send(message.encode())
+        assert_true(self.ctrl.poll(5000))
+        return IpcMessage(from_str=self.ctrl.recv())
+
+    def test_acquisitions_sharded(self):
+        assert_equal(self.send('configure', {'acquisition_id': 'a', 'flush': 10}).get_msg_type(), IpcMessage.ACK)
+        assert_equal(self.send('configure', {'acquisition_id': 'b', 'flush': 10}).get_msg_type(), IpcMessage.ACK)
+        status = self.send('status')
+        assert_equal(sorted(status.get_param('acquisitions')), ['a', 'b'])
+        shards = status.get_param('shards')
+        assert_equal([shard['acquisitions'] for shard in shards], [['a'], ['b']])
+        assert_true(all(shard['alive'] for shard in shards))
+
+        # Messages are routed to the shard of their acquisition
+        deadline = time.time() + 5.0
+        received = 0
+        while received == 0 and time.time() < deadline:
+            self.publisher.send_multipart([json.dumps({
+                'header': {'acqID': 'b', 'frame': 0}, 'plugin': 'p', 'parameter': 'x'
+            }).encode(), b''])
+            time.sleep(0.05)
+            acquisition = self.send('status').get_param('acquisitions')['b']
+            received = acquisition['frame_sequence']['received']
+        assert_true(received > 0)
+        assert_equal(self.send('status').get_param('acquisitions')['a']['frame_sequence']['received'], 0)
+
+    def test_publish_on_shards(self):
+        publish = self.input_endpoint + '_publish'
+        reply = self.send('configure', {'publish': publish, 'publish_interval': 0})
+        assert_equal(reply.get_msg_type(), IpcMessage.ACK)
+        endpoints = self.send('request_configuration').get_param('publish_shards')
+        assert_equal(endpoints, [publish + '_0', publish + '_1'])
+        self.send('configure', {'acquisition_id': 'a'})
+        self.send('configure', {'acquisition_id': 'b'})
+
+        # Each shard publishes the acquisitions it writes on its own endpoint
+        subscriber = self.context.socket(zmq.SUB)
+        subscriber.connect(endpoints[1])
+        subscriber.setsockopt(zmq.SUBSCRIBE, b'')
+        deadline = time.time() + 5.0
+        frame = 0
+        while not subscriber.poll(50) and time.time() < deadline:
+            self.publisher.send_multipart([json.dumps({
+                'header': {'acqID': 'b', 'frame': frame}, 'plugin': 'p', 'parameter': 'x', 'type': 'integer'
+            }).encode(), numpy.int32(frame).tobytes()])
+            frame += 1
+        assert_true(subscriber.poll(0))
+        header, _ = decode_frame_records(subscriber.recv_multipart())
+        assert_equal(header['acquisition_id'], 'b')
+        assert_true('publisher' in self.send('status').get_param('shards')[1])
+        subscriber.close(linger=0)
@@ -0,0 +1,126 @@
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+import h5py
+import numpy
+from nose.tools import assert_equal, assert_raises, assert_true
+
+from odin_data.meta_writer.meta_writer import MetaWriter
+from odin_data.meta_writer.storage import Hdf5Storage, NpyDataset, convert_to_hdf5
+from odin_data.meta_writer.storage_benchmark import run_storage_benchmark
+
+if sys.version_info[0] == 3:  # pragma: no cover
+    from unittest.mock import patch
+else:                         # pragma: no cover
+    from mock import patch
+
+
+class TestNpyDataset:
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'position.npy')
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_grow_and_trim(self):
+        dataset = NpyDataset(self.file_name, (0, 2), (None, 2), 'float32', -1)
+        dataset.resize((3, 2))
+        dataset[0:2] = [[1, 2], [3, 4]]
+        assert_equal(dataset.shape, (3, 2))
+        assert_equal(dataset[2].tolist(), [-1, -1])
+
+        # Growing beyond the reserved space remaps the file
+        dataset.resize((5000, 2))
+        dataset[4999] = [5, 6]
+        dataset.flush()
+        assert_equal(numpy.load(self.file_name, mmap_mode='r').shape, (5000, 2))
+
+        dataset.resize((3, 2))
+        dataset.close()
+        values = numpy.load(self.file_name)
+        assert_equal(values.dtype, numpy.dtype('float32'))
+        assert_equal(values.tolist(), [[1, 2], [3, 4], [-1, -1]])
+
+    def test_maxshape(self):
+        dataset = NpyDataset(self.file_name, (0,), (4,), 'uint8', 0)
+        assert_raises(ValueError, dataset.resize, (5,))
+        dataset.close()
+
+
+class TestHdf5Storage:
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.directory, 'test_meta.h5')
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def write_and_close(self, swmr):
+        with patch('odin_data.meta_writer.storage.h5py.File', wraps=h5py.File) as h5py_file:
+            storage = Hdf5Storage(self.file_name)
+            storage.create_dataset('frame', data=numpy.arange(3))
+            if swmr:
+                storage.enable_swmr()
+            storage.write_attributes({'frame_sequences': {'missing': 1}})
+            storage.write_dataset('frame_table', numpy.arange(2))
+            storage.close()
+        with h5py.File(self.file_name, 'r') as meta_file:
+            assert_equal(meta_file['frame_sequences'].attrs['missing'], 1)
+            assert_equal(meta_file['frame_table'][:].tolist(), [0, 1])
+        return h5py_file.call_count
+
+    def test_written_before_close(self):
+        # The file is only reopened to add objects if it is in SWMR mode, and then only once
+        assert_equal(self.write_and_close(False), 1)
+        assert_equal(self.write_and_close(True), 2)
+
+
+class TestNpyStorage:
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.writer = MetaWriter(logging.getLogger('test'), self.directory, 'test_acq')
+        self.writer.storage = 'npy'
+        self.writer.flush_frequency = 3
+        self.writer.add_dataset_definition('frame', (0,), (None,), 'int64', -1)
+        self.writer.add_dataset_definition('exposure', (0,), (None,), 'float64', -1.0, indexed=True)
+
+    def teardown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_and_convert(self):
+        self.writer.create_file()
+        self.writer.create_dataset_with_data('config', numpy.arange(4), (2, 2))
+        self.writer.add_dataset_values('frame', numpy.arange(5))
+        self.writer.add_frame_values('exposure', [2, 0], [2.0, 0.0])
+        for frame in [0, 1, 3]:
+            self.writer.update_frame_sequence((0, 'plugin', 'frame'), frame)
+        self.writer.close_file()
+
+        meta_directory = os.path.join(self.directory, 'test_acq_meta')
+        assert_equal(self.writer.full_file_name, meta_directory)
+        assert_equal(numpy.load(os.path.join(meta_directory, 'frame.npy')).tolist(), list(range(5)))
+        assert_equal(numpy.load(os.path.join(meta_directory, 'exposure.npy')).tolist(), [0.0, -1.0, 2.0])
+        with open(os.path.join(meta_directory, 'attributes.json')) as json_file:
+            assert_equal(json.load(json_file)['frame_sequences']['missing'], 1)
+
+        file_name = os.path.join(self.directory, 'test_acq_meta.h5')
+        convert_to_hdf5(meta_directory, file_name)
+        with h5py.File(file_name, 'r') as meta_file:
+            assert_equal(meta_file['frame'][:].tolist(), list(range(5)))
+            assert_equal(meta_file['exposure_written'][:].tolist(), [1, 0, 1])
+            assert_equal(meta_file['config'].shape, (2, 2))
+            assert_equal(meta_file['frame_sequences/input0/plugin/frame'].attrs['received'], 3)
+
+    def test_benchmark(self):
+        for storage in ['hdf5', 'npy']:
+            result = run_storage_benchmark(storage, 1000, flush_frequency=100, batch_size=10)
+            assert_equal(result['values'], 1000)
+            assert_true(result['rate'] > 0)
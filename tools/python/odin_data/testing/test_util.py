@@ -1,7 +1,13 @@
+import sys
 import unittest
 
 from odin_data.util import *
 
+if sys.version_info[0] == 3:  # pragma: no cover
+    from unittest.mock import Mock
+else:                         # pragma: no cover
+    from mock import Mock
+
 
 class UtilTest(unittest.TestCase):
 
@@ -20,3 +26,33 @@ class UtilTest(unittest.TestCase):
         result = remove_suffix(test, "/0")
 
         self.assertEqual(expected, result)
+
+    def test_parameter_versions(self):
+        versions = ParameterVersions()
+        self.assertEqual(versions.version(), 0)
+
+        versions.bump('status')
+        self.assertEqual(versions.version('status/frames'), 1)
+        self.assertEqual(versions.version('config'), 0)
+        self.assertEqual(versions.version(), 1)
+
+        versions.bump()
+        self.assertEqual(versions.version('config'), 2)
+        self.assertEqual(versions.version('status'), 2)
+
+        etag = versions.etag('status', 7)
+        self.assertTrue(etag.startswith('"') and etag.endswith('-2-7"'))
+        self.assertNotEqual(etag, ParameterVersions().etag('status', 7))
+
+    def test_etag_matches(self):
+        request = Mock()
+        request.headers = {}
+        self.assertFalse(etag_matches(request, '"a-1"'))
+        self.assertFalse(etag_matches(None, '"a-1"'))
+
+        request.headers = {'If-None-Match': '"a-0", W/"a-1"'}
+        self.assertTrue(etag_matches(request, '"a-1"'))
+        self.assertFalse(etag_matches(request, '"a-2"'))
+
+        request.headers = {'If-None-Match': '*'}
+        self.assertTrue(etag_matches(request, '"a-2"'))
@@ -0,0 +1,127 @@
+import logging
+
+from nose.tools import assert_equal, assert_false, assert_true, assert_raises
+
+from odin_data.meta_writer.meta_writer import MetaWriter
+from odin_data.meta_writer.writer_registry import AcquisitionWriters, WriterRegistry
+
+
+class VersionedWriter(MetaWriter):
+    """Meta writer counting the instances created and versions requested."""
+
+    instances = 0
+    version_requests = 0
+
+    def __init__(self, logger, directory, acquisition_id):
+        super(VersionedWriter, self).__init__(logger, directory, acquisition_id)
+        VersionedWriter.instances += 1
+
+    @staticmethod
+    def get_version():
+        VersionedWriter.version_requests += 1
+        return {'full': '1.2.3'}
+
+    def stop(self):
+        self.finished = True
+
+
+class NotAWriter(object):
+    """Class without the methods of a writer."""
+
+
+class TestWriterRegistry:
+
+    WRITER = 'odin_data.testing.test_writer_registry.VersionedWriter'
+
+    def setup(self):
+        VersionedWriter.instances = 0
+        VersionedWriter.version_requests = 0
+        self.registry = WriterRegistry(logging.getLogger('test_writer_registry'))
+
+    def test_class_cached(self):
+        writer_class = self.registry.writer_class(self.WRITER)
+        assert_true(writer_class is VersionedWriter)
+        assert_true(self.registry.writer_class(self.WRITER) is writer_class)
+        assert_equal(list(self.registry._classes), [self.WRITER])
+
+    def test_invalid_class(self):
+        assert_raises(Exception, self.registry.writer_class, None)
+        assert_raises(Exception, self.registry.writer_class,
+                      'odin_data.testing.test_writer_registry.NotAWriter')
+        assert_raises(AttributeError, self.registry.writer_class,
+                      'odin_data.testing.test_writer_registry.Missing')
+
+    def test_version_cached(self):
+        assert_equal(self.registry.writer_version(self.WRITER), {'full': '1.2.3'})
+        assert_equal(self.registry.writer_version(self.WRITER), {'full': '1.2.3'})
+        assert_equal(VersionedWriter.version_requests, 1)
+
+    def test_prewarmed_writer_assigned(self):
+        self.registry.prewarm(self.WRITER, '/tmp')
+        self.registry.prewarm(self.WRITER, '/tmp')
+        assert_equal(VersionedWriter.instances, 1)
+        assert_equal(self.registry.spares(), [self.WRITER])
+
+        writer = self.registry.create_writer(self.WRITER, '/data', 'acq')
+        assert_equal(VersionedWriter.instances, 1)
+        assert_equal(writer.directory, '/data')
+        assert_equal(writer._acquisition_id, 'acq')
+        assert_equal(self.registry.spares(), [])
+
+        self.registry.create_writer(self.WRITER, '/data', 'next')
+        assert_equal(VersionedWriter.instances, 2)
+
+
+class TestAcquisitionWriters:
+
+    def setup(self):
+        self.logger = logging.getLogger('test_writer_registry')
+        self.writers = AcquisitionWriters(max_finished=1, max_open=2)
+
+    def add(self, acquisition_id, file_created=False, finished=False):
+        writer = VersionedWriter(self.logger, '/tmp', acquisition_id)
+        writer.file_created = file_created
+        writer.finished = finished
+        self.writers[acquisition_id] = writer
+        return writer
+
+    def test_least_recently_used_order(self):
+        for acquisition_id in ['a', 'b', 'c']:
+            self.add(acquisition_id)
+        self.writers.touch('a')
+        assert_equal(self.writers.keys(), ['b', 'c', 'a'])
+        assert_true('b' in self.writers)
+        del self.writers['b']
+        assert_equal(len(self.writers), 2)
+
+    def test_finished_writers_evicted(self):
+        self.add('a', finished=True)
+        self.add('b', finished=True)
+        self.add('c')
+        # Only the most recently used finished writer is kept
+        assert_equal(self.writers.keys(), ['b', 'c'])
+        assert_equal(self.writers.status()['evicted'], 1)
+
+    def test_writers_to_close(self):
+        for acquisition_id in ['a', 'b', 'c']:
+            self.add(acquisition_id, file_created=True).number_processes_running = 1
+        self.writers['b'].number_processes_running = 0
+        self.writers.touch('a')
+
+        # Writers that frame processors are writing to are never closed
+        assert_equal(self.writers.writers_to_close(idle_timeout=60.0), [])
+        to_close = self.writers.writers_to_close(idle_timeout=0.0)
+        assert_equal([(key, reason) for key, _, reason in to_close], [('b', 'idle')])
+        self.writers['c'].number_processes_running = 0
+        to_close = self.writers.writers_to_close(idle_timeout=0.0)
+        assert_equal([(key, reason) for key, _, reason in to_close], [('b', 'idle'), ('c', 'idle')])
+        assert_equal(self.writers.status()['open'], 3)
+
+    def test_full(self):
+        self.add('a')
+        assert_false(self.writers.full())
+        self.add('b', file_created=True)
+        self.add('c').number_processes_running = 1
+        assert_true(self.writers.full())
+        self.writers['b'].finished = True
+        assert_false(self.writers.full())
@@ -1,4 +1,5 @@
 import re
+import time
 
 
 def remove_prefix(string, prefix):
@@ -7,3 +8,79 @@ def remove_prefix(string, prefix):
 
 def remove_suffix(string, suffix):
     return re.sub("{}$".format(suffix), "", string)
+
+
+class ParameterVersions(object):
+    """Monotonically increasing versions for the subtrees of a parameter tree.
+
+    Each change to a subtree assigns it the next value of a single counter, so the version of
+    any subtree, or of the whole tree, only ever increases.  The versions are prefixed with a
+    token unique to this instance when formatted as an ETag, so tags issued before a restart
+    never match.
+    """
+
+    def __init__(self):
+        self._token = '{:x}'.format(int(time.time() * 1000000))
+        self._counter = 0
+        self._all = 0
+        self._versions = {}
+
+    def bump(self, *subtrees):
+        """Record a change to the named top level subtrees, or to the whole tree if none given.
+
+        :param subtrees: names of the subtrees that have changed
+        """
+        self._counter += 1
+        if subtrees:
+            for subtree in subtrees:
+                self._versions[subtree] = self._counter
+        else:
+            self._all = self._counter
+
+    def version(self, path=''):
+        """Return the version of the subtree containing a path.
+
+        :param path: URI path within the parameter tree, the whole tree if empty
+        :return: version number
+        """
+        subtree = path.strip('/').split('/')[0]
+        if not subtree:
+            return self._counter
+        return max(self._versions.get(subtree, 0), self._all)
+
+    def etag(self, path='', *versions):
+        """Format the version of a path as an ETag, with any additional versions appended.
+
+        :param path: URI path within the parameter tree
+        :param versions: additional versions that the response depends on
+        :return: quoted ETag string
+        """
+        tags = [self._token, str(self.version(path))] + [str(version) for version in versions]
+        return '"{}"'.format('-'.join(tags))
+
+
+def etag_matches(request, etag):
+    """Check if the If-None-Match header of a request matches an ETag.
+
+    :param request: Tornado HTTP request object, may be None
+    :param etag: current ETag of the requested resource
+    :return: True if the client already holds the current version of the resource
+    """
+    headers = getattr(request, 'headers', None)
+    if not headers:
+        return False
+    if_none_match = headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+    return '*' in tags or etag in tags
+
+
+def not_modified_response(etag):
+    """Build the response body returned when a conditional GET matches the current version.
+
+    :param etag: current ETag of the requested resource
+    :return: response dict
+    """
+    return {'etag': etag, 'not_modified': True}
@@ -22,6 +22,7 @@ setup(name='odin_data',
             'frame_producer = frame_producer.frame_producer:main',
             'frame_receiver_client = odin_data.frame_receiver.client:main',
             'meta_writer = odin_data.meta_writer.meta_writer_app:main',
+            'meta_journal_replay = odin_data.meta_writer.journal_replay:main',
          ]
       },
       zip_safe=False,
@@ -82,8 +82,8 @@ var LiveViewApp = (function()
         // Retrieve API data and populate controls
         $.getJSON(api_url, function (response)
         {
-            buildColormapSelect(response.colormap_selected, response.colormap_options);
-            updateClipRange(response.data_min_max, true);
+            buildColormapSelect(response.value.colormap_selected, response.value.colormap_options);
+            updateClipRange(response.value.data_min_max, true);
             changeClipEnable();
         });
 
@@ -222,7 +222,7 @@ var LiveViewApp = (function()
 
         $.getJSON(api_url + "data_min_max", function(response)
         {
-            updateClipRange(response.data_min_max, !clip_enable);
+            updateClipRange(response.value.data_min_max, !clip_enable);
         });
     };
 